@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+"""
+Generates synthetic cluster database (``db.json``).
+
+Usage::
+
+    python -m benchmarks.dbgen --providers 10 --nodes 50 db.json
+"""
+import argparse
+import json
+import socket
+import uuid
+
+NODE_TYPES = ["ldap", "oxauth", "oxtrust", "oxidp", "nginx"]
+
+WEAVE_IP_NETWORK = "10.2.0.0/16"
+
+
+def generate_database(path, providers=1, nodes=5, hostname=None):
+    """Writes a database of a cluster with ``providers`` providers,
+    each running ``nodes`` nodes of every type in turn.
+
+    The first (master) provider is named after ``hostname`` (FQDN of
+    the machine by default), so it's picked as the local provider.
+    """
+    data = {
+        "clusters": {
+            "1": {
+                "id": "cluster-1",
+                "ox_cluster_hostname": "bench.example.com",
+                "weave_ip_network": WEAVE_IP_NETWORK,
+            },
+        },
+        "providers": {},
+        "nodes": {},
+    }
+
+    node_count = 0
+    for provider_num in range(providers):
+        provider_id = "provider-{}".format(provider_num + 1)
+        data["providers"][str(provider_num + 1)] = {
+            "id": provider_id,
+            "type": "master" if provider_num == 0 else "consumer",
+            "hostname": (hostname or socket.getfqdn()) if provider_num == 0
+            else "host-{}.bench.example.com".format(provider_num + 1),
+        }
+
+        for num in range(nodes):
+            node_count += 1
+            node_type = NODE_TYPES[num % len(NODE_TYPES)]
+            weave_ip = "10.2.{}.{}".format(node_count // 250,
+                                           node_count % 250 + 1)
+
+            data["nodes"][str(node_count)] = {
+                "id": uuid.uuid4().hex + uuid.uuid4().hex,
+                "name": "{}_{}".format(node_type, node_count),
+                "type": node_type,
+                "state": "SUCCESS",
+                "provider_id": provider_id,
+                "cluster_id": "cluster-1",
+                "weave_ip": weave_ip,
+                "weave_prefixlen": 16,
+                "domain_name": "{}.{}.gluu.local".format(node_count,
+                                                         node_type),
+            }
+
+    with open(path, "w") as fp:
+        json.dump(data, fp)
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("path", help="path to database file")
+    parser.add_argument("--providers", type=int, default=1,
+                        help="number of providers (default to 1)")
+    parser.add_argument("--nodes", type=int, default=5,
+                        help="number of nodes per provider (default to 5)")
+    parser.add_argument("--hostname", default=None,
+                        help="hostname of master provider "
+                             "(default to FQDN of the machine)")
+    args = parser.parse_args()
+    generate_database(args.path, args.providers, args.nodes, args.hostname)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+"""
+Measures the per-call cost of decrypting cluster secret (weave password)
+with M2Crypto, the pure-Python cipher and the in-memory secret cache.
+
+Usage::
+
+    python -m benchmarks.decrypt [--calls 1000]
+"""
+import argparse
+import base64
+import json
+import subprocess
+import sys
+import time
+
+from gluuagent.des import triple_des_decrypt
+from gluuagent.secrets import SecretCache
+
+KEY = "123456789012345678901234"
+
+ENC_TEXT = "im6yqa0BROeTNcwvx4XCaw=="
+
+
+def m2crypto_decrypt(encrypted_text, key):
+    from M2Crypto.EVP import Cipher
+
+    cipher = Cipher(alg="des_ede3_ecb", key=key, op=0, iv="\0" * 16)
+    return cipher.update(base64.b64decode(encrypted_text)) + cipher.final()
+
+
+def pure_decrypt(encrypted_text, key):
+    return triple_des_decrypt(base64.b64decode(encrypted_text), key)
+
+
+def measure_import(module):
+    """Measures import time of ``module`` in a fresh interpreter;
+    returns ``None`` if it's not installed.
+    """
+    code = ("import time; started = time.time(); import {}; "
+            "print(time.time() - started)".format(module))
+    proc = subprocess.Popen([sys.executable, "-c", code],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, _ = proc.communicate()
+    if proc.returncode:
+        return None
+    return float(stdout)
+
+
+def counted(func):
+    """Wraps ``func`` to count its calls in ``calls`` attribute.
+    """
+    def wrapper(*args):
+        wrapper.calls += 1
+        return func(*args)
+    wrapper.calls = 0
+    return wrapper
+
+
+def measure_call(func, calls):
+    started = time.time()
+    for _ in range(calls):
+        func(ENC_TEXT, KEY)
+    return (time.time() - started) / calls
+
+
+def run_benchmark(calls=1000):
+    """Returns import and per-call time (in seconds) of each backend,
+    and how many times the secret is actually decrypted.
+    """
+    pure = counted(pure_decrypt)
+    cached = counted(pure_decrypt)
+    cache = SecretCache(decrypt=cached)
+    results = {
+        "pure-python": {
+            "import": measure_import("gluuagent.des"),
+            "call": measure_call(pure, calls),
+            "decrypts": pure.calls,
+        },
+        "cached": {
+            "import": None,
+            "call": measure_call(cache.get, calls),
+            "decrypts": cached.calls,
+        },
+    }
+    if measure_import("M2Crypto.EVP") is not None:
+        m2crypto = counted(m2crypto_decrypt)
+        results["m2crypto"] = {
+            "import": measure_import("M2Crypto.EVP"),
+            "call": measure_call(m2crypto, calls),
+            "decrypts": m2crypto.calls,
+        }
+    return results
+
+
+def format_report(results):
+    lines = ["{:<14}{:>14}{:>14}".format("backend", "import (ms)",
+                                         "per call (us)")]
+    for name in sorted(results):
+        result = results[name]
+        lines.append("{:<14}{:>14}{:>14.1f}".format(
+            name,
+            "-" if result["import"] is None
+            else "{:.1f}".format(result["import"] * 1000),
+            result["call"] * 1000000,
+        ))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--calls", type=int, default=1000,
+                        help="number of calls per backend (default to 1000)")
+    parser.add_argument("--json", action="store_true",
+                        help="print the result as JSON")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.calls)
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print(format_report(results))
+
+
+if __name__ == "__main__":
+    main()
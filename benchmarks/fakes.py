@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+"""
+Simulated docker engine and weave backends with configurable latency.
+"""
+import BaseHTTPServer
+import SocketServer
+import datetime
+import json
+import os
+import re
+import stat
+import threading
+import time
+import urllib
+import urlparse
+import uuid
+from collections import Counter
+
+# fake commands put in front of ``PATH``; every call is appended
+# to ``$GLUU_BENCH_CALLS``
+FAKE_COMMANDS = {
+    # only ``docker exec -i <container> <cmd>`` is supported
+    "docker": """#!/bin/sh
+echo "docker $1" >> "$GLUU_BENCH_CALLS"
+sleep "$GLUU_BENCH_DOCKER_LATENCY"
+shift 3
+exec "$@"
+""",
+    "weave": """#!/bin/sh
+echo "weave $1" >> "$GLUU_BENCH_CALLS"
+sleep "$GLUU_BENCH_WEAVE_LATENCY"
+""",
+    # runs inside the exec'd shell
+    "supervisorctl": """#!/bin/sh
+echo "$2 RUNNING pid 1, uptime 0:00:01"
+""",
+}
+
+# layers of every pulled image
+IMAGE_LAYERS = 3
+
+
+def timestamp():
+    return datetime.datetime.utcnow().isoformat() + "Z"
+
+
+class CallCounter(object):
+    def __init__(self):
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+
+class FakeDockerEngine(CallCounter):
+    """Serves the subset of docker remote API used by the agent
+    over a unix socket; every call takes ``latency`` seconds.
+    """
+
+    routes = [
+        ("GET", r"/containers/json$", "containers_list"),
+        ("GET", r"/containers/(?P<id>[^/]+)/json$", "container_inspect"),
+        ("POST", r"/containers/(?P<id>[^/]+)/restart$", "container_restart"),
+        ("POST", r"/containers/(?P<id>[^/]+)/stop$", "container_stop"),
+        ("POST", r"/containers/(?P<id>[^/]+)/exec$", "exec_create"),
+        ("POST", r"/exec/(?P<id>[^/]+)/start$", "exec_start"),
+        ("GET", r"/exec/(?P<id>[^/]+)/json$", "exec_inspect"),
+        ("GET", r"/images/(?P<name>.+)/json$", "image_inspect"),
+        ("POST", r"/images/create$", "image_pull"),
+    ]
+
+    def __init__(self, socket_path, latency=0):
+        super(FakeDockerEngine, self).__init__()
+        self.socket_path = socket_path
+        self.base_url = "unix://" + socket_path
+        self.latency = latency
+        self.containers = {}
+        self.images = {}
+        self._server = None
+
+    def add_container(self, container_id, name=None, image="sha256:old",
+                      running=False):
+        self.containers[container_id] = {
+            "Id": container_id,
+            "Name": "/" + (name or container_id[:12]),
+            "Image": image,
+            "Running": running,
+            "StartedAt": timestamp(),
+        }
+
+    def find_container(self, container):
+        for meta in self.containers.values():
+            if container in (meta["Id"], meta["Id"][:12], meta["Name"][1:]):
+                return meta
+
+    def start(self):
+        engine = self
+
+        class Handler(DockerHandler):
+            pass
+
+        Handler.engine = engine
+        self._server = ThreadingUnixServer(self.socket_path, Handler)
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        os.unlink(self.socket_path)
+
+
+class ThreadingUnixServer(SocketServer.ThreadingMixIn,
+                          SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class JSONHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self):
+        return "local"
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data) if data is not None else ""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else ""
+
+
+class DockerHandler(JSONHandler):
+    engine = None
+
+    def dispatch(self):
+        url = urlparse.urlparse(self.path)
+        # strip API version, e.g. ``/v1.21``
+        path = re.sub(r"^/v[\d.]+", "", url.path)
+        self.params = dict(urlparse.parse_qsl(url.query))
+        self.read_body()
+
+        for method, pattern, name in self.engine.routes:
+            match = re.match(pattern, path)
+            if method == self.command and match:
+                self.engine.count(name)
+                time.sleep(self.engine.latency)
+                kwargs = dict((key, urllib.unquote_plus(value))
+                              for key, value in match.groupdict().items())
+                return getattr(self, name)(**kwargs)
+        self.send_json({"message": "page not found"}, 404)
+
+    do_GET = do_POST = dispatch
+
+    def containers_list(self):
+        self.send_json([{
+            "Id": meta["Id"],
+            "Names": [meta["Name"]],
+            "Image": meta["Image"],
+            "State": "running" if meta["Running"] else "exited",
+            "Status": "Up 1 second" if meta["Running"] else "Exited (0)",
+        } for meta in self.engine.containers.values()])
+
+    def container_inspect(self, id):
+        meta = self.engine.find_container(id)
+        if not meta:
+            return self.send_json({"message": "no such container"}, 404)
+        self.send_json({
+            "Id": meta["Id"],
+            "Name": meta["Name"],
+            "Image": meta["Image"],
+            "State": {"Running": meta["Running"],
+                      "StartedAt": meta["StartedAt"]},
+        })
+
+    def container_restart(self, id):
+        self._set_running(id, True)
+
+    def container_stop(self, id):
+        self._set_running(id, False)
+
+    def _set_running(self, container, running):
+        meta = self.engine.find_container(container)
+        if not meta:
+            return self.send_json({"message": "no such container"}, 404)
+        meta["Running"] = running
+        if running:
+            meta["StartedAt"] = timestamp()
+        self.send_json(None, 204)
+
+    def exec_create(self, id):
+        self.send_json({"Id": uuid.uuid4().hex})
+
+    def exec_start(self, id):
+        self.send_json("")
+
+    def exec_inspect(self, id):
+        self.send_json({"ExitCode": 0})
+
+    def image_inspect(self, name):
+        meta = self.engine.images.get(name)
+        if not meta:
+            return self.send_json({"message": "no such image"}, 404)
+        self.send_json(meta)
+
+    def image_pull(self):
+        image = self.params["fromImage"]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        events = []
+        for layer in range(IMAGE_LAYERS):
+            events.append({"status": "Pulling fs layer", "id": str(layer)})
+        for layer in range(IMAGE_LAYERS):
+            events.append({"status": "Pull complete", "id": str(layer)})
+        events.append({"status": "Status: Downloaded newer image "
+                                 "for {}".format(image)})
+
+        for event in events:
+            # each layer takes time to download
+            if event["status"] == "Pull complete":
+                time.sleep(self.engine.latency)
+            chunk = json.dumps(event) + "\r\n"
+            self.wfile.write("{:x}\r\n{}\r\n".format(len(chunk), chunk))
+        self.wfile.write("0\r\n\r\n")
+
+        digest = "sha256:" + uuid.uuid4().hex
+        self.engine.images[image] = {
+            "Id": "sha256:" + uuid.uuid4().hex,
+            "RepoDigests": ["{}@{}".format(image, digest)],
+        }
+
+
+class FakeWeaveRouter(CallCounter):
+    """Serves weaveDNS endpoints of weave router's HTTP API; the port
+    is picked by the OS if ``port`` is 0.
+    """
+
+    def __init__(self, host, port, latency=0):
+        super(FakeWeaveRouter, self).__init__()
+        self.address = (host, port)
+        self.latency = latency
+        self.entries = {}
+        self._server = None
+
+    def start(self):
+        router = self
+
+        class Handler(JSONHandler):
+            def do_GET(self):
+                router.count("report")
+                time.sleep(router.latency)
+                self.send_json({"DNS": {"Entries": [
+                    {"ContainerID": container_id, "Address": ip,
+                     "Hostname": fqdn + ".", "Tombstone": 0}
+                    for container_id, ip, fqdn in router.entries
+                ]}})
+
+            def do_PUT(self):
+                router.count("dns_add")
+                time.sleep(router.latency)
+                _, _, container_id, ip = self.path.split("/")
+                fqdn = urlparse.parse_qs(self.read_body())["fqdn"][0]
+                router.entries[(container_id, ip, fqdn)] = True
+                self.send_json(None, 204)
+
+            def do_DELETE(self):
+                router.count("dns_remove")
+                time.sleep(router.latency)
+                url = urlparse.urlparse(self.path)
+                _, _, container_id, ip = url.path.split("/")
+                fqdn = urlparse.parse_qs(url.query)["fqdn"][0]
+                router.entries.pop((container_id, ip, fqdn), None)
+                self.send_json(None, 204)
+
+        self._server = ThreadingTCPServer(self.address, Handler)
+        # actual port if an ephemeral one is requested
+        self.address = self._server.server_address
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class ThreadingTCPServer(SocketServer.ThreadingMixIn,
+                         BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def install_fake_commands(bin_dir, calls_file, docker_latency=0,
+                          weave_latency=0):
+    """Writes fake ``docker``, ``weave`` and ``supervisorctl`` commands
+    into ``bin_dir`` and puts them in front of ``PATH``.
+    """
+    for name, script in FAKE_COMMANDS.items():
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as fp:
+            fp.write(script)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+    open(calls_file, "w").close()
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+    os.environ["GLUU_BENCH_CALLS"] = calls_file
+    os.environ["GLUU_BENCH_DOCKER_LATENCY"] = str(docker_latency)
+    os.environ["GLUU_BENCH_WEAVE_LATENCY"] = str(weave_latency)
+
+
+def read_command_calls(calls_file):
+    """Counts calls of fake commands by their subcommand,
+    e.g. ``weave attach``.
+    """
+    with open(calls_file) as fp:
+        return Counter(line.strip() for line in fp if line.strip())
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+"""
+Runs recovery or image update end to end against simulated docker
+engine and weave, reporting wall time, backend calls and peak memory.
+
+Usage::
+
+    python -m benchmarks.recovery --providers 10 --nodes 50 \\
+        --docker-latency 5 --weave-latency 20
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+from gluuagent import executors
+from gluuagent.constants import PULL_WORKERS
+from gluuagent.constants import RECOVERY_WORKERS
+from gluuagent.constants import WEAVE_HTTP_HOST
+from gluuagent.database import Database
+from gluuagent.tasks import ImageUpdateTask
+from gluuagent.tasks import RecoveryTask
+from gluuagent.utils import get_local_hostnames
+from gluuagent.utils import get_logger
+from gluuagent.weave import WeaveClient
+
+from .dbgen import generate_database
+from .fakes import FakeDockerEngine
+from .fakes import FakeWeaveRouter
+from .fakes import install_fake_commands
+from .fakes import read_command_calls
+
+TASKS = ("recover", "update-images")
+
+
+class PortListener(object):
+    """Accepts (and closes) TCP connections, e.g. for LDAP readiness
+    probe. An ephemeral port is used if ``port`` is omitted.
+    """
+
+    def __init__(self, host, port=0):
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(128)
+        self.port = self.sock.getsockname()[1]
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                return
+            conn.close()
+
+    def stop(self):
+        # wakes up the blocking ``accept`` so the port is released
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+
+
+class LocalLdapProbe(object):
+    """Makes LDAP readiness probe connect to ``host`` and ``port`` (e.g.
+    where ``PortListener`` listens) instead of node's weave IP, which is
+    not routable without weave router, until stopped.
+    """
+
+    def __init__(self, host, port):
+        self.original = executors.port_probe
+        executors.port_probe = (
+            lambda addr, _, timeout=1: self.original(host, port, timeout)
+        )
+
+    def stop(self):
+        executors.port_probe = self.original
+
+
+def run_benchmark(task="recover", providers=1, nodes=20, running=0.0,
+                  docker_latency=0.0, weave_latency=0.0,
+                  workers=RECOVERY_WORKERS, pull_workers=PULL_WORKERS,
+                  weave_api=True, logfile=None, incremental=False):
+    """Runs a single benchmark; latencies are in seconds.
+
+    ``running`` is the fraction of local nodes which are already running,
+    the rest are stopped (as after reboot). If ``incremental`` is set,
+    recovery is run once before the measured run, so the latter starts
+    from saved state.
+    """
+    tmpdir = tempfile.mkdtemp(prefix="gluuagent-bench-")
+    environ = dict(os.environ)
+    servers = []
+
+    try:
+        database = os.path.join(tmpdir, "db.json")
+        data = generate_database(database, providers, nodes,
+                                 hostname=get_local_hostnames()[0])
+
+        engine = FakeDockerEngine(os.path.join(tmpdir, "docker.sock"),
+                                  docker_latency)
+        local_nodes = [node for node in data["nodes"].values()
+                       if node["provider_id"] == "provider-1"]
+        for num, node in enumerate(local_nodes):
+            engine.add_container(node["id"], node["name"],
+                                 running=num < len(local_nodes) * running)
+        # fake weave script doesn't start the router container; it's kept
+        # running for the measured run of incremental benchmark
+        engine.add_container("weave" * 12, "weave", running=incremental)
+        engine.add_container("prometheus" * 6, "prometheus")
+        engine.start()
+        servers.append(engine)
+        os.environ["DOCKER_HOST"] = engine.base_url
+
+        router = None
+        if weave_api:
+            router = FakeWeaveRouter(WEAVE_HTTP_HOST, 0, weave_latency)
+            router.start()
+            servers.append(router)
+
+        calls_file = os.path.join(tmpdir, "calls.log")
+        install_fake_commands(tmpdir, calls_file, docker_latency,
+                              weave_latency)
+        listener = PortListener("127.0.0.1")
+        servers.append(listener)
+        servers.append(LocalLdapProbe("127.0.0.1", listener.port))
+
+        if logfile:
+            logger = get_logger(logfile, name="gluuagent.benchmark")
+        else:
+            logger = logging.getLogger("gluuagent.benchmark")
+            logger.setLevel(logging.INFO)
+            logger.addHandler(logging.NullHandler())
+            logger.propagate = False
+
+        state_file = os.path.join(tmpdir, "state.json")
+
+        def recovery_task(db, **kwargs):
+            task = RecoveryTask(db, logger, **kwargs)
+            if router:
+                # fake router listens on an ephemeral port
+                task.weave = WeaveClient(*router.address)
+            return task
+
+        if incremental:
+            db = Database(database, snapshot=True,
+                          hostnames=get_local_hostnames())
+            recovery_task(db, workers=workers,
+                          state_file=state_file).execute()
+            engine.reset()
+            if router:
+                router.reset()
+            open(calls_file, "w").close()
+
+        started = time.time()
+        db = Database(database, snapshot=True,
+                      hostnames=get_local_hostnames())
+        loaded = time.time()
+
+        if task == "recover":
+            recovery_task(db, workers=workers,
+                          state_file=state_file).execute()
+        else:
+            ImageUpdateTask(db, logger, pull_workers=pull_workers,
+                            recovery_task=recovery_task(db)).execute()
+        finished = time.time()
+
+        return {
+            "task": task,
+            "providers": providers,
+            "nodes": providers * nodes,
+            "local_nodes": len(local_nodes),
+            "workers": workers,
+            "incremental": incremental,
+            "docker_latency": docker_latency,
+            "weave_latency": weave_latency,
+            "wall_time": finished - started,
+            "load_time": loaded - started,
+            # ``ru_maxrss`` is in kilobytes on Linux
+            "peak_rss_mb": resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            "docker_calls": dict(engine.calls),
+            "weave_api_calls": dict(router.calls) if router else {},
+            "command_calls": dict(read_command_calls(calls_file)),
+        }
+    finally:
+        for server in reversed(servers):
+            server.stop()
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def format_report(result):
+    lines = [
+        "task            {task}".format(**result),
+        "nodes           {nodes} ({local_nodes} local) on "
+        "{providers} provider(s)".format(**result),
+        "latency         docker {:.1f} ms, weave {:.1f} ms".format(
+            result["docker_latency"] * 1000,
+            result["weave_latency"] * 1000),
+        "wall time       {wall_time:.3f} s (database load "
+        "{load_time:.3f} s)".format(**result),
+        "peak RSS        {peak_rss_mb:.1f} MB".format(**result),
+    ]
+    for title, key in [("docker API", "docker_calls"),
+                       ("weave API", "weave_api_calls"),
+                       ("commands", "command_calls")]:
+        calls = result[key]
+        lines.append("{:<16}{} calls".format(title, sum(calls.values())))
+        for name in sorted(calls):
+            lines.append("    {:<24} {:>6}".format(name, calls[name]))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--task", choices=TASKS, default="recover")
+    parser.add_argument("--providers", type=int, default=1,
+                        help="number of providers (default to 1)")
+    parser.add_argument("--nodes", type=int, default=20,
+                        help="number of nodes per provider (default to 20)")
+    parser.add_argument("--running", type=float, default=0.0,
+                        help="fraction of local nodes already running "
+                             "(default to 0)")
+    parser.add_argument("--docker-latency", type=float, default=0.0,
+                        help="latency of docker calls in ms (default to 0)")
+    parser.add_argument("--weave-latency", type=float, default=0.0,
+                        help="latency of weave calls in ms (default to 0)")
+    parser.add_argument("--workers", type=int, default=RECOVERY_WORKERS,
+                        help="recovery workers "
+                             "(default to {})".format(RECOVERY_WORKERS))
+    parser.add_argument("--incremental", action="store_true",
+                        help="measure the second recovery run, which "
+                             "starts from the state saved by the first one")
+    parser.add_argument("--no-weave-api", action="store_true",
+                        help="don't serve weave HTTP API; weave script "
+                             "is used instead")
+    parser.add_argument("--logfile", default=None,
+                        help="path to log file of the task")
+    parser.add_argument("--json", action="store_true",
+                        help="print the result as JSON")
+    args = parser.parse_args()
+
+    result = run_benchmark(
+        task=args.task,
+        providers=args.providers,
+        nodes=args.nodes,
+        running=args.running,
+        docker_latency=args.docker_latency / 1000.0,
+        weave_latency=args.weave_latency / 1000.0,
+        workers=args.workers,
+        weave_api=not args.no_weave_api,
+        logfile=args.logfile,
+        incremental=args.incremental,
+    )
+    if args.json:
+        print(json.dumps(result, indent=2, sort_keys=True))
+    else:
+        print(format_report(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+"""
+Measures cold-start time of ``gluu-agent``.
+
+Each case is run in a fresh interpreter several times and the best
+wall time is reported, along with heavy modules loaded by the case.
+
+Usage::
+
+    python benchmarks/startup.py [--runs 10]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules which should only be imported by the code paths using them
+HEAVY_MODULES = ("docker", "requests", "yaml", "sh", "M2Crypto", "netaddr",
+                 "tinydb")
+
+CASES = [
+    ("import gluuagent.cli", "import gluuagent.cli"),
+    ("gluu-agent --help",
+     "import sys; sys.argv = ['gluu-agent', '--help']\n"
+     "from gluuagent.cli import main\n"
+     "try:\n"
+     "    main()\n"
+     "except SystemExit:\n"
+     "    pass"),
+    ("recover (missing database)",
+     "import sys, logging; logging.disable(logging.WARN)\n"
+     "sys.argv = ['gluu-agent', 'recover', '--database', '/nonexistent']\n"
+     "from gluuagent.cli import main\n"
+     "try:\n"
+     "    main()\n"
+     "except SystemExit:\n"
+     "    pass"),
+    ("import gluuagent.tasks", "import gluuagent.tasks"),
+]
+
+# wraps the case to report elapsed time and loaded heavy modules
+WRAPPER = """
+import json, os, sys, time
+started = time.time()
+sys.stdout = open(os.devnull, "w")
+exec(compile({code!r}, "<case>", "exec"))
+elapsed = time.time() - started
+sys.stdout = sys.__stdout__
+print(json.dumps({{
+    "elapsed": elapsed,
+    "modules": sorted(set(
+        name.split(".")[0] for name in sys.modules
+        if name.split(".")[0] in {heavy!r}
+    )),
+}}))
+"""
+
+
+def run_case(code, runs):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [ROOT, env.get("PYTHONPATH")]))
+    script = WRAPPER.format(code=code, heavy=HEAVY_MODULES)
+
+    results = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, "-c", script],
+                                         env=env)
+        results.append(json.loads(output.splitlines()[-1]))
+    return min(result["elapsed"] for result in results), results[0]["modules"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--runs", type=int, default=10,
+                        help="number of runs per case (default to 10)")
+    args = parser.parse_args()
+
+    print("{:<30} {:>10}  {}".format("case", "best (ms)", "heavy modules"))
+    for name, code in CASES:
+        elapsed, modules = run_case(code, args.runs)
+        print("{:<30} {:>10.1f}  {}".format(name, elapsed * 1000,
+                                            ", ".join(modules) or "-"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+import socket
+import struct
+
+
+class AddressError(ValueError):
+    pass
+
+
+def ip_to_int(ip):
+    try:
+        return struct.unpack("!I", socket.inet_aton(ip))[0]
+    except (socket.error, TypeError):
+        raise AddressError("invalid IP address {!r}".format(ip))
+
+
+def int_to_ip(value):
+    return socket.inet_ntoa(struct.pack("!I", value))
+
+
+def parse_network(ip_network):
+    """Parses CIDR notation (e.g. ``10.2.0.0/16``); returns the network
+    address (as integer) and prefix length.
+    """
+    try:
+        addr, prefixlen = ip_network.split("/")
+        prefixlen = int(prefixlen)
+    except (AttributeError, ValueError):
+        raise AddressError("invalid network {!r}".format(ip_network))
+
+    if not 0 <= prefixlen <= 30:
+        raise AddressError("unsupported prefix length of network "
+                           "{}".format(ip_network))
+    mask = (0xffffffff << (32 - prefixlen)) & 0xffffffff
+    return ip_to_int(addr) & mask, prefixlen
+
+
+def get_broadcast(network, prefixlen):
+    return network + (1 << (32 - prefixlen)) - 1
+
+
+class AddressConflict(AddressError):
+    """IP is already allocated to ``holder``.
+    """
+
+    def __init__(self, message, holder):
+        super(AddressConflict, self).__init__(message)
+        self.holder = holder
+
+
+class AddressPlan(object):
+    """Weave addresses of a cluster, computed once from its
+    ``weave_ip_network``.
+
+    Network, broadcast, exposed (host) and prometheus addresses are
+    reserved up front; only the allocated addresses are tracked (keyed
+    by their offset in the network), so conflicts and out-of-range IPs
+    are found without materializing the pool.
+
+    Allocations are kept in a dict rather than a bitmap of the whole
+    network: its size follows the number of nodes instead of the
+    network size, and the holder of an address is needed to report
+    both nodes of a conflict.
+    """
+
+    def __init__(self, ip_network):
+        self.ip_network = ip_network
+        self.network, self.prefixlen = parse_network(ip_network)
+        self.size = 1 << (32 - self.prefixlen)
+        self.broadcast = get_broadcast(self.network, self.prefixlen)
+        # as the last address of pool is a broadcast address, we cannot
+        # use it; weave is exposed on the 2nd last and prometheus takes
+        # the 3rd last address
+        self.exposed = self.broadcast - 1
+        self.prometheus = self.broadcast - 2
+
+        self._reserved = {}
+        for name, addr in [("network", self.network),
+                           ("broadcast", self.broadcast),
+                           ("exposed", self.exposed),
+                           ("prometheus", self.prometheus)]:
+            self._reserved[addr - self.network] = name
+        self._owners = {}
+
+    @property
+    def exposed_cidr(self):
+        return int_to_ip(self.exposed), self.prefixlen
+
+    @property
+    def prometheus_cidr(self):
+        return int_to_ip(self.prometheus), self.prefixlen
+
+    def allocate(self, ip, owner):
+        """Marks ``ip`` as taken by ``owner``; raises ``AddressError``
+        if the IP is outside of the network or reserved, and
+        ``AddressConflict`` if it's already taken by someone else.
+        Allocating the same IP to the same owner is a no-op.
+        """
+        offset = ip_to_int(ip) - self.network
+        if not 0 <= offset < self.size:
+            raise AddressError("{} is outside of weave network "
+                               "{}".format(ip, self.ip_network))
+        if offset in self._reserved:
+            raise AddressError("{} is reserved for {} address".format(
+                ip, self._reserved[offset]))
+
+        holder = self._owners.setdefault(offset, owner)
+        if holder != owner:
+            raise AddressConflict("{} is already taken by {}".format(
+                ip, holder), holder)
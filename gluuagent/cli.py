@@ -8,11 +8,24 @@ import sys
 
 import click
 
-from .database import Database
-from .tasks import RecoveryTask
-from .tasks import ImageUpdateTask
+from .constants import DOCKER_CERT_PATH
+from .constants import FLEET_WORKERS
+from .constants import HEALTH_CPU_BUDGET
+from .constants import HEALTH_WORKERS
+from .constants import LOCK_FILE
+from .constants import PULL_WORKERS
+from .constants import RECOVERY_PRIORITY_CHOICES
+from .constants import RECOVERY_WORKERS
+from .constants import ROLLING_BATCH_SIZE
+from .constants import RPC_SOCKET
+from .constants import STATE_FILE
+from .utils import get_local_hostnames
 from .utils import get_logger
 
+# modules depending on docker, requests, etc. are imported by each
+# command after the database is found, so ``--help`` or a host without
+# cluster database doesn't pay their import time
+
 
 @click.group(context_settings={
     "help_option_names": ["-h", "--help"],
@@ -37,10 +50,70 @@ def main():
     is_flag=True,
     help="Enable weave encryption.",
     )
-def recover(database, logfile, encrypted):
+@click.option(
+    "--workers",
+    default=RECOVERY_WORKERS,
+    type=int,
+    help="Maximum number of nodes recovered simultaneously "
+         "(default to {})".format(RECOVERY_WORKERS),
+    )
+@click.option(
+    "--metrics-file",
+    default=None,
+    help="Path to Prometheus textfile collector file "
+         "(if omitted metrics are not exported)",
+    )
+@click.option(
+    "--log-format",
+    type=click.Choice(["text", "json"]),
+    default="text",
+    help="Format of log records; json format includes per-node "
+         "events (default to text)",
+    )
+@click.option(
+    "--state-file",
+    default=STATE_FILE,
+    help="Path to file keeping the state of last successful recovery, "
+         "used to skip unchanged nodes (default to {})".format(STATE_FILE),
+    )
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Check every node regardless of the state of last recovery.",
+    )
+@click.option(
+    "--plan",
+    is_flag=True,
+    help="Print the recovery plan as JSON without running it.",
+    )
+@click.option(
+    "--node",
+    "node_ids",
+    multiple=True,
+    help="Only recover the node with given ID (and the nodes it depends "
+         "on); may be repeated.",
+    )
+@click.option(
+    "--type",
+    "node_types",
+    multiple=True,
+    type=click.Choice(sorted(RECOVERY_PRIORITY_CHOICES)),
+    help="Only recover nodes of given type (and the nodes they depend "
+         "on); may be repeated.",
+    )
+@click.option(
+    "--lock-file",
+    default=LOCK_FILE,
+    help="Path to lock file shared by agent processes of the host "
+         "(default to {})".format(LOCK_FILE),
+    )
+def recover(database, logfile, log_format, encrypted, workers,
+            metrics_file, state_file, full, plan, node_ids, node_types,
+            lock_file):
     """Run recovery process.
     """
-    logger = get_logger(logfile, name="gluuagent.recover")
+    logger = get_logger(logfile, name="gluuagent.recover",
+                        json_format=log_format == "json")
 
     # checks if database is exist
     if not os.path.exists(database):
@@ -48,9 +121,126 @@ def recover(database, logfile, encrypted):
                     "skipping recovery process".format(database))
         sys.exit(0)
 
-    db = Database(database)
-    task = RecoveryTask(db, logger, encrypted)
-    task.execute()
+    from .database import Database
+    from .metrics import REGISTRY
+    from .tasks import RecoveryTask
+
+    db = Database(database, snapshot=True,
+                  hostnames=get_local_hostnames())
+    task = RecoveryTask(db, logger, encrypted, workers,
+                        state_file=state_file)
+
+    if plan:
+        import json
+
+        click.echo(json.dumps(
+            task.get_plan(node_ids, node_types).to_dict(), indent=2,
+        ))
+        return
+
+    from .lock import HostLock
+    from .lock import LockError
+
+    task.lock = HostLock(lock_file, logger=logger)
+    targeted = bool(node_ids or node_types)
+    try:
+        # a plain recovery requested while another process is
+        # changing containers is left to that process; its follow-up
+        # only checks the nodes changed since its last recovery, so
+        # a full recovery waits for the lock instead
+        result = task.exclusive("recover", task.execute, node_ids,
+                                node_types, full,
+                                coalesce=not (targeted or full))
+    except LockError as exc:
+        logger.error(exc)
+        sys.exit(1)
+    finally:
+        if metrics_file:
+            REGISTRY.write_textfile(metrics_file)
+
+    # e.g. unknown node ID
+    if targeted and result.errors:
+        sys.exit(1)
+
+
+@main.command("recover-fleet")
+@click.option(
+    "--database",
+    default="/var/lib/gluu-cluster/db/db.json",
+    help="Path to database file (default to /var/lib/gluu-cluster/db/db.json)",
+    )
+@click.option(
+    "--logfile",
+    default=None,
+    help="Path to log file (if omitted will use stdout)",
+    )
+@click.option(
+    "--encrypted",
+    is_flag=True,
+    help="Enable weave encryption.",
+    )
+@click.option(
+    "--workers",
+    default=FLEET_WORKERS,
+    type=int,
+    help="Maximum number of providers recovered simultaneously "
+         "(default to {})".format(FLEET_WORKERS),
+    )
+@click.option(
+    "--node-workers",
+    default=RECOVERY_WORKERS,
+    type=int,
+    help="Maximum number of nodes of a provider recovered simultaneously "
+         "(default to {})".format(RECOVERY_WORKERS),
+    )
+@click.option(
+    "--cert-path",
+    default=DOCKER_CERT_PATH,
+    help="Path to TLS certificates of docker API of providers "
+         "(default to {})".format(DOCKER_CERT_PATH),
+    )
+@click.option(
+    "--log-format",
+    type=click.Choice(["text", "json"]),
+    default="text",
+    help="Format of log records; json format includes per-node "
+         "events (default to text)",
+    )
+@click.option(
+    "--lock-file",
+    default=LOCK_FILE,
+    help="Path to lock file shared by agent processes of the host "
+         "(default to {})".format(LOCK_FILE),
+    )
+def recover_fleet(database, logfile, log_format, encrypted, workers,
+                  node_workers, cert_path, lock_file):
+    """Recover every provider of the cluster from this host.
+    """
+    logger = get_logger(logfile, name="gluuagent.recover_fleet",
+                        json_format=log_format == "json")
+
+    # checks if database is exist
+    if not os.path.exists(database):
+        logger.warn("unable to read database {}; "
+                    "skipping recovery process".format(database))
+        sys.exit(0)
+
+    import json
+
+    from .database import Database
+    from .fleet import FleetRecoveryTask
+    from .lock import HostLock
+
+    # every provider (and its nodes) is needed
+    db = Database(database, snapshot=True)
+    task = FleetRecoveryTask(db, logger, encrypted, workers, node_workers,
+                             cert_path)
+    task.lock = HostLock(lock_file, logger=logger)
+    results = task.execute()
+    click.echo(json.dumps(results, indent=2))
+
+    if any(result["status"] == "failure" for result in results):
+        sys.exit(1)
 
 
 @main.command("update-images")
@@ -64,10 +254,69 @@ def recover(database, logfile, encrypted):
     default=None,
     help="Path to log file (if omitted will use stdout)",
     )
-def update_images(database, logfile):
+@click.option(
+    "--encrypted",
+    is_flag=True,
+    help="Enable weave encryption.",
+    )
+@click.option(
+    "--workers",
+    default=RECOVERY_WORKERS,
+    type=int,
+    help="Maximum number of nodes recovered simultaneously "
+         "(default to {})".format(RECOVERY_WORKERS),
+    )
+@click.option(
+    "--state-file",
+    default=STATE_FILE,
+    help="Path to file keeping the state of last successful recovery, "
+         "used to skip unchanged nodes (default to {})".format(STATE_FILE),
+    )
+@click.option(
+    "--parallel",
+    default=PULL_WORKERS,
+    type=int,
+    help="Maximum number of images pulled simultaneously "
+         "(default to {})".format(PULL_WORKERS),
+    )
+@click.option(
+    "--rolling",
+    is_flag=True,
+    help="Update nodes a batch at a time instead of stopping all nodes.",
+    )
+@click.option(
+    "--batch-size",
+    default=ROLLING_BATCH_SIZE,
+    type=int,
+    help="Number of nodes updated at a time in rolling update "
+         "(default to {})".format(ROLLING_BATCH_SIZE),
+    )
+@click.option(
+    "--metrics-file",
+    default=None,
+    help="Path to Prometheus textfile collector file "
+         "(if omitted metrics are not exported)",
+    )
+@click.option(
+    "--log-format",
+    type=click.Choice(["text", "json"]),
+    default="text",
+    help="Format of log records; json format includes per-node "
+         "events (default to text)",
+    )
+@click.option(
+    "--lock-file",
+    default=LOCK_FILE,
+    help="Path to lock file shared by agent processes of the host "
+         "(default to {})".format(LOCK_FILE),
+    )
+def update_images(database, logfile, log_format, encrypted, workers,
+                  state_file, parallel, rolling, batch_size, metrics_file,
+                  lock_file):
     """Run image update process.
     """
-    logger = get_logger(logfile, name="gluuagent.update_image")
+    logger = get_logger(logfile, name="gluuagent.update_image",
+                        json_format=log_format == "json")
 
     # checks if database is exist
     if not os.path.exists(database):
@@ -75,6 +324,356 @@ def update_images(database, logfile):
                     "skipping image update process".format(database))
         sys.exit(0)
 
-    db = Database(database)
-    task = ImageUpdateTask(db, logger)
+    from .database import Database
+    from .lock import HostLock
+    from .lock import LockError
+    from .metrics import REGISTRY
+    from .tasks import ImageUpdateTask
+    from .tasks import RecoveryTask
+
+    db = Database(database, snapshot=True,
+                  hostnames=get_local_hostnames())
+    # nodes are recovered with the same settings as ``recover``, so
+    # recoveries requested meanwhile can be left to this process
+    recovery_task = RecoveryTask(db, logger, encrypted, workers,
+                                 state_file=state_file)
+    recovery_task.lock = HostLock(lock_file, logger=logger)
+    task = ImageUpdateTask(db, logger, encrypted, pull_workers=parallel,
+                           rolling=rolling, batch_size=batch_size,
+                           docker_client=recovery_task.docker,
+                           recovery_task=recovery_task)
+    try:
+        task.execute()
+    except LockError as exc:
+        logger.error(exc)
+        sys.exit(1)
+    finally:
+        if metrics_file:
+            REGISTRY.write_textfile(metrics_file)
+
+
+@main.command()
+@click.option(
+    "--database",
+    default="/var/lib/gluu-cluster/db/db.json",
+    help="Path to database file (default to /var/lib/gluu-cluster/db/db.json)",
+    )
+@click.option(
+    "--logfile",
+    default=None,
+    help="Path to log file (if omitted will use stdout)",
+    )
+@click.option(
+    "--encrypted",
+    is_flag=True,
+    help="Enable weave encryption.",
+    )
+@click.option(
+    "--workers",
+    default=RECOVERY_WORKERS,
+    type=int,
+    help="Maximum number of nodes recovered simultaneously "
+         "(default to {})".format(RECOVERY_WORKERS),
+    )
+@click.option(
+    "--metrics-port",
+    default=None,
+    type=int,
+    help="Serve Prometheus metrics on 127.0.0.1 at given port "
+         "(if omitted metrics are not served)",
+    )
+@click.option(
+    "--log-format",
+    type=click.Choice(["text", "json"]),
+    default="text",
+    help="Format of log records; json format includes per-node "
+         "events (default to text)",
+    )
+@click.option(
+    "--state-file",
+    default=STATE_FILE,
+    help="Path to file keeping the state of last successful recovery, "
+         "used to skip unchanged nodes (default to {})".format(STATE_FILE),
+    )
+@click.option(
+    "--lock-file",
+    default=LOCK_FILE,
+    help="Path to lock file shared by agent processes of the host "
+         "(default to {})".format(LOCK_FILE),
+    )
+def watch(database, logfile, log_format, encrypted, workers, metrics_port,
+          state_file, lock_file):
+    """Watch docker events and recover stopped nodes.
+    """
+    logger = get_logger(logfile, name="gluuagent.watch",
+                        json_format=log_format == "json")
+
+    # checks if database is exist
+    if not os.path.exists(database):
+        logger.warn("unable to read database {}; "
+                    "skipping watch process".format(database))
+        sys.exit(0)
+
+    from .database import Database
+    from .metrics import REGISTRY
+    from .tasks import WatchTask
+
+    db = Database(database, snapshot=True,
+                  hostnames=get_local_hostnames())
+    if metrics_port:
+        REGISTRY.serve(metrics_port)
+
+    from .lock import HostLock
+
+    task = WatchTask(db, logger, encrypted, workers,
+                     state_file=state_file)
+    task.lock = HostLock(lock_file, logger=logger)
     task.execute()
+
+
+@main.command()
+@click.option(
+    "--database",
+    default="/var/lib/gluu-cluster/db/db.json",
+    help="Path to database file (default to /var/lib/gluu-cluster/db/db.json)",
+    )
+@click.option(
+    "--logfile",
+    default=None,
+    help="Path to log file (if omitted will use stdout)",
+    )
+@click.option(
+    "--encrypted",
+    is_flag=True,
+    help="Enable weave encryption.",
+    )
+@click.option(
+    "--workers",
+    default=HEALTH_WORKERS,
+    type=int,
+    help="Maximum number of nodes probed simultaneously "
+         "(default to {})".format(HEALTH_WORKERS),
+    )
+@click.option(
+    "--cpu-budget",
+    default=HEALTH_CPU_BUDGET,
+    type=float,
+    help="Fraction of a CPU spent on probing "
+         "(default to {})".format(HEALTH_CPU_BUDGET),
+    )
+@click.option(
+    "--metrics-port",
+    default=None,
+    type=int,
+    help="Serve Prometheus metrics on 127.0.0.1 at given port "
+         "(if omitted metrics are not served)",
+    )
+@click.option(
+    "--log-format",
+    type=click.Choice(["text", "json"]),
+    default="text",
+    help="Format of log records; json format includes per-node "
+         "events (default to text)",
+    )
+@click.option(
+    "--lock-file",
+    default=LOCK_FILE,
+    help="Path to lock file shared by agent processes of the host "
+         "(default to {})".format(LOCK_FILE),
+    )
+def health(database, logfile, log_format, encrypted, workers, cpu_budget,
+           metrics_port, lock_file):
+    """Probe local nodes periodically and restart unhealthy ones.
+    """
+    logger = get_logger(logfile, name="gluuagent.health",
+                        json_format=log_format == "json")
+
+    # checks if database is exist
+    if not os.path.exists(database):
+        logger.warn("unable to read database {}; "
+                    "skipping health process".format(database))
+        sys.exit(0)
+
+    from .database import Database
+    from .health import HealthTask
+    from .metrics import REGISTRY
+
+    db = Database(database, snapshot=True,
+                  hostnames=get_local_hostnames())
+    if metrics_port:
+        REGISTRY.serve(metrics_port)
+
+    from .lock import HostLock
+
+    task = HealthTask(db, logger, encrypted, workers, cpu_budget)
+    task.lock = HostLock(lock_file, logger=logger)
+    task.execute()
+
+
+@main.command()
+@click.option(
+    "--database",
+    default="/var/lib/gluu-cluster/db/db.json",
+    help="Path to database file (default to /var/lib/gluu-cluster/db/db.json)",
+    )
+@click.option(
+    "--logfile",
+    default=None,
+    help="Path to log file (if omitted will use stdout)",
+    )
+@click.option(
+    "--encrypted",
+    is_flag=True,
+    help="Enable weave encryption.",
+    )
+@click.option(
+    "--workers",
+    default=RECOVERY_WORKERS,
+    type=int,
+    help="Maximum number of nodes recovered simultaneously "
+         "(default to {})".format(RECOVERY_WORKERS),
+    )
+@click.option(
+    "--socket",
+    "socket_path",
+    default=RPC_SOCKET,
+    help="Path to control socket (default to {})".format(RPC_SOCKET),
+    )
+@click.option(
+    "--metrics-port",
+    default=None,
+    type=int,
+    help="Serve Prometheus metrics on 127.0.0.1 at given port "
+         "(if omitted metrics are not served)",
+    )
+@click.option(
+    "--log-format",
+    type=click.Choice(["text", "json"]),
+    default="text",
+    help="Format of log records; json format includes per-node "
+         "events (default to text)",
+    )
+@click.option(
+    "--state-file",
+    default=STATE_FILE,
+    help="Path to file keeping the state of last successful recovery, "
+         "used to skip unchanged nodes (default to {})".format(STATE_FILE),
+    )
+@click.option(
+    "--lock-file",
+    default=LOCK_FILE,
+    help="Path to lock file shared by agent processes of the host "
+         "(default to {})".format(LOCK_FILE),
+    )
+def serve(database, logfile, log_format, encrypted, workers, socket_path,
+          metrics_port, state_file, lock_file):
+    """Keep the agent running and accept commands sent by `ctl`.
+    """
+    logger = get_logger(logfile, name="gluuagent.serve",
+                        json_format=log_format == "json")
+
+    # checks if database is exist
+    if not os.path.exists(database):
+        logger.warn("unable to read database {}; "
+                    "skipping serve process".format(database))
+        sys.exit(0)
+
+    from .database import Database
+    from .metrics import REGISTRY
+    from .service import AgentService
+
+    db = Database(database, snapshot=True,
+                  hostnames=get_local_hostnames())
+    if metrics_port:
+        REGISTRY.serve(metrics_port)
+
+    from .lock import HostLock
+
+    service = AgentService(db, logger, encrypted, workers,
+                           state_file=state_file,
+                           lock=HostLock(lock_file, logger=logger))
+    service.serve(socket_path)
+
+
+@main.command()
+@click.argument(
+    "command",
+    type=click.Choice(["recover", "recover-node", "update-images",
+                       "status"]),
+    )
+@click.option(
+    "--node",
+    "node_id",
+    default=None,
+    help="ID of the node to recover (required by recover-node)",
+    )
+@click.option(
+    "--type",
+    "node_type",
+    type=click.Choice(sorted(RECOVERY_PRIORITY_CHOICES)),
+    default=None,
+    help="Only recover nodes of given type",
+    )
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Check every node regardless of the state of last recovery.",
+    )
+@click.option(
+    "--rolling",
+    is_flag=True,
+    help="Update nodes a batch at a time instead of stopping all nodes.",
+    )
+@click.option(
+    "--batch-size",
+    default=None,
+    type=int,
+    help="Number of nodes updated at a time in rolling update",
+    )
+@click.option(
+    "--parallel",
+    default=None,
+    type=int,
+    help="Maximum number of images pulled simultaneously",
+    )
+@click.option(
+    "--socket",
+    "socket_path",
+    default=RPC_SOCKET,
+    help="Path to control socket (default to {})".format(RPC_SOCKET),
+    )
+@click.option(
+    "--timeout",
+    default=None,
+    type=float,
+    help="Seconds to wait for the result (if omitted waits until "
+         "the command is finished)",
+    )
+def ctl(command, node_id, node_type, full, rolling, batch_size, parallel,
+        socket_path, timeout):
+    """Send a command to the agent started by `serve`.
+    """
+    import json
+
+    from .rpc import RpcError
+    from .rpc import call
+
+    params = {}
+    if command == "recover":
+        params = {"full": full,
+                  "node_ids": [node_id] if node_id else None,
+                  "node_types": [node_type] if node_type else None}
+    elif command == "recover-node":
+        if not node_id:
+            raise click.UsageError("--node is required by recover-node")
+        params = {"node_id": node_id}
+    elif command == "update-images":
+        params = {"rolling": rolling, "batch_size": batch_size,
+                  "parallel": parallel}
+
+    try:
+        result = call(socket_path, command, timeout, **params)
+    except RpcError as exc:
+        click.echo("error: {}".format(exc), err=True)
+        sys.exit(1)
+    click.echo(json.dumps(result, indent=2))
@@ -14,3 +14,137 @@ RECOVERY_PRIORITY_CHOICES = {
     "oxidp": 4,
     "oxtrust": 5,
 }
+
+# maximum number of nodes (within the same recovery tier)
+# recovered at the same time
+RECOVERY_WORKERS = 4
+
+# port used by LDAP node to serve (secure) requests
+LDAP_PORT = 1636
+
+# maximum time (in seconds) to wait for a node to become ready
+LDAP_READINESS_TIMEOUT = 60
+
+HTTPD_READINESS_TIMEOUT = 5
+
+DEFAULT_READINESS_TIMEOUT = 30
+
+# address of weave router's HTTP API
+WEAVE_HTTP_HOST = "127.0.0.1"
+
+WEAVE_HTTP_PORT = 6784
+
+# docker events which trigger node recovery in watch mode; stopped
+# container is reported as ``die`` as well
+WATCH_EVENTS = ("die", "oom")
+
+# time (in seconds) a recovery is remembered in watch mode; events of
+# the container emitted before the recovery started (e.g. ``die``
+# following ``oom``) don't trigger another recovery
+WATCH_DEDUP_WINDOW = 10
+
+# delay (in seconds) before reconnecting to docker events stream
+WATCH_RECONNECT_DELAY = 5
+
+# maximum number of images pulled simultaneously
+PULL_WORKERS = 3
+
+# number of attempts to pull an image; layers pulled by previous
+# attempts are reused by docker
+PULL_RETRIES = 3
+
+# interval (in seconds) between pull progress summaries
+PULL_LOG_INTERVAL = 10
+
+# image used by each node type
+NODE_IMAGES = {
+    "ldap": "gluuopendj",
+    "oxauth": "gluuoxauth",
+    "oxtrust": "gluuoxtrust",
+    "oxidp": "gluuoxidp",
+    "nginx": "gluunginx",
+}
+
+# number of nodes updated at a time in rolling update
+ROLLING_BATCH_SIZE = 1
+
+# maximum number of idle connections kept to docker engine;
+# should be large enough for recovery, weave and pull workers
+DOCKER_POOL_SIZE = 10
+
+# timeout (in seconds) of a command run in container's shell session
+EXEC_TIMEOUT = 30
+
+# state of the last successful recovery
+STATE_FILE = "/var/lib/gluu-agent/state.json"
+
+# maximum number of providers recovered at the same time in fleet mode
+FLEET_WORKERS = 4
+
+# client certificates (``ca.pem``, ``cert.pem`` and ``key.pem``) used to
+# access docker API of other providers over TLS
+DOCKER_CERT_PATH = "/etc/docker"
+
+# estimated duration (in seconds) of recovery actions, reported by
+# ``recover --plan``
+ACTION_COSTS = {
+    "launch_weave": 10.0,
+    "expose_weave": 1.0,
+    "restart": 2.0,
+    "attach": 1.0,
+    "dns_add": 0.05,
+    "dns_remove": 0.05,
+}
+
+# estimated duration (in seconds) of node entrypoints, including the wait
+# for node readiness
+ENTRYPOINT_COSTS = {
+    "ldap": 20.0,
+    "oxauth": 5.0,
+    "oxidp": 5.0,
+}
+
+# lifetime (in seconds) of decrypted cluster secrets kept in memory
+SECRET_TTL = 600
+
+# probe interval (in seconds) of a node in health mode; the interval
+# doubles while the node is healthy and drops to the minimum on failure
+HEALTH_MIN_INTERVAL = 5
+
+HEALTH_MAX_INTERVAL = 60
+
+# consecutive failed probes before the node is restarted
+HEALTH_FAILURE_THRESHOLD = 3
+
+# minimum delay (in seconds) between restarts of a node; doubled on each
+# restart within the flap window
+HEALTH_RESTART_BACKOFF = 30
+
+HEALTH_MAX_RESTART_BACKOFF = 600
+
+# node restarted this many times within the window (in seconds) is
+# flapping; it's not restarted again until the window has passed
+HEALTH_FLAP_THRESHOLD = 5
+
+HEALTH_FLAP_WINDOW = 1800
+
+# maximum number of probes run at the same time; each probe holds
+# at most one connection
+HEALTH_WORKERS = 4
+
+# fraction of a CPU the health supervisor may spend on probing
+HEALTH_CPU_BUDGET = 0.05
+
+# control socket of resident agent (``gluu-agent serve``)
+RPC_SOCKET = "/var/run/gluu-agent.sock"
+
+# host-level lock held while containers are changed; the holder renews
+# its lease (in seconds), otherwise the lock is considered stale
+LOCK_FILE = "/var/run/gluu-agent.lock"
+
+LOCK_LEASE = 60
+
+# maximum time (in seconds) to wait for the lock held by another process
+LOCK_TIMEOUT = 1800
+
+LOCK_POLL = 1
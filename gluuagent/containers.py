@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+import threading
+
+
+def is_running(container):
+    """Checks whether container (an item of ``containers`` listing)
+    is running.
+    """
+    # ``State`` is only available in newer docker API
+    if "State" in container:
+        return container["State"] == "running"
+    return container.get("Status", "").startswith("Up")
+
+
+class ContainerStateCache(object):
+    """Keeps the state of containers loaded from a single
+    ``containers(all=True)`` call.
+
+    Containers which are not in the snapshot (or have been invalidated)
+    are inspected individually.
+    """
+
+    def __init__(self, client, filters=None):
+        self.client = client
+        self.filters = filters
+        self._states = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        states = {}
+        for container in self.client.containers(all=True,
+                                                filters=self.filters):
+            state = {
+                "Id": container["Id"],
+                "Running": is_running(container),
+            }
+            states[container["Id"]] = state
+            states[container["Id"][:12]] = state
+            for name in container.get("Names") or []:
+                states[name.lstrip("/")] = state
+        self._states = states
+
+    def clear(self):
+        with self._lock:
+            self._states = None
+
+    def get(self, container):
+        with self._lock:
+            if self._states is None:
+                self.load()
+            state = self._states.get(container)
+
+        if state is None:
+            # raises ``docker.errors.APIError`` if container is not found
+            meta = self.client.inspect_container(container)
+            state = {
+                "Id": meta["Id"],
+                "Running": meta["State"]["Running"],
+                "StartedAt": meta["State"].get("StartedAt"),
+            }
+            with self._lock:
+                if self._states is not None:
+                    self._states[container] = state
+        return state
+
+    def invalidate(self, container):
+        """Removes the container from snapshot, so its state will be
+        inspected on next lookup.
+        """
+        with self._lock:
+            if not self._states:
+                return
+            state = self._states.get(container)
+            if state is None:
+                return
+            for key, value in self._states.items():
+                if value is state:
+                    del self._states[key]
+
+    def running(self, container):
+        return self.get(container)["Running"]
+
+    def container_id(self, container):
+        return self.get(container)["Id"]
+
+    def started_at(self, container):
+        """Gets the time container was (re)started; as it's not part of
+        containers listing, the container is inspected once per snapshot.
+        """
+        state = self.get(container)
+        if "StartedAt" not in state:
+            meta = self.client.inspect_container(state["Id"])
+            state["StartedAt"] = meta["State"].get("StartedAt")
+        return state["StartedAt"]
@@ -3,27 +3,342 @@
 #
 # All rights reserved.
 
+import json
+import mmap
+import os
+import threading
+
 import tinydb
 
+# fields indexed by ``IndexedTable``
+INDEXED_FIELDS = ("id", "provider_id", "state", "type", "hostname")
+
+# size (in bytes) of the file window decoded at a time by stream reader
+STREAM_CHUNK_SIZE = 256 * 1024
+
+
+class JSONStreamReader(object):
+    """Reads tinydb's JSON document from a memory-mapped file.
+
+    Only a window of the file is held in memory and every document
+    is decoded on its own, so callers may keep only the documents
+    they're interested in.
+
+    Usage::
+
+        with JSONStreamReader(path) as reader:
+            for table_name, docs in reader.iter_tables():
+                ...
+    """
+
+    whitespace = " \t\r\n"
+
+    def __init__(self, path, chunk_size=STREAM_CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+
+        self._buf = ""
+        self._text = ""
+        self._start = 0
+        self._pos = 0
+
+    def __enter__(self):
+        with open(self.path, "rb") as fp:
+            if os.fstat(fp.fileno()).st_size:
+                self._buf = mmap.mmap(fp.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._buf:
+            self._buf.close()
+        self._buf = ""
+        self._text = ""
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos):
+        self._pos = pos
+        # forces the window to be refilled
+        self._start = pos
+        self._text = ""
+
+    def _fill(self, size):
+        self._start = self._pos
+        self._text = self._buf[self._pos:self._pos + size]
+
+    def _peek(self):
+        """Skips whitespaces and returns the next character.
+        """
+        while True:
+            idx = self._pos - self._start
+            if idx >= len(self._text):
+                if self._pos >= len(self._buf):
+                    return ""
+                self._fill(self.chunk_size)
+                idx = 0
+
+            char = self._text[idx]
+            if char not in self.whitespace:
+                return char
+            self._pos += 1
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError("expecting {!r} at position {} of {}".format(
+                char, self._pos, self.path,
+            ))
+        self._pos += 1
+
+    def _decode(self):
+        """Decodes a single JSON string or object.
+        """
+        self._peek()
+        size = self.chunk_size
+        while True:
+            try:
+                # ``scan_once`` is the C-accelerated part of ``raw_decode``
+                value, end = self.decoder.scan_once(
+                    self._text, self._pos - self._start,
+                )
+                self._pos = self._start + end
+                return value
+            except (StopIteration, ValueError):
+                # the value doesn't fit into the window
+                if self._start + len(self._text) >= len(self._buf):
+                    raise ValueError("unable to decode value at position "
+                                     "{} of {}".format(self._pos, self.path))
+                self._fill(size)
+                size *= 2
+
+    def _next_item(self):
+        """Moves to the next ``key: value`` pair of current object;
+        returns ``False`` (and skips the closing brace) if there's none.
+        """
+        char = self._peek()
+        if char == ",":
+            self._pos += 1
+            char = self._peek()
+        if char == "}":
+            self._pos += 1
+            return False
+        return True
+
+    def iter_tables(self):
+        """Yields ``(table_name, documents)`` pairs, where ``documents``
+        is a generator of ``(eid, document)`` pairs.
+
+        Each ``documents`` generator must be fully consumed
+        before moving to the next table.
+        """
+        if not self._buf:
+            return
+
+        self.seek(0)
+        self._expect("{")
+        while self._next_item():
+            table_name = self._decode()
+            self._expect(":")
+            yield table_name, self.iter_documents()
+
+    def iter_documents(self, pos=None):
+        """Yields ``(eid, document)`` pairs of a table starting at ``pos``
+        (or current position).
+        """
+        if pos is not None:
+            self.seek(pos)
+
+        self._expect("{")
+        while self._next_item():
+            eid = self._decode()
+            self._expect(":")
+            yield eid, self._decode()
+
+
+def stream_load(path, hostnames):
+    """Loads only the records related to the provider(s) matching
+    any of ``hostnames``, i.e. the clusters, the provider itself
+    and its nodes.
+    """
+    result = {"providers": [], "clusters": [], "nodes": []}
+    provider_ids = None
+    nodes_pos = None
+
+    def drain(docs):
+        # decodes (and drops) one document at a time
+        for _ in docs:
+            pass
+
+    with JSONStreamReader(path) as reader:
+        for table_name, docs in reader.iter_tables():
+            if table_name == "providers":
+                result[table_name] = [(eid, doc) for eid, doc in docs
+                                      if doc.get("hostname") in hostnames]
+                provider_ids = set(doc["id"] for _, doc
+                                   in result[table_name])
+            elif table_name == "clusters":
+                result[table_name] = list(docs)
+            elif table_name == "nodes" and provider_ids is None:
+                # nodes can't be filtered before providers are known;
+                # hence we revisit them later
+                nodes_pos = reader.tell()
+                drain(docs)
+            elif table_name == "nodes":
+                result[table_name] = [
+                    (eid, doc) for eid, doc in docs
+                    if doc.get("provider_id") in provider_ids
+                ]
+            else:
+                drain(docs)
+
+        if nodes_pos is not None:
+            result["nodes"] = [
+                (eid, doc) for eid, doc in reader.iter_documents(nodes_pos)
+                if doc.get("provider_id") in (provider_ids or ())
+            ]
+    return result
+
+
+class IndexedTable(object):
+    """A read-only table with hash indexes on ``INDEXED_FIELDS``.
+
+    Equality conditions on indexed fields (and their ``&``/``|``
+    combinations) are answered from the indexes; the remaining
+    candidates are checked against the full condition.
+    """
+
+    def __init__(self, documents, fields=INDEXED_FIELDS):
+        self.documents = documents
+        self.indexes = dict((field, {}) for field in fields)
+
+        for pos, doc in enumerate(documents):
+            for field, index in self.indexes.items():
+                try:
+                    index.setdefault(doc[field], []).append(pos)
+                except (KeyError, TypeError):
+                    # missing or unhashable value
+                    continue
+
+    def candidates(self, hashval):
+        """Gets positions of documents which may match the condition
+        identified by ``hashval``, or ``None`` if every document is
+        a candidate.
+        """
+        op = hashval[0]
+
+        if op == "==":
+            path, value = hashval[1], hashval[2]
+            if len(path) != 1 or path[0] not in self.indexes:
+                return None
+            try:
+                return set(self.indexes[path[0]].get(value, ()))
+            except TypeError:
+                return None
+
+        if op == "and":
+            found = [positions for positions
+                     in [self.candidates(item) for item in hashval[1]]
+                     if positions is not None]
+            if not found:
+                return None
+            return set.intersection(*found)
+
+        if op == "or":
+            found = [self.candidates(item) for item in hashval[1]]
+            if any(positions is None for positions in found):
+                return None
+            return set.union(*found)
+        return None
+
+    def all(self):
+        return [dict(doc) for doc in self.documents]
+
+    def search(self, condition):
+        positions = self.candidates(condition.hashval)
+        if positions is None:
+            docs = self.documents
+        else:
+            docs = [self.documents[pos] for pos in sorted(positions)]
+        # returns copies so callers are free to modify the documents
+        return [dict(doc) for doc in docs if condition(doc)]
+
 
 class Database(object):
-    def __init__(self, database_uri):
-        self.db = tinydb.TinyDB(database_uri)
+    def __init__(self, database_uri, snapshot=False, hostnames=None):
+        self.database_uri = database_uri
+        self.snapshot = snapshot
+
+        # if set, snapshot only contains records related to
+        # provider(s) with matching hostname
+        self.hostnames = hostnames
+
+        if snapshot:
+            # a read-only view; file is parsed once
+            # and reloaded only if it has been changed
+            self.db = None
+            self._tables = {}
+            self._stat = None
+            self._lock = threading.Lock()
+        else:
+            self.db = tinydb.TinyDB(database_uri)
 
         # shortcut to ``tinydb.where``
         self.where = tinydb.where
 
+    def _file_changed(self):
+        stat = os.stat(self.database_uri)
+        key = (stat.st_ino, stat.st_mtime, stat.st_size)
+        if key == self._stat:
+            return False
+        self._stat = key
+        return True
+
+    def load_tables(self):
+        if self.hostnames:
+            data = stream_load(self.database_uri, self.hostnames)
+        else:
+            with open(self.database_uri) as fp:
+                data = dict((table_name, docs.items()) for table_name, docs
+                            in json.load(fp).items())
+
+        tables = {}
+        for table_name, docs in data.items():
+            # keep the order of insertion
+            docs = sorted(docs, key=lambda item: int(item[0]))
+            tables[table_name] = IndexedTable([doc for _, doc in docs])
+        return tables
+
+    def table(self, table_name):
+        with self._lock:
+            if self._file_changed():
+                self._tables = self.load_tables()
+            return self._tables.get(table_name) or IndexedTable([])
+
     def get(self, identifier, table_name):
+        if self.snapshot:
+            data = self.table(table_name).search(
+                self.where("id") == identifier
+            )
+            return data[0] if data else None
+
         table = self.db.table(table_name)
         data = table.get(self.where("id") == identifier)
         return data
 
     def all(self, table_name):
+        if self.snapshot:
+            return self.table(table_name).all()
+
         table = self.db.table(table_name)
         data = table.all()
         return data
 
     def search_from_table(self, table_name, condition):
+        if self.snapshot:
+            return self.table(table_name).search(condition)
+
         table = self.db.table(table_name)
         data = table.search(condition)
         return data
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+"""
+Pure-Python Triple DES (EDE, ECB mode with PKCS#5 padding), compatible
+with the pyDes-based encryption of cluster secrets.
+
+It's only meant for decrypting short secrets (e.g. weave password)
+without loading M2Crypto.
+"""
+
+# initial permutation
+IP = [
+    58, 50, 42, 34, 26, 18, 10, 2, 60, 52, 44, 36, 28, 20, 12, 4,
+    62, 54, 46, 38, 30, 22, 14, 6, 64, 56, 48, 40, 32, 24, 16, 8,
+    57, 49, 41, 33, 25, 17, 9, 1, 59, 51, 43, 35, 27, 19, 11, 3,
+    61, 53, 45, 37, 29, 21, 13, 5, 63, 55, 47, 39, 31, 23, 15, 7,
+]
+
+# final permutation (inverse of ``IP``)
+FP = [
+    40, 8, 48, 16, 56, 24, 64, 32, 39, 7, 47, 15, 55, 23, 63, 31,
+    38, 6, 46, 14, 54, 22, 62, 30, 37, 5, 45, 13, 53, 21, 61, 29,
+    36, 4, 44, 12, 52, 20, 60, 28, 35, 3, 43, 11, 51, 19, 59, 27,
+    34, 2, 42, 10, 50, 18, 58, 26, 33, 1, 41, 9, 49, 17, 57, 25,
+]
+
+# expansion of half block into 48 bits
+E = [
+    32, 1, 2, 3, 4, 5, 4, 5, 6, 7, 8, 9,
+    8, 9, 10, 11, 12, 13, 12, 13, 14, 15, 16, 17,
+    16, 17, 18, 19, 20, 21, 20, 21, 22, 23, 24, 25,
+    24, 25, 26, 27, 28, 29, 28, 29, 30, 31, 32, 1,
+]
+
+# permutation of S-boxes output
+P = [
+    16, 7, 20, 21, 29, 12, 28, 17, 1, 15, 23, 26, 5, 18, 31, 10,
+    2, 8, 24, 14, 32, 27, 3, 9, 19, 13, 30, 6, 22, 11, 4, 25,
+]
+
+# key schedule permutations
+PC1 = [
+    57, 49, 41, 33, 25, 17, 9, 1, 58, 50, 42, 34, 26, 18,
+    10, 2, 59, 51, 43, 35, 27, 19, 11, 3, 60, 52, 44, 36,
+    63, 55, 47, 39, 31, 23, 15, 7, 62, 54, 46, 38, 30, 22,
+    14, 6, 61, 53, 45, 37, 29, 21, 13, 5, 28, 20, 12, 4,
+]
+
+PC2 = [
+    14, 17, 11, 24, 1, 5, 3, 28, 15, 6, 21, 10,
+    23, 19, 12, 4, 26, 8, 16, 7, 27, 20, 13, 2,
+    41, 52, 31, 37, 47, 55, 30, 40, 51, 45, 33, 48,
+    44, 49, 39, 56, 34, 53, 46, 42, 50, 36, 29, 32,
+]
+
+SHIFTS = [1, 1, 2, 2, 2, 2, 2, 2, 1, 2, 2, 2, 2, 2, 2, 1]
+
+SBOXES = [
+    [14, 4, 13, 1, 2, 15, 11, 8, 3, 10, 6, 12, 5, 9, 0, 7,
+     0, 15, 7, 4, 14, 2, 13, 1, 10, 6, 12, 11, 9, 5, 3, 8,
+     4, 1, 14, 8, 13, 6, 2, 11, 15, 12, 9, 7, 3, 10, 5, 0,
+     15, 12, 8, 2, 4, 9, 1, 7, 5, 11, 3, 14, 10, 0, 6, 13],
+    [15, 1, 8, 14, 6, 11, 3, 4, 9, 7, 2, 13, 12, 0, 5, 10,
+     3, 13, 4, 7, 15, 2, 8, 14, 12, 0, 1, 10, 6, 9, 11, 5,
+     0, 14, 7, 11, 10, 4, 13, 1, 5, 8, 12, 6, 9, 3, 2, 15,
+     13, 8, 10, 1, 3, 15, 4, 2, 11, 6, 7, 12, 0, 5, 14, 9],
+    [10, 0, 9, 14, 6, 3, 15, 5, 1, 13, 12, 7, 11, 4, 2, 8,
+     13, 7, 0, 9, 3, 4, 6, 10, 2, 8, 5, 14, 12, 11, 15, 1,
+     13, 6, 4, 9, 8, 15, 3, 0, 11, 1, 2, 12, 5, 10, 14, 7,
+     1, 10, 13, 0, 6, 9, 8, 7, 4, 15, 14, 3, 11, 5, 2, 12],
+    [7, 13, 14, 3, 0, 6, 9, 10, 1, 2, 8, 5, 11, 12, 4, 15,
+     13, 8, 11, 5, 6, 15, 0, 3, 4, 7, 2, 12, 1, 10, 14, 9,
+     10, 6, 9, 0, 12, 11, 7, 13, 15, 1, 3, 14, 5, 2, 8, 4,
+     3, 15, 0, 6, 10, 1, 13, 8, 9, 4, 5, 11, 12, 7, 2, 14],
+    [2, 12, 4, 1, 7, 10, 11, 6, 8, 5, 3, 15, 13, 0, 14, 9,
+     14, 11, 2, 12, 4, 7, 13, 1, 5, 0, 15, 10, 3, 9, 8, 6,
+     4, 2, 1, 11, 10, 13, 7, 8, 15, 9, 12, 5, 6, 3, 0, 14,
+     11, 8, 12, 7, 1, 14, 2, 13, 6, 15, 0, 9, 10, 4, 5, 3],
+    [12, 1, 10, 15, 9, 2, 6, 8, 0, 13, 3, 4, 14, 7, 5, 11,
+     10, 15, 4, 2, 7, 12, 9, 5, 6, 1, 13, 14, 0, 11, 3, 8,
+     9, 14, 15, 5, 2, 8, 12, 3, 7, 0, 4, 10, 1, 13, 11, 6,
+     4, 3, 2, 12, 9, 5, 15, 10, 11, 14, 1, 7, 6, 0, 8, 13],
+    [4, 11, 2, 14, 15, 0, 8, 13, 3, 12, 9, 7, 5, 10, 6, 1,
+     13, 0, 11, 7, 4, 9, 1, 10, 14, 3, 5, 12, 2, 15, 8, 6,
+     1, 4, 11, 13, 12, 3, 7, 14, 10, 15, 6, 8, 0, 5, 9, 2,
+     6, 11, 13, 8, 1, 4, 10, 7, 9, 5, 0, 15, 14, 2, 3, 12],
+    [13, 2, 8, 4, 6, 15, 11, 1, 10, 9, 3, 14, 5, 0, 12, 7,
+     1, 15, 13, 8, 10, 3, 7, 4, 12, 5, 6, 11, 0, 14, 9, 2,
+     7, 11, 4, 1, 9, 12, 14, 2, 0, 6, 10, 13, 15, 3, 5, 8,
+     2, 1, 14, 7, 4, 10, 8, 13, 15, 12, 9, 0, 3, 5, 6, 11],
+]
+
+BLOCK_SIZE = 8
+
+
+class DESError(ValueError):
+    pass
+
+
+def _permute(value, table, bits):
+    result = 0
+    for pos in table:
+        result = (result << 1) | ((value >> (bits - pos)) & 1)
+    return result
+
+
+def _to_int(data):
+    return int(data.encode("hex"), 16)
+
+
+def _to_bytes(value):
+    return ("%016x" % value).decode("hex")
+
+
+def get_subkeys(key):
+    """Computes 16 round keys of a single DES key (8 bytes).
+    """
+    key = _permute(_to_int(key), PC1, 64)
+    c, d = key >> 28, key & 0xfffffff
+    subkeys = []
+    for shift in SHIFTS:
+        c = ((c << shift) | (c >> (28 - shift))) & 0xfffffff
+        d = ((d << shift) | (d >> (28 - shift))) & 0xfffffff
+        subkeys.append(_permute((c << 28) | d, PC2, 56))
+    return subkeys
+
+
+def _feistel(half, subkey):
+    value = _permute(half, E, 32) ^ subkey
+    result = 0
+    for num, sbox in enumerate(SBOXES):
+        chunk = (value >> (42 - 6 * num)) & 0x3f
+        row = ((chunk >> 4) & 2) | (chunk & 1)
+        col = (chunk >> 1) & 0xf
+        result = (result << 4) | sbox[row * 16 + col]
+    return _permute(result, P, 32)
+
+
+def des_block(block, subkeys):
+    """Encrypts a 64-bit block (as integer); decrypts it if ``subkeys``
+    are reversed.
+    """
+    block = _permute(block, IP, 64)
+    left, right = block >> 32, block & 0xffffffff
+    for subkey in subkeys:
+        left, right = right, left ^ _feistel(right, subkey)
+    return _permute((right << 32) | left, FP, 64)
+
+
+def _triple_subkeys(key):
+    if len(key) != 24:
+        raise DESError("Triple DES key must be 24 bytes long")
+    return [get_subkeys(key[pos:pos + 8]) for pos in (0, 8, 16)]
+
+
+def triple_des_encrypt(data, key):
+    k1, k2, k3 = _triple_subkeys(key)
+    padding = BLOCK_SIZE - len(data) % BLOCK_SIZE
+    data += chr(padding) * padding
+
+    blocks = []
+    for pos in range(0, len(data), BLOCK_SIZE):
+        block = _to_int(data[pos:pos + BLOCK_SIZE])
+        block = des_block(block, k1)
+        block = des_block(block, k2[::-1])
+        block = des_block(block, k3)
+        blocks.append(_to_bytes(block))
+    return "".join(blocks)
+
+
+def triple_des_decrypt(data, key):
+    if not data or len(data) % BLOCK_SIZE:
+        raise DESError("data length must be a multiple of {}".format(
+            BLOCK_SIZE))
+    k1, k2, k3 = _triple_subkeys(key)
+
+    blocks = []
+    for pos in range(0, len(data), BLOCK_SIZE):
+        block = _to_int(data[pos:pos + BLOCK_SIZE])
+        block = des_block(block, k3[::-1])
+        block = des_block(block, k2)
+        block = des_block(block, k1[::-1])
+        blocks.append(_to_bytes(block))
+    data = "".join(blocks)
+
+    padding = ord(data[-1])
+    padded = 1 <= padding <= BLOCK_SIZE
+    if not padded or data[-padding:] != chr(padding) * padding:
+        raise DESError("bad decrypt")
+    return data[:-padding]
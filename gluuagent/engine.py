@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+import os
+
+import docker
+import docker.tls
+from docker.unixconn.unixconn import UnixAdapter
+from docker.unixconn.unixconn import UnixHTTPConnectionPool
+
+try:
+    from requests.packages.urllib3.connectionpool import HTTPConnectionPool
+except ImportError:  # pragma: no cover
+    from urllib3.connectionpool import HTTPConnectionPool
+
+from .constants import DOCKER_POOL_SIZE
+
+
+class PooledUnixConnectionPool(UnixHTTPConnectionPool):
+    """Unix socket connection pool which keeps up to ``maxsize``
+    idle connections to docker engine.
+    """
+
+    def __init__(self, base_url, socket_path, timeout=60, maxsize=1):
+        # ``UnixHTTPConnectionPool`` doesn't let us set ``maxsize``
+        HTTPConnectionPool.__init__(self, "localhost", timeout=timeout,
+                                    maxsize=maxsize)
+        self.base_url = base_url
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+
+class PooledUnixAdapter(UnixAdapter):
+    """Transport adapter which shares a single pool of keep-alive
+    connections to the unix socket between every endpoint and thread.
+
+    The stock ``UnixAdapter`` creates a pool holding a single connection
+    for each request URL, hence concurrent requests (or requests to
+    different endpoints, e.g. ``exec_create`` followed by ``exec_start``)
+    open a new connection to docker engine most of the time.
+    """
+
+    def __init__(self, socket_url, timeout=60, pool_size=DOCKER_POOL_SIZE):
+        super(PooledUnixAdapter, self).__init__(socket_url, timeout)
+        # when all connections are busy (e.g. held by events stream),
+        # an extra connection is created and closed after use
+        self.pool = PooledUnixConnectionPool("http+docker://localunixsocket",
+                                             self.socket_path,
+                                             self.timeout,
+                                             maxsize=pool_size)
+
+    def get_connection(self, url, proxies=None):
+        return self.pool
+
+    def close(self):
+        self.pool.close()
+
+
+def get_docker_tls(base_url, cert_path):
+    """Gets TLS config of docker client; ``None`` is returned unless
+    ``base_url`` is a HTTPS URL.
+    """
+    if not (base_url or "").startswith("https://"):
+        return None
+    return docker.tls.TLSConfig(
+        client_cert=(os.path.join(cert_path, "cert.pem"),
+                     os.path.join(cert_path, "key.pem")),
+        ca_cert=os.path.join(cert_path, "ca.pem"),
+        verify=True,
+    )
+
+
+def get_docker_env(base_url, cert_path):
+    """Gets environment variables pointing docker CLI at ``base_url``;
+    weave script runs its helper containers via docker CLI, hence it's
+    pointed at the same engine.
+    """
+    env = {"DOCKER_HOST": base_url.replace("https://", "tcp://")
+                                  .replace("http://", "tcp://")}
+    if base_url.startswith("https://"):
+        env["DOCKER_TLS_VERIFY"] = "1"
+        env["DOCKER_CERT_PATH"] = cert_path
+    return env
+
+
+def get_docker_client(base_url=None, pool_size=DOCKER_POOL_SIZE,
+                      cert_path=None):
+    """Creates ``docker.Client`` which is safe to share between
+    threads of recovery.
+
+    Connections to unix socket are pooled and reused, so up to
+    ``pool_size`` requests are in flight at once without reconnecting.
+    Setting ``pool_size`` to 1 returns the stock client. Like docker CLI,
+    ``DOCKER_HOST`` environment variable overrides the default socket.
+    HTTPS engines are accessed using client certificates in ``cert_path``.
+    """
+    base_url = base_url or os.environ.get("DOCKER_HOST")
+    client = docker.Client(base_url=base_url,
+                           tls=get_docker_tls(base_url, cert_path))
+
+    if pool_size > 1 and isinstance(getattr(client, "_custom_adapter", None),
+                                    UnixAdapter):
+        adapter = PooledUnixAdapter(client._custom_adapter.socket_path,
+                                    client.timeout, pool_size)
+        client._custom_adapter.close()
+        client._custom_adapter = adapter
+        client.mount("http+docker://", adapter)
+    return client
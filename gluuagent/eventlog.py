@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+import datetime
+import json
+import logging
+import Queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from .metrics import timed
+
+# maximum number of log records waiting to be written
+QUEUE_SIZE = 10000
+
+_run_id = None
+
+
+def new_run():
+    """Starts a new run (e.g. recovery or image update); its ID is
+    attached to every structured log record.
+    """
+    global _run_id
+    _run_id = uuid.uuid4().hex
+    return _run_id
+
+
+def current_run():
+    return _run_id
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats log record as a single-line JSON object.
+    """
+
+    def format(self, record):
+        data = {
+            "time": datetime.datetime.utcfromtimestamp(
+                record.created
+            ).isoformat() + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "run_id": current_run(),
+        }
+        data.update(getattr(record, "event", None) or {})
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str, sort_keys=True)
+
+
+class QueueHandler(logging.Handler):
+    """Passes log records to a background thread which writes them
+    using ``target`` handler, so logging never blocks on I/O.
+
+    Records are dropped (and counted) if the queue is full.
+    """
+
+    def __init__(self, target, maxsize=QUEUE_SIZE):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.queue = Queue.Queue(maxsize)
+        self.dropped = 0
+
+        self._thread = threading.Thread(target=self._consume)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def emit(self, record):
+        # message arguments might be changed after the call returns
+        record.msg = record.getMessage()
+        record.args = None
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+    def _consume(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            self.target.handle(record)
+
+    def close(self):
+        if self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join(5)
+        self.target.close()
+        logging.Handler.close(self)
+
+
+@contextmanager
+def span(logger, phase, node_type="", **fields):
+    """Logs start and end of an operation as structured events.
+
+    The yielded dict is included in the end event, so callers may
+    add fields such as ``exit_code`` or override the ``outcome``.
+    """
+    event = dict(fields, span=phase, span_id=uuid.uuid4().hex[:16],
+                 node_type=node_type)
+    started = time.time()
+    logger.debug("{} started".format(phase),
+                 extra={"event": dict(event, event="start", start=started)})
+
+    result = {"outcome": "success"}
+    try:
+        with timed(phase, node_type):
+            yield result
+    except Exception as exc:
+        result.update(outcome="failure", error=str(exc))
+        # e.g. ``sh.ErrorReturnCode`` raised by failed command
+        if getattr(exc, "exit_code", None) is not None:
+            result["exit_code"] = exc.exit_code
+        raise
+    finally:
+        ended = time.time()
+        event.update(result, event="end", start=started, end=ended,
+                     duration=ended - started)
+        logger.debug("{} finished".format(phase), extra={"event": event})
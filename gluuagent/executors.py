@@ -3,14 +3,32 @@
 #
 # All rights reserved.
 
+import os
+import select
+import socket
+import subprocess
+import threading
 import time
+import uuid
 from collections import namedtuple
 
+import docker.errors
+
+from .constants import DEFAULT_READINESS_TIMEOUT
+from .constants import EXEC_TIMEOUT
+from .constants import HTTPD_READINESS_TIMEOUT
+from .constants import LDAP_PORT
+from .constants import LDAP_READINESS_TIMEOUT
+from .constants import STATE_SUCCESS
+from .eventlog import span
 from .utils import get_logger
 
 DockerExecResult = namedtuple("DockerExecResult",
                               ["cmd", "exit_code", "retval"])
 
+ReadinessResult = namedtuple("ReadinessResult",
+                             ["ready", "elapsed", "attempts"])
+
 
 def run_docker_exec(client, container, cmd):
     exec_cmd = client.exec_create(container, cmd=cmd)
@@ -21,8 +39,191 @@ def run_docker_exec(client, container, cmd):
     return result
 
 
+class ExecSessionError(Exception):
+    """Raised when the exec'd shell is unable to run a command.
+    """
+
+
+class ExecSession(object):
+    """Long-lived shell exec'd into a container, running commands
+    one at a time without creating a new docker exec for each of them.
+
+    As docker-py can't write to exec's stdin, the shell is attached via
+    ``docker exec -i``.
+    """
+
+    def __init__(self, container, argv=None, timeout=EXEC_TIMEOUT,
+                 env=None):
+        self.container = container
+        self.argv = argv or ["docker", "exec", "-i", str(container), "sh"]
+        self.timeout = timeout
+        # e.g. ``DOCKER_HOST`` of container in another host
+        self.env = dict(os.environ, **env) if env else None
+        # marks the end of command output, followed by its exit code
+        self.marker = "__gluuagent_{}__".format(uuid.uuid4().hex)
+        self._proc = None
+        self._buffer = ""
+        self._alive = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        try:
+            with open(os.devnull, "w") as devnull:
+                self._proc = subprocess.Popen(
+                    self.argv, stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE, stderr=devnull, close_fds=True,
+                    env=self.env,
+                )
+        except OSError as exc:
+            raise ExecSessionError(
+                "unable to start shell; reason={}".format(exc))
+        self._buffer = ""
+        self._alive = False
+
+    def run(self, cmd):
+        """Runs shell command; stderr is merged into the output.
+        Raises ``ExecSessionError`` if the command couldn't be sent.
+        """
+        with self._lock:
+            if self._proc is None:
+                self.start()
+
+            # subshell keeps ``exit`` or ``cd`` from affecting the session
+            script = "(\n{}\n) </dev/null 2>&1\n" \
+                     "printf '\\n{} %d\\n' $?\n".format(cmd, self.marker)
+            try:
+                self._proc.stdin.write(script)
+                self._proc.stdin.flush()
+            except IOError as exc:
+                self._close()
+                raise ExecSessionError(
+                    "unable to send command; reason={}".format(exc))
+
+            output, exit_code, eof = self._read_result()
+            if exit_code is None:
+                self._close()
+                if eof and not self._alive and not output:
+                    # shell died before running anything
+                    raise ExecSessionError("shell exited unexpectedly")
+                exit_code = -1
+            self._alive = True
+            return DockerExecResult(cmd=cmd, exit_code=exit_code,
+                                    retval=output.strip())
+
+    def _read_result(self):
+        # returns the output, exit code and whether the shell has exited;
+        # exit code is ``None`` if the shell exited or timed out
+        fd = self._proc.stdout.fileno()
+        deadline = time.time() + self.timeout
+        marker = "\n{} ".format(self.marker)
+
+        while True:
+            pos = self._buffer.find(marker)
+            end = self._buffer.find("\n", pos + len(marker))
+            if pos >= 0 and end >= 0:
+                output = self._buffer[:pos]
+                exit_code = int(self._buffer[pos + len(marker):end])
+                self._buffer = self._buffer[end + 1:]
+                return output, exit_code, False
+
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([fd], [], [],
+                                                   remaining)[0]:
+                return self._buffer, None, False
+            data = os.read(fd, 4096)
+            if not data:
+                return self._buffer, None, True
+            self._buffer += data
+
+    def _close(self):
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+        except IOError:
+            pass
+        if self._proc.poll() is None:
+            self._proc.terminate()
+        self._proc.wait()
+        self._proc.stdout.close()
+        self._proc = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+def wait_until(probe, timeout, interval=0.25, max_interval=2.0, backoff=2):
+    """Polls ``probe`` until it returns a truthy value or ``timeout``
+    (in seconds) is reached. The delay between attempts grows by
+    ``backoff`` factor up to ``max_interval``.
+    """
+    started = time.time()
+    deadline = started + timeout
+    attempts = 0
+
+    while True:
+        attempts += 1
+        ready = bool(probe())
+        now = time.time()
+        if ready or now >= deadline:
+            return ReadinessResult(ready=ready, elapsed=now - started,
+                                   attempts=attempts)
+        time.sleep(min(interval, deadline - now))
+        interval = min(interval * backoff, max_interval)
+
+
+def port_probe(host, port, timeout=1):
+    """Creates a probe to check whether ``host`` accepts TCP connection
+    on ``port``.
+    """
+    def probe():
+        try:
+            sock = socket.create_connection((host, port), timeout)
+        except (socket.error, socket.timeout):
+            return False
+        sock.close()
+        return True
+    return probe
+
+
+def supervisor_probe(run_command, program):
+    """Creates a probe to check whether supervisor ``program``
+    inside the container is running; ``run_command`` runs a shell
+    command in the container.
+    """
+    def probe():
+        try:
+            resp = run_command("supervisorctl status {}".format(program))
+        except docker.errors.APIError:
+            # container might not be fully started yet
+            return False
+        return "RUNNING" in resp.retval
+    return probe
+
+
+def health_probe(client, container):
+    """Creates a probe to check container's health status reported
+    by docker; containers without healthcheck are considered healthy
+    as long as they are running.
+    """
+    def probe():
+        try:
+            state = client.inspect_container(container)["State"]
+        except docker.errors.APIError:
+            return False
+        health = state.get("Health")
+        if health:
+            return health["Status"] == "healthy"
+        return state["Running"] is True
+    return probe
+
+
 class BaseExecutor(object):
-    def __init__(self, node, provider, cluster, docker, db, logger=None):
+    readiness_timeout = DEFAULT_READINESS_TIMEOUT
+
+    def __init__(self, node, provider, cluster, docker, db, logger=None,
+                 docker_env=None):
         self.logger = logger or get_logger(
             name=__name__ + "." + self.__class__.__name__
         )
@@ -31,37 +232,107 @@ class BaseExecutor(object):
         self.cluster = cluster
         self.docker = docker
         self.db = db
+        self.readiness = None
+        # shell is started on the first command
+        self.session = ExecSession(self.node["id"], env=docker_env)
+        self._session_failed = False
 
     def run_entrypoint(self):
         """Entrypoints need to be started/executed after starting container.
         """
 
+    def run_command(self, cmd):
+        """Runs shell command inside the node's container.
+
+        Commands share a single exec'd shell for the executor's lifetime.
+        If the shell fails, the command is run by a new docker exec and
+        a new shell is started on the next command; docker exec is used
+        for the remaining commands if that shell fails as well.
+        """
+        if self.session is not None:
+            try:
+                result = self.session.run(cmd)
+                self._session_failed = False
+                return result
+            except ExecSessionError as exc:
+                self.logger.warn("unable to use shell session in {} node {}; "
+                                 "reason={}".format(self.node["type"],
+                                                    self.node["id"], exc))
+                self.session.close()
+                if self._session_failed:
+                    # the restarted shell failed as well
+                    self.session = None
+                self._session_failed = True
+        return run_docker_exec(self.docker, self.node["id"],
+                               '''sh -c "{}"'''.format(cmd))
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+
+    def readiness_probe(self):
+        return health_probe(self.docker, self.node["id"])
+
+    def wait_ready(self, probe=None, timeout=None):
+        """Blocks until the node is ready or the timeout is reached.
+        The result is kept as ``readiness`` attribute.
+        """
+        with span(self.logger, "readiness", self.node["type"],
+                  node_id=self.node["id"]) as event:
+            self.readiness = wait_until(probe or self.readiness_probe(),
+                                        timeout or self.readiness_timeout)
+            event.update(attempts=self.readiness.attempts,
+                         outcome="success" if self.readiness.ready
+                         else "timeout")
+        if self.readiness.ready:
+            self.logger.info("{} node {} is ready after {:.2f} seconds".format(
+                self.node["type"], self.node["id"], self.readiness.elapsed,
+            ))
+        else:
+            self.logger.warn(
+                "{} node {} is not ready after {:.2f} seconds".format(
+                    self.node["type"], self.node["id"],
+                    self.readiness.elapsed,
+                )
+            )
+        return self.readiness
+
 
 class LdapExecutor(BaseExecutor):
+    readiness_timeout = LDAP_READINESS_TIMEOUT
+
     def run_entrypoint(self):
         # nodes like oxauth/oxtrust/saml need ldap to run first;
-        # hence we set delay to block other node's executors
-        # running simultaneously
-        time.sleep(20)
+        # hence we wait until LDAP port is ready to block other node's
+        # executors running simultaneously
+        self.wait_ready()
+
+    def readiness_probe(self):
+        # only nodes with attached weave IP are reachable from host
+        if self.node["state"] == STATE_SUCCESS and self.node.get("weave_ip"):
+            return port_probe(self.node["weave_ip"], LDAP_PORT)
+        return super(LdapExecutor, self).readiness_probe()
 
 
 class OxauthExecutor(BaseExecutor):
+    readiness_timeout = HTTPD_READINESS_TIMEOUT
+
     def run_entrypoint(self):
-        time.sleep(5)
         self.clean_restart_httpd()
 
+    def readiness_probe(self):
+        return supervisor_probe(self.run_command, "httpd")
+
     def clean_restart_httpd(self):
-        resp = run_docker_exec(self.docker, self.node["id"],
-                               "supervisorctl status httpd")
-        if "RUNNING" not in resp.retval:
+        if not self.wait_ready().ready:
             self.logger.info("httpd process is crashed; restarting ...")
             # httpd refuses to work if previous shutdown was unclean
             # a workaround is to remove ``/var/run/apache2/apache2.pid``
             # before restarting supervisor program
-            cmd = "rm /var/run/apache2/apache2.pid " \
-                  "&& supervisorctl restart httpd"
-            cmd = '''sh -c "{}"'''.format(cmd)
-            run_docker_exec(self.docker, self.node["id"], cmd)
+            self.run_command("rm /var/run/apache2/apache2.pid "
+                             "&& supervisorctl restart httpd")
+            # ``readiness`` tells whether the restarted httpd is up
+            self.wait_ready()
 
 
 class OxtrustExecutor(OxauthExecutor):
@@ -90,8 +361,7 @@ class OxtrustExecutor(OxauthExecutor):
               "|| echo '{0} {1}' >> /etc/hosts" \
             .format(node["weave_ip"],
                     self.cluster["ox_cluster_hostname"])
-        cmd = '''sh -c "{}"'''.format(cmd)
-        result = run_docker_exec(self.docker, self.node["id"], cmd)
+        result = self.run_command(cmd)
 
         if result.exit_code != 0:
             self.logger.error(
@@ -103,7 +373,6 @@ class OxtrustExecutor(OxauthExecutor):
 
 class OxidpExecutor(OxtrustExecutor):
     def run_entrypoint(self):
-        time.sleep(5)
         self.clean_restart_httpd()
         super(OxidpExecutor, self).run_entrypoint()
 
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+import time
+
+from .constants import DOCKER_CERT_PATH
+from .constants import FLEET_WORKERS
+from .constants import RECOVERY_WORKERS
+from .engine import get_docker_client
+from .engine import get_docker_env
+from .eventlog import new_run
+from .eventlog import span
+from .tasks import BaseTask
+from .tasks import RecoveryTask
+from .utils import run_concurrently
+
+
+class ProviderRecoveryTask(RecoveryTask):
+    """Recovers a provider of another host through its docker API
+    (``docker_base_url`` of the provider).
+    """
+
+    def __init__(self, db, provider, master=None, logger=None,
+                 encrypted=False, workers=RECOVERY_WORKERS,
+                 cert_path=DOCKER_CERT_PATH):
+        base_url = provider["docker_base_url"]
+        super(ProviderRecoveryTask, self).__init__(
+            db, logger, encrypted, workers,
+            docker_client=get_docker_client(base_url, cert_path=cert_path),
+            docker_env=get_docker_env(base_url, cert_path),
+        )
+        self.provider = provider
+        self.master = master
+
+    def get_provider(self):
+        return self.provider
+
+    def get_master_address(self):
+        # salt minion config of the host is not readable from here
+        if self.master:
+            return self.master["hostname"]
+        return super(ProviderRecoveryTask, self).get_master_address()
+
+
+class FleetRecoveryTask(BaseTask):
+    """Recovers every provider of the cluster from a single (master)
+    provider, a few providers at a time.
+    """
+
+    def __init__(self, db, logger=None, encrypted=False,
+                 workers=FLEET_WORKERS, node_workers=RECOVERY_WORKERS,
+                 cert_path=DOCKER_CERT_PATH):
+        super(FleetRecoveryTask, self).__init__(db, logger, encrypted)
+        self.workers = workers
+        self.node_workers = node_workers
+        self.cert_path = cert_path
+
+        # host lock held while the local provider is recovered, so runs
+        # of other agent processes of this host don't overlap; not used
+        # if omitted
+        self.lock = None
+
+    def execute(self):
+        """Recovers all providers; returns the result of each provider.
+        """
+        new_run()
+
+        # makes sure the cluster exists before spawning the workers
+        self.get_cluster()
+        local = self.get_provider()
+        providers = self.db.all("providers")
+        masters = [provider for provider in providers
+                   if provider["type"] == "master"]
+
+        self.logger.info("trying to recover {} providers".format(
+            len(providers)))
+        results = run_concurrently(
+            lambda provider: self.recover_provider(
+                provider, local, masters[0] if masters else None),
+            providers,
+            self.workers,
+        )
+
+        recovered = [result for result in results
+                     if result["status"] == "success"]
+        self.logger.info("fleet recovery is finished; {} of {} providers "
+                         "are recovered".format(len(recovered),
+                                                len(results)))
+        return results
+
+    def get_task(self, provider, local, master):
+        if provider["id"] == local["id"]:
+            task = RecoveryTask(self.db, self.logger, self.encrypted,
+                                self.node_workers)
+            task.lock = self.lock
+            return task
+        return ProviderRecoveryTask(self.db, provider, master, self.logger,
+                                    self.encrypted, self.node_workers,
+                                    self.cert_path)
+
+    def recover_provider(self, provider, local, master):
+        result = {
+            "provider": provider["id"],
+            "type": provider["type"],
+            "hostname": provider.get("hostname"),
+            "status": "success",
+            "actions": 0,
+            "duration": 0.0,
+        }
+
+        remote = provider["id"] != local["id"]
+        if remote and not provider.get("docker_base_url"):
+            self.logger.warn("docker API of {} provider {} is unknown; "
+                             "skipping".format(provider["type"],
+                                               provider["id"]))
+            result["status"] = "skipped"
+            return result
+
+        started = time.time()
+        try:
+            with span(self.logger, "provider", provider_id=provider["id"]):
+                task = self.get_task(provider, local, master)
+                task.exclusive("recover-fleet", self.run_task, task, result)
+        except Exception as exc:
+            # a failed provider must not stop the recovery of the others
+            self.logger.error("unable to recover {} provider {}; "
+                              "reason={}".format(provider["type"],
+                                                 provider["id"], exc))
+            result.update(status="failure", error=str(exc))
+        result["duration"] = time.time() - started
+        return result
+
+    def run_task(self, task, result):
+        plan = task.get_plan()
+        result["actions"] = len(plan)
+        task.run_plan(plan)
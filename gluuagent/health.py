@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+import time
+from collections import deque
+
+import docker.errors
+import requests.exceptions
+
+from .constants import HEALTH_CPU_BUDGET
+from .constants import HEALTH_FAILURE_THRESHOLD
+from .constants import HEALTH_FLAP_THRESHOLD
+from .constants import HEALTH_FLAP_WINDOW
+from .constants import HEALTH_MAX_INTERVAL
+from .constants import HEALTH_MAX_RESTART_BACKOFF
+from .constants import HEALTH_MIN_INTERVAL
+from .constants import HEALTH_RESTART_BACKOFF
+from .constants import HEALTH_WORKERS
+from .eventlog import new_run
+from .eventlog import span
+from .executors import BaseExecutor
+from .executors import ExecSessionError
+from .executors import OxauthExecutor
+from .metrics import NODE_FLAPPING
+from .metrics import NODE_HEALTHY
+from .tasks import NODE_EXECUTORS
+from .tasks import RecoveryTask
+from .utils import run_concurrently
+
+
+class NodeHealth(object):
+    """Probe schedule and restart history of a node.
+    """
+
+    def __init__(self, min_interval=HEALTH_MIN_INTERVAL,
+                 max_interval=HEALTH_MAX_INTERVAL,
+                 restart_backoff=HEALTH_RESTART_BACKOFF,
+                 max_restart_backoff=HEALTH_MAX_RESTART_BACKOFF,
+                 flap_threshold=HEALTH_FLAP_THRESHOLD,
+                 flap_window=HEALTH_FLAP_WINDOW):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.restart_backoff = restart_backoff
+        self.max_restart_backoff = max_restart_backoff
+        self.flap_threshold = flap_threshold
+        self.flap_window = flap_window
+
+        self.interval = min_interval
+        self.next_probe = 0
+        self.failures = 0
+        # time of restarts within the flap window
+        self.restarts = deque()
+        # the node is not restarted before this time
+        self.hold_until = 0
+        self.flap_reported = False
+
+    def due(self, now):
+        return now >= self.next_probe
+
+    def record_probe(self, healthy, now):
+        if healthy:
+            self.failures = 0
+            # stable node is probed less and less often
+            self.interval = min(self.interval * 2, self.max_interval)
+        else:
+            self.failures += 1
+            self.interval = self.min_interval
+        self.next_probe = now + self.interval
+
+    def record_restart(self, now):
+        self._forget(now)
+        self.restarts.append(now)
+        backoff = self.restart_backoff * 2 ** (len(self.restarts) - 1)
+        self.hold_until = now + min(backoff, self.max_restart_backoff)
+        self.failures = 0
+
+    def flapping(self, now):
+        self._forget(now)
+        return len(self.restarts) >= self.flap_threshold
+
+    def _forget(self, now):
+        while self.restarts and self.restarts[0] <= now - self.flap_window:
+            self.restarts.popleft()
+
+
+class CpuBudget(object):
+    """Tells how long to pause so CPU time used by the process stays
+    within ``budget`` (a fraction of a CPU).
+    """
+
+    def __init__(self, budget, clock=time.clock, timer=time.time):
+        self.budget = budget
+        self.clock = clock
+        self.timer = timer
+        self._cpu = clock()
+        self._wall = timer()
+
+    def delay(self):
+        """Gets the pause (in seconds) owed for CPU time used since
+        the previous call.
+        """
+        cpu, wall = self.clock(), self.timer()
+        used, elapsed = cpu - self._cpu, wall - self._wall
+
+        delay = 0
+        if self.budget > 0:
+            delay = max(used / self.budget - elapsed, 0)
+        # the pause is part of the next window
+        self._cpu, self._wall = cpu, wall + delay
+        return delay
+
+
+class HealthTask(RecoveryTask):
+    """Periodically probes the service of every local node (e.g. httpd
+    under supervisor or LDAP port) and restarts nodes which stay
+    unhealthy.
+
+    A node failing ``HEALTH_FAILURE_THRESHOLD`` probes in a row is
+    restarted, with growing delay between restarts; a node restarted
+    too often is left alone until the flap window has passed, so
+    a crash-looping container doesn't keep the workers busy.
+    """
+
+    def __init__(self, db, logger=None, encrypted=False,
+                 workers=HEALTH_WORKERS, cpu_budget=HEALTH_CPU_BUDGET,
+                 failure_threshold=HEALTH_FAILURE_THRESHOLD):
+        super(HealthTask, self).__init__(db, logger, encrypted, workers)
+        self.cpu_budget = CpuBudget(cpu_budget)
+        self.failure_threshold = failure_threshold
+        self.health = {}
+        # executors are kept between probes to reuse their shell session
+        self.executors = {}
+
+    def execute(self):
+        new_run()
+        cluster = self.get_cluster()
+        provider = self.get_provider()
+
+        self.logger.info("supervising health of {} provider {}".format(
+            provider["type"], provider["id"],
+        ))
+        try:
+            while True:
+                self.check(provider, cluster)
+                time.sleep(max(self.next_delay(time.time()),
+                               self.cpu_budget.delay()))
+        finally:
+            self.close()
+
+    def get_health(self, node):
+        return self.health.setdefault(node["id"], NodeHealth())
+
+    def next_delay(self, now):
+        """Gets the time until the next probe is due; new nodes are
+        picked up within the minimum interval.
+        """
+        delay = HEALTH_MIN_INTERVAL
+        for health in self.health.values():
+            delay = min(delay, health.next_probe - now)
+        return max(delay, 0)
+
+    def check(self, provider, cluster, now=None):
+        """Probes nodes which are due; returns ``(node, healthy)``
+        pairs.
+        """
+        now = time.time() if now is None else now
+        nodes = [node for node in self.get_nodes(provider)
+                 if self.get_health(node).due(now)]
+        if not nodes:
+            return []
+
+        # state of all containers is loaded by a single listing
+        self.containers.clear()
+        results = run_concurrently(
+            lambda node: self.check_node(node, provider, cluster),
+            nodes,
+            self.workers,
+        )
+        return zip(nodes, results)
+
+    def check_node(self, node, provider, cluster):
+        health = self.get_health(node)
+        healthy = self.probe_node(node, provider, cluster)
+        now = time.time()
+        health.record_probe(healthy, now)
+        NODE_HEALTHY.set(int(healthy), node_id=node["id"],
+                         node_type=node["type"])
+
+        flapping = health.flapping(now)
+        NODE_FLAPPING.set(int(flapping), node_id=node["id"],
+                          node_type=node["type"])
+        if flapping != health.flap_reported:
+            health.flap_reported = flapping
+            if flapping:
+                self.logger.error(
+                    "{} node {} has been restarted {} times in {} seconds; "
+                    "suspending restarts".format(node["type"], node["id"],
+                                                 len(health.restarts),
+                                                 health.flap_window))
+
+        if healthy or health.failures < self.failure_threshold:
+            return healthy
+        if flapping or now < health.hold_until:
+            return healthy
+
+        try:
+            self.exclusive("health", self.heal, node, provider, cluster)
+        except Exception as exc:
+            # a failed restart must not stop the supervisor
+            self.logger.error("unable to restart {} node {}; "
+                              "reason={}".format(node["type"], node["id"],
+                                                 exc))
+        health.record_restart(time.time())
+        return healthy
+
+    def get_executor(self, node, provider, cluster):
+        executor = self.executors.get(node["id"])
+        if executor is None:
+            exec_cls = NODE_EXECUTORS.get(node["type"], BaseExecutor)
+            executor = exec_cls(node, provider, cluster, self.docker,
+                                self.db, self.logger, self.docker_env)
+            self.executors[node["id"]] = executor
+        return executor
+
+    def probe_node(self, node, provider, cluster):
+        try:
+            if self.container_stopped(node["id"], node["type"]):
+                return False
+            with span(self.logger, "health", node["type"],
+                      node_id=node["id"]) as event:
+                executor = self.get_executor(node, provider, cluster)
+                healthy = bool(executor.readiness_probe()())
+                if not healthy:
+                    event["outcome"] = "failure"
+            return healthy
+        except (docker.errors.APIError, ExecSessionError,
+                requests.exceptions.RequestException) as exc:
+            self.logger.warn("unable to probe {} node {}; "
+                             "reason={}".format(node["type"], node["id"],
+                                                exc))
+            return False
+
+    def heal(self, node, provider, cluster):
+        self.logger.warn("{} node {} is unhealthy; restarting".format(
+            node["type"], node["id"],
+        ))
+        executor = self.executors.pop(node["id"], None)
+
+        with span(self.logger, "heal", node["type"], node_id=node["id"]):
+            stopped = self.container_stopped(node["id"], node["type"])
+            if not stopped and isinstance(executor, OxauthExecutor):
+                # restarting httpd is cheaper than restarting the container
+                try:
+                    executor.clean_restart_httpd()
+                finally:
+                    executor.close()
+                return
+
+            if executor:
+                executor.close()
+            if not stopped:
+                self.docker.stop(node["id"])
+                self.containers.invalidate(node["id"])
+            self.recover_node(node, provider, cluster)
+
+    def close(self):
+        for executor in self.executors.values():
+            executor.close()
+        self.executors = {}
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+import os.path
+import time
+from collections import OrderedDict
+
+import docker.errors
+import requests
+
+from .constants import PULL_LOG_INTERVAL
+
+# the digest docker keeps in ``RepoDigests`` belongs to this manifest type
+MANIFEST_V2 = "application/vnd.docker.distribution.manifest.v2+json"
+
+# layer statuses which mean the layer is available locally
+LAYER_DONE_STATUSES = ("Pull complete", "Already exists")
+
+
+def get_local_digest(client, image):
+    """Gets digest of local image as pulled from ``image`` repository.
+    """
+    try:
+        meta = client.inspect_image(image)
+    except docker.errors.APIError:
+        return None
+
+    for repo_digest in meta.get("RepoDigests") or []:
+        name, _, digest = repo_digest.partition("@")
+        if name == image:
+            return digest
+    return None
+
+
+def get_registry_digest(image, tag="latest", timeout=10):
+    """Gets digest of image's manifest from the registry.
+    """
+    registry, name = image.split("/", 1)
+
+    # use CA certificate of the registry trusted by docker daemon
+    # (see README.md)
+    ca_cert = "/etc/docker/certs.d/{}/ca.crt".format(registry)
+    verify = ca_cert if os.path.exists(ca_cert) else True
+
+    resp = requests.head(
+        "https://{}/v2/{}/manifests/{}".format(registry, name, tag),
+        headers={"Accept": MANIFEST_V2},
+        verify=verify,
+        timeout=timeout,
+    )
+    resp.raise_for_status()
+    return resp.headers.get("Docker-Content-Digest")
+
+
+class PullProgress(object):
+    """Aggregates the progress of every layer from ``docker pull``
+    stream, so a summary can be logged instead of every chunk.
+    """
+
+    def __init__(self, image, logger, interval=PULL_LOG_INTERVAL):
+        self.image = image
+        self.logger = logger
+        self.interval = interval
+        self.layers = OrderedDict()
+        self.error = None
+        self.status = None
+        self._last_logged = time.time()
+
+    def update(self, event):
+        if "errorDetail" in event or "error" in event:
+            self.error = event.get("errorDetail") or event["error"]
+            return
+
+        status = event.get("status", "")
+        progress = event.get("progressDetail") or {}
+        layer = event.get("id")
+
+        if layer and ("current" in progress or status in
+                      LAYER_DONE_STATUSES or layer in self.layers):
+            info = self.layers.setdefault(
+                layer, {"status": status, "current": 0, "total": 0},
+            )
+            info["status"] = status
+            if progress.get("total"):
+                info["current"] = progress.get("current", 0)
+                info["total"] = progress["total"]
+        elif not layer:
+            # e.g. ``Digest: ...`` or ``Status: ...``
+            self.status = status
+
+        if time.time() - self._last_logged >= self.interval:
+            self.log()
+
+    def summary(self):
+        done = sum(1 for info in self.layers.values()
+                   if info["status"] in LAYER_DONE_STATUSES)
+        current = sum(info["current"] for info in self.layers.values())
+        total = sum(info["total"] for info in self.layers.values())
+        return "{}: {}/{} layers done, {:.1f}/{:.1f} MB downloaded".format(
+            self.image, done, len(self.layers),
+            current / 1048576.0, total / 1048576.0,
+        )
+
+    def log(self):
+        self._last_logged = time.time()
+        self.logger.info(self.summary())
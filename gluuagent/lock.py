@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+import contextlib
+import copy
+import errno
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+from .constants import LOCK_FILE
+from .constants import LOCK_LEASE
+from .constants import LOCK_POLL
+from .constants import LOCK_TIMEOUT
+from .utils import get_logger
+
+
+class LockError(Exception):
+    pass
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        # the process exists, but belongs to another user
+        return exc.errno == errno.EPERM
+    return True
+
+
+class HostLock(object):
+    """Lock shared by every agent process of the host (init script,
+    manual ``recover``, ``update-images``, watcher, etc.).
+
+    The holder (its PID, command and lease expiry) is recorded in
+    the lock file and the lease is renewed while the lock is held.
+    A lock whose holder has died or stopped renewing its lease (e.g.
+    a hung process) is stale and taken over; ``flock`` only guards the
+    short read-modify-write of the file.
+
+    An instance may be shared by threads (e.g. workers of health
+    supervisor); the token and lease renewer of the holding thread are
+    only dropped while the lock file still names it as the holder, so
+    a thread taking the lock right after is left alone.
+
+    A holder acquiring the lock with ``followup=True`` accepts recovery
+    requests of other processes made with the same ``options`` (e.g.
+    weave encryption); any number of such requests results in a single
+    follow-up recovery (see ``run_exclusive``).
+    """
+
+    def __init__(self, path=LOCK_FILE, lease=LOCK_LEASE, logger=None):
+        self.logger = logger or get_logger(
+            name=__name__ + "." + self.__class__.__name__
+        )
+        self.path = path
+        self.lease = lease
+        self.token = None
+        self._stop = threading.Event()
+        self._renewer = None
+        # guards token and renewer against threads sharing the instance
+        self._mutex = threading.Lock()
+
+    @contextlib.contextmanager
+    def _state(self):
+        """Yields the state of the lock (a dict) under ``flock``; the
+        state is written back if it's changed.
+        """
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError as exc:
+            raise LockError("unable to open lock file {}; "
+                            "reason={}".format(self.path, exc))
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.read(fd, 65536)
+            try:
+                state = json.loads(data) if data else {}
+            except ValueError:
+                # file is corrupted, e.g. by full disk
+                state = {}
+            original = copy.deepcopy(state)
+
+            yield state
+
+            if state != original:
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, json.dumps(state))
+        finally:
+            # closing the file releases flock
+            os.close(fd)
+
+    def _live_holder(self, state, now):
+        holder = state.get("holder")
+        if not holder:
+            return None
+        if holder["expires_at"] <= now or not pid_alive(holder["pid"]):
+            return None
+        return holder
+
+    def holder(self):
+        """Gets the current holder or ``None`` if the lock is free.
+        """
+        with self._state() as state:
+            return self._live_holder(state, time.time())
+
+    def acquire(self, command, followup=False, options=None):
+        """Takes the lock unless another process holds it; returns
+        ``True`` if the lock is taken.
+        """
+        with self._mutex:
+            now = time.time()
+            with self._state() as state:
+                if self._live_holder(state, now):
+                    return False
+
+                stale = state.get("holder")
+                if stale:
+                    self.logger.warn("taking over stale lock of {} "
+                                     "(pid {})".format(stale["command"],
+                                                       stale["pid"]))
+
+                self.token = uuid.uuid4().hex
+                state["holder"] = {
+                    "token": self.token,
+                    "pid": os.getpid(),
+                    "command": command,
+                    "followup": followup,
+                    "options": options,
+                    "acquired_at": now,
+                    "expires_at": now + self.lease,
+                }
+            self._start_renewer()
+            return True
+
+    def _start_renewer(self):
+        self._stop = threading.Event()
+        self._renewer = threading.Thread(target=self._renew_lease,
+                                         args=(self._stop,))
+        self._renewer.daemon = True
+        self._renewer.start()
+
+    def _stop_renewer(self):
+        self._stop.set()
+        if self._renewer:
+            self._renewer.join()
+            self._renewer = None
+
+    def _renew_lease(self, stop):
+        while not stop.wait(self.lease / 3.0):
+            self.renew()
+
+    def renew(self):
+        with self._state() as state:
+            holder = state.get("holder")
+            if not holder:
+                # released by ``finish``
+                return False
+            if holder["token"] != self.token:
+                self.logger.error("lock {} has been taken over by "
+                                  "another process".format(self.path))
+                return False
+            holder["expires_at"] = time.time() + self.lease
+            return True
+
+    def release(self):
+        with self._mutex:
+            if self.token is None:
+                return
+            # renewer is stopped while the lock is still held, so it
+            # can't be confused with the renewer of the next holder
+            self._stop_renewer()
+
+            with self._state() as state:
+                holder = state.get("holder")
+                if holder and holder["token"] == self.token:
+                    state["holder"] = None
+                    # requests left by a failed run must not be served by
+                    # the next holder
+                    if state.pop("followup_requested", False):
+                        self.logger.warn("dropping recovery requested while "
+                                         "{} was running".format(
+                                             holder["command"]))
+                self.token = None
+
+    def request_followup(self, options=None):
+        """Asks the current holder to recover once more when it's done;
+        returns the holder, or ``None`` if the lock is free or the
+        holder doesn't accept follow-up requests made with ``options``.
+        """
+        with self._state() as state:
+            holder = self._live_holder(state, time.time())
+            if (holder and holder["followup"]
+                    and holder.get("options") == options):
+                # requests are not counted; one follow-up serves them all
+                state["followup_requested"] = True
+                return holder
+
+    def finish(self):
+        """Releases the lock unless a follow-up has been requested; in that
+        case the request is cleared, the lock is kept and ``False`` is
+        returned.
+
+        Checking and releasing at once makes sure no request is left
+        behind by a holder which has just finished.
+        """
+        with self._mutex:
+            self._stop_renewer()
+            with self._state() as state:
+                if not state.pop("followup_requested", False):
+                    holder = state.get("holder")
+                    if holder and holder["token"] == self.token:
+                        state["holder"] = None
+                    self.token = None
+                    return True
+            self._start_renewer()
+            return False
+
+
+def run_exclusive(lock, command, func, followup=None, options=None,
+                  coalesce=False, timeout=LOCK_TIMEOUT, poll=LOCK_POLL):
+    """Runs ``func`` while holding the host lock; returns its result.
+
+    If the lock is held by another process, waits up to ``timeout``
+    seconds (raising ``LockError`` afterwards), unless ``coalesce`` is
+    set and the holder accepts follow-up requests made with ``options``;
+    in that case the request is left to the holder and ``None`` is
+    returned.
+
+    With ``followup`` (a recovery function running with ``options``),
+    requests made by other processes while ``func`` runs are served by
+    calling ``followup`` once afterwards.
+    """
+    deadline = time.time() + timeout
+    while not lock.acquire(command, followup is not None, options):
+        if coalesce:
+            holder = lock.request_followup(options)
+            if holder:
+                lock.logger.info(
+                    "{} is running (pid {}); recovery will run again once "
+                    "it's finished".format(holder["command"], holder["pid"]))
+                return None
+
+        if time.time() >= deadline:
+            holder = lock.holder() or {}
+            raise LockError("unable to acquire lock {} held by {} "
+                            "(pid {})".format(lock.path,
+                                              holder.get("command"),
+                                              holder.get("pid")))
+        time.sleep(poll)
+
+    # once ``finish`` has released the lock, another thread sharing it
+    # may take it over, so it must not be released again
+    released = False
+    try:
+        result = func()
+        while followup is not None:
+            released = lock.finish()
+            if released:
+                break
+            lock.logger.info("running recovery requested while {} was "
+                             "running".format(command))
+            followup()
+        return result
+    finally:
+        if not released:
+            lock.release()
+
+
+class Coalescer(object):
+    """Calls ``func`` one at a time; calls made while ``func`` runs share
+    a single follow-up call, so a burst of requests costs at most two
+    runs.
+
+    Each caller gets the result of a run started after its call.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self._cond = threading.Condition()
+        self._running = False
+        self._started = 0
+        self._finished = 0
+        self._outcome = None
+
+    def __call__(self):
+        with self._cond:
+            target = self._started + 1
+            while self._finished < target and self._running:
+                self._cond.wait()
+            if self._finished >= target:
+                return self._result()
+            self._running = True
+            self._started += 1
+
+        try:
+            outcome = (self.func(), None)
+        except Exception:
+            outcome = (None, sys.exc_info())
+
+        with self._cond:
+            self._running = False
+            self._finished = self._started
+            self._outcome = outcome
+            self._cond.notify_all()
+            return self._result()
+
+    def _result(self):
+        result, exc_info = self._outcome
+        if exc_info:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return result
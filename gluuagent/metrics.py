@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+import os
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from contextlib import contextmanager
+
+# upper bounds (in seconds) of histogram buckets
+DEFAULT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, _escape(value))
+                          for name, value in labels) + "}"
+
+
+class Metric(object):
+    """Base class of metrics exported in Prometheus text format.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError("{} requires labels {}".format(
+                self.name, self.labelnames,
+            ))
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Yields ``(name, labels, value)`` tuples.
+        """
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, key, value
+
+    def exposition(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.type),
+        ]
+        for name, labels, value in self.samples():
+            lines.append("{}{} {}".format(name, _format_labels(labels),
+                                          repr(float(value))))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * len(self.buckets), 0),
+            )
+            counts = [count + (value <= bound)
+                      for count, bound in zip(counts, self.buckets)]
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, (counts, total) in items:
+            for count, bound in zip(counts, self.buckets):
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield self.name + "_bucket", key + (("le", le),), count
+            yield self.name + "_count", key, counts[-1]
+            yield self.name + "_sum", key, total
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def exposition(self):
+        return "\n".join(metric.exposition()
+                         for metric in self.metrics) + "\n"
+
+    def write_textfile(self, path):
+        """Writes metrics for node_exporter's textfile collector;
+        the file is replaced atomically.
+        """
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as fp:
+            fp.write(self.exposition())
+        os.rename(tmp_path, path)
+
+    def serve(self, port, addr="127.0.0.1"):
+        """Serves metrics over HTTP in a background thread.
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.exposition()
+                self.send_response(200)
+                self.send_header("Content-Type",
+                                 "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer((addr, port), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+
+REGISTRY = Registry()
+
+PHASE_DURATION = REGISTRY.register(Histogram(
+    "gluuagent_phase_duration_seconds",
+    "Time spent in each recovery/update phase.",
+    ["phase", "node_type"],
+))
+
+PHASE_FAILURES = REGISTRY.register(Counter(
+    "gluuagent_phase_failures_total",
+    "Number of failed recovery/update phases.",
+    ["phase", "node_type"],
+))
+
+RESTARTS = REGISTRY.register(Counter(
+    "gluuagent_restarts_total",
+    "Number of containers restarted by the agent.",
+    ["node_type"],
+))
+
+CONTAINER_RUNNING = REGISTRY.register(Gauge(
+    "gluuagent_container_running",
+    "Whether the container is running (as last seen by the agent).",
+    ["container", "node_type"],
+))
+
+NODE_HEALTHY = REGISTRY.register(Gauge(
+    "gluuagent_node_healthy",
+    "Whether the node passed its last health probe.",
+    ["node_id", "node_type"],
+))
+
+NODE_FLAPPING = REGISTRY.register(Gauge(
+    "gluuagent_node_flapping",
+    "Whether the node is restarted too often to be restarted again.",
+    ["node_id", "node_type"],
+))
+
+
+@contextmanager
+def timed(phase, node_type=""):
+    """Measures the duration of a phase; failures are counted
+    separately.
+    """
+    started = time.time()
+    try:
+        yield
+    except Exception:
+        PHASE_FAILURES.inc(phase=phase, node_type=node_type)
+        raise
+    finally:
+        PHASE_DURATION.observe(time.time() - started,
+                               phase=phase, node_type=node_type)
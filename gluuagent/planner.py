@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+import docker.errors
+
+from .addressing import AddressConflict
+from .addressing import AddressError
+from .addressing import AddressPlan
+from .constants import ACTION_COSTS
+from .constants import ENTRYPOINT_COSTS
+from .constants import STATE_SUCCESS
+from .metrics import CONTAINER_RUNNING
+from .utils import get_logger
+
+
+def get_node_hostnames(node, cluster):
+    """Gets all hostnames of the node registered in weaveDNS.
+    """
+    hostnames = [node["domain_name"]]
+    if node["type"] == "ldap":
+        hostnames.append("ldap.gluu.local")
+    if node["type"] == "nginx":
+        hostnames.append(cluster["ox_cluster_hostname"])
+    return hostnames
+
+
+def get_recovery_tiers(nodes):
+    """Groups nodes into tiers ordered by their ``recovery_priority``.
+
+    Every tier depends on all tiers before it (e.g. oxauth needs ldap),
+    while nodes within the same tier can be recovered simultaneously.
+    """
+    tiers = {}
+    for node in nodes:
+        tiers.setdefault(node["recovery_priority"], []).append(node)
+    return [tiers[priority] for priority in sorted(tiers)]
+
+
+def resolve_nodes(nodes, node_ids=(), node_types=()):
+    """Picks nodes matching any of ``node_ids`` or ``node_types``,
+    along with the nodes of lower recovery tiers they depend on
+    (e.g. ldap nodes for an oxauth node).
+    """
+    targets = set(node["id"] for node in nodes
+                  if node["id"] in node_ids or node["type"] in node_types)
+    if not targets:
+        return []
+
+    priority = max(node["recovery_priority"] for node in nodes
+                   if node["id"] in targets)
+    return [node for node in nodes
+            if node["id"] in targets or node["recovery_priority"] < priority]
+
+
+class Action(object):
+    """A single step of recovery plan; the action may only run after
+    every action in ``depends`` (a list of action IDs) is done.
+    """
+
+    def __init__(self, id, kind, target, node_type="", depends=None,
+                 cost=0.0, params=None):
+        self.id = id
+        self.kind = kind
+        self.target = target
+        self.node_type = node_type
+        self.depends = sorted(set(depends or []))
+        self.cost = cost
+        self.params = params or {}
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "action": self.kind,
+            "target": self.target,
+            "node_type": self.node_type,
+            "depends": self.depends,
+            "cost": self.cost,
+            "params": self.params,
+        }
+
+
+class Plan(object):
+    """Ordered list of recovery actions.
+    """
+
+    def __init__(self, provider=None, cluster=None):
+        self.provider = provider
+        self.cluster = cluster
+        self.actions = []
+        # nodes left out of the plan, e.g. due to invalid weave IP
+        self.errors = []
+        # nodes whose entrypoint is run, keyed by the action target
+        self.nodes = {}
+
+    def __len__(self):
+        return len(self.actions)
+
+    def add(self, kind, target, node_type="", depends=None, cost=None,
+            **params):
+        if cost is None:
+            cost = ACTION_COSTS.get(kind, 0.0)
+        action = Action(len(self.actions) + 1, kind, target, node_type,
+                        depends, cost, params)
+        self.actions.append(action)
+        return action
+
+    def levels(self):
+        """Groups actions into levels; actions of a level only depend
+        on actions of previous levels, hence can run simultaneously.
+        """
+        level_of = {}
+        levels = []
+        # actions only depend on the ones added before them
+        for action in self.actions:
+            level = max([level_of[dep] + 1 for dep in action.depends] or [0])
+            level_of[action.id] = level
+            if level == len(levels):
+                levels.append([])
+            levels[level].append(action)
+        return levels
+
+    @property
+    def total_cost(self):
+        return sum(action.cost for action in self.actions)
+
+    @property
+    def estimated_duration(self):
+        """Estimates the duration of the plan, assuming independent
+        actions run simultaneously.
+        """
+        finished = {}
+        for action in self.actions:
+            finished[action.id] = action.cost + max(
+                [finished[dep] for dep in action.depends] or [0])
+        return max(finished.values() or [0])
+
+    def to_dict(self):
+        return {
+            "provider": self.provider and {"id": self.provider["id"],
+                                           "type": self.provider["type"]},
+            "actions": [action.to_dict() for action in self.actions],
+            "total_cost": self.total_cost,
+            "estimated_duration": self.estimated_duration,
+            "errors": self.errors,
+        }
+
+
+class Planner(object):
+    """Builds recovery plan from the state of containers and weaveDNS
+    entries, without changing anything.
+
+    ``known_nodes`` is the state of nodes saved by the last successful
+    recovery; it's used to find nodes restarted outside the agent.
+    """
+
+    def __init__(self, provider, cluster, containers, dns, executors,
+                 known_nodes=None, logger=None):
+        self.logger = logger or get_logger(
+            name=__name__ + "." + self.__class__.__name__
+        )
+        self.containers = containers
+        self.dns = dns
+        self.executors = executors
+        self.known_nodes = known_nodes or {}
+        self.provider = provider
+        self.cluster = cluster
+        self.plan = Plan(provider, cluster)
+        # actions which require weave router to be running
+        self.weave_actions = []
+        self._addresses = None
+        # reasons why weave IP of a node cannot be attached, keyed by
+        # node ID (``None`` if the IP is fine)
+        self._address_errors = {}
+
+    @property
+    def addresses(self):
+        if self._addresses is None:
+            self._addresses = AddressPlan(self.cluster["weave_ip_network"])
+        return self._addresses
+
+    def index_nodes(self, nodes):
+        """Allocates weave IP of every attached node in the address
+        plan, so a conflict is found regardless of which node is
+        recovered first.
+        """
+        for node in nodes:
+            if node["state"] == STATE_SUCCESS:
+                self.check_address(node)
+
+    def check_address(self, node):
+        """Checks weave IP and prefix length of the node against the
+        address plan; returns the reason if the IP cannot be attached.
+
+        Neither node of a conflict is attached, as it's unknown which
+        one owns the IP.
+        """
+        if node["id"] not in self._address_errors:
+            self._address_errors[node["id"]] = self._allocate(node)
+        return self._address_errors[node["id"]]
+
+    def _allocate(self, node):
+        if node.get("weave_prefixlen") != self.addresses.prefixlen:
+            return ("prefix length {} of {} doesn't match weave network "
+                    "{}".format(node.get("weave_prefixlen"),
+                                node["weave_ip"],
+                                self.addresses.ip_network))
+        try:
+            self.addresses.allocate(node["weave_ip"], node["id"])
+        except AddressConflict as exc:
+            self._address_errors[exc.holder] = (
+                "{} is also taken by {}".format(node["weave_ip"], node["id"])
+            )
+            return str(exc)
+        except AddressError as exc:
+            return str(exc)
+
+    def attachable(self, node):
+        """Checks weave IP of the node; an IP which cannot be attached
+        is reported in plan errors.
+        """
+        error = self.check_address(node)
+        if error:
+            self.logger.error("unable to attach weave IP of {} node {}; "
+                              "reason={}".format(node["type"], node["id"],
+                                                 error))
+            self.plan.errors.append({"target": node["id"],
+                                     "node_type": node["type"],
+                                     "error": error})
+        return not error
+
+    def stopped(self, container, node_type=""):
+        running = self.containers.running(container)
+        CONTAINER_RUNNING.set(int(running), container=container,
+                              node_type=node_type)
+        return running is False
+
+    def plan_weave(self):
+        try:
+            if not self.stopped("weave"):
+                self.logger.info("weave container is already running")
+                return
+        except docker.errors.APIError as exc:
+            err_code = exc.response.status_code
+            if err_code == 404:
+                self.logger.warn(exc)
+            else:
+                raise
+
+        self.logger.warn("weave container is not running")
+        launch = self.plan.add("launch_weave", "weave",
+                               provider_type=self.provider["type"])
+        addr, prefixlen = self.addresses.exposed_cidr
+        expose = self.plan.add("expose_weave", "weave",
+                               depends=[launch.id],
+                               cidr="{}/{}".format(addr, prefixlen))
+        self.weave_actions = [launch.id, expose.id]
+
+    def plan_nodes(self, nodes):
+        """Plans the recovery of ``nodes`` tier by tier (sorted by their
+        recovery_priority property); every tier starts after all actions
+        of the previous tier.
+        """
+        previous = []
+        for tier in get_recovery_tiers(nodes):
+            current = []
+            for node in tier:
+                current.extend(self.plan_node(node, previous))
+            previous = current or previous
+
+    def plan_node(self, node, depends=()):
+        """Plans the recovery of a single node; returns the IDs of
+        planned actions.
+        """
+        depends = list(depends)
+        planned = []
+        container_id = self.containers.container_id(node["id"])
+
+        if not self.stopped(node["id"], node["type"]):
+            self.logger.info("{} node {} is already running".format(
+                node["type"], node["id"]
+            ))
+
+            if self.restarted_externally(node):
+                # container restarted by docker (or by hand) has lost
+                # its weave IP
+                self.logger.warn("{} node {} has been restarted since last "
+                                 "recovery".format(node["type"], node["id"]))
+                self.dns.forget(container_id)
+                return self.plan_attach(node, depends)
+
+            # if weave is relaunched by another tool, DNS entries
+            # might not be restored, hence we're readding the missing
+            # entries; only nodes with SUCCESS state have weave IP
+            # attached, so let weave script find the addresses of the rest
+            ip = None
+            if node["state"] == STATE_SUCCESS:
+                if not self.attachable(node):
+                    return []
+                ip = node["weave_ip"]
+            return self.plan_dns(
+                node, [(container_id, ip, hostname) for hostname
+                       in get_node_hostnames(node, self.cluster)],
+                depends + self.weave_actions,
+            )
+
+        self.logger.warn("{} node {} is not running".format(
+            node["type"], node["id"]
+        ))
+        restart = self.plan.add("restart", node["id"], node["type"],
+                                depends=depends)
+        planned.append(restart.id)
+
+        # weave removes DNS entries of stopped container
+        self.dns.forget(container_id)
+        planned.extend(self.plan_attach(node, [restart.id]))
+
+        exec_cls = self.executors.get(node["type"])
+        if exec_cls:
+            entrypoint = self.plan.add(
+                "entrypoint", node["id"], node["type"], depends=planned,
+                cost=ENTRYPOINT_COSTS.get(node["type"], 0.0),
+            )
+            self.plan.nodes[node["id"]] = node
+            planned.append(entrypoint.id)
+        return planned
+
+    def plan_attach(self, node, depends):
+        """Plans weave IP and DNS entries of (re)started node.
+        """
+        if node["state"] != STATE_SUCCESS:
+            return []
+
+        if not self.attachable(node):
+            return []
+
+        container_id = self.containers.container_id(node["id"])
+        attach = self.plan.add(
+            "attach", node["id"], node["type"],
+            depends=depends + self.weave_actions,
+            cidr="{}/{}".format(node["weave_ip"], node["weave_prefixlen"]),
+        )
+        return [attach.id] + self.plan_dns(
+            node, [(container_id, node["weave_ip"], hostname) for hostname
+                   in get_node_hostnames(node, self.cluster)],
+            [attach.id],
+        )
+
+    def plan_dns(self, node, desired, depends):
+        # reconciler only tracks the records; nothing is written to
+        # weaveDNS while planning
+        added, removed = self.dns.reconcile(desired, RecordSink(),
+                                            node["type"])
+        planned = []
+        for kind, records in [("dns_remove", removed), ("dns_add", added)]:
+            for container_id, ip, fqdn in records:
+                action = self.plan.add(kind, container_id, node["type"],
+                                       depends=depends, ip=ip, fqdn=fqdn)
+                planned.append(action.id)
+        return planned
+
+    def plan_prometheus(self):
+        if self.provider["type"] != "master":
+            return
+
+        if not self.stopped("prometheus"):
+            self.logger.info("prometheus container is already running")
+            return
+
+        self.logger.warn("prometheus container is not running")
+        restart = self.plan.add("restart", "prometheus")
+        addr, prefixlen = self.addresses.prometheus_cidr
+        self.plan.add("attach", "prometheus",
+                      depends=[restart.id] + self.weave_actions,
+                      cidr="{}/{}".format(addr, prefixlen))
+
+    def restarted_externally(self, node):
+        """Checks whether running node has been restarted since last
+        successful recovery.
+        """
+        known = self.known_nodes.get(str(node["id"]))
+        if not known:
+            return False
+        container_id = self.containers.container_id(node["id"])
+        started_at = self.containers.started_at(node["id"])
+        return (known["container"] == container_id
+                and known["started_at"] != started_at)
+
+
+class RecordSink(object):
+    """Stands for ``WeaveBatch`` when DNS records are only planned.
+    """
+
+    def dns_add(self, container_id, ip, fqdn, node_type=""):
+        pass
+
+    def dns_remove(self, container_id, ip, fqdn, node_type=""):
+        pass
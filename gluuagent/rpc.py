@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+import errno
+import json
+import os
+import socket
+import SocketServer
+import stat
+
+from .utils import get_logger
+
+# no third-party module is imported here, so the thin client
+# (``gluu-agent ctl``) starts as fast as the interpreter does
+
+
+class RpcError(Exception):
+    pass
+
+
+def encode_message(message):
+    # one JSON object per line
+    return json.dumps(message) + "\n"
+
+
+def decode_message(line):
+    if not line:
+        raise RpcError("connection closed by agent")
+    try:
+        return json.loads(line)
+    except ValueError:
+        raise RpcError("malformed message {!r}".format(line[:100]))
+
+
+class RpcHandler(SocketServer.StreamRequestHandler):
+    """Answers a single request per connection, i.e.
+    ``{"command": ..., "params": {...}}``, with either
+    ``{"result": ...}`` or ``{"error": ...}``.
+    """
+
+    def handle(self):
+        server = self.server
+        command = None
+        try:
+            request = decode_message(self.rfile.readline())
+            command = request.get("command")
+            handler = server.handlers.get(command)
+            if handler is None:
+                raise RpcError("unknown command {!r}".format(command))
+            response = {"result": handler(**request.get("params") or {})}
+        except (Exception, SystemExit) as exc:
+            # tasks exit when cluster or provider is not found;
+            # that must not take the agent down
+            server.logger.error("unable to run {!r}; reason={}".format(
+                command, exc))
+            response = {"error": str(exc) or exc.__class__.__name__}
+
+        try:
+            self.wfile.write(encode_message(response))
+        except socket.error as exc:
+            # client has gone away
+            server.logger.warn("unable to send response; "
+                               "reason={}".format(exc))
+
+
+class RpcServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """Serves ``handlers`` (callables keyed by command name) over
+    a unix-domain socket only accessible by the owner.
+
+    Each connection is handled in its own thread; handlers are
+    responsible for serializing the work they can't do concurrently.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, handlers, logger=None):
+        self.logger = logger or get_logger(
+            name=__name__ + "." + self.__class__.__name__
+        )
+        self.path = path
+        self.handlers = handlers
+
+        remove_stale_socket(path)
+        SocketServer.UnixStreamServer.__init__(self, path, RpcHandler,
+                                               bind_and_activate=False)
+        # socket is created with owner-only permissions, so there's
+        # no window where other users can connect
+        umask = os.umask(0o177)
+        try:
+            self.server_bind()
+        finally:
+            os.umask(umask)
+        self.server_activate()
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def remove_stale_socket(path):
+    """Removes socket file left by an agent which has died; raises
+    ``RpcError`` if another agent is listening on it.
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise RpcError("{} exists and is not a socket".format(path))
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error as exc:
+        if exc.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+            raise
+        os.unlink(path)
+    else:
+        raise RpcError("another agent is listening on {}".format(path))
+    finally:
+        sock.close()
+
+
+def call(path, command, timeout=None, **params):
+    """Sends ``command`` to the agent listening on ``path``; returns
+    the result or raises ``RpcError``.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        try:
+            sock.connect(path)
+            sock.sendall(encode_message({"command": command,
+                                         "params": params}))
+            response = decode_message(sock.makefile("rb").readline())
+        except socket.error as exc:
+            raise RpcError("unable to reach agent at {}; "
+                           "reason={}".format(path, exc))
+    finally:
+        sock.close()
+
+    if "error" in response:
+        raise RpcError(response["error"])
+    return response.get("result")
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+import threading
+import time
+
+from .constants import SECRET_TTL
+from .utils import decrypt_text
+
+
+class SecretCache(object):
+    """Keeps decrypted cluster secrets in memory for ``ttl`` seconds,
+    so each secret is decrypted once per process instead of on every use
+    (e.g. each weave relaunch in watch mode).
+
+    Plaintexts are never written anywhere; expired entries are dropped
+    on the next lookup.
+    """
+
+    def __init__(self, ttl=SECRET_TTL, decrypt=None):
+        self.ttl = ttl
+        self.decrypt = decrypt or decrypt_text
+        self._secrets = {}
+        self._lock = threading.Lock()
+
+    def get(self, encrypted_text, key):
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._secrets.get((encrypted_text, key))
+            if entry is None:
+                # decrypting under the lock makes concurrent callers
+                # wait for the same plaintext
+                plaintext = self.decrypt(encrypted_text, key)
+                entry = (plaintext, now + self.ttl)
+                self._secrets[(encrypted_text, key)] = entry
+            return entry[0]
+
+    def admin_password(self, cluster):
+        """Gets the plaintext of cluster's ``admin_pw``, e.g. to be used
+        as weave password.
+        """
+        return self.get(cluster["admin_pw"], cluster["passkey"])
+
+    def _expire(self, now):
+        for cache_key, (_, expires_at) in self._secrets.items():
+            if expires_at <= now:
+                del self._secrets[cache_key]
+
+    def clear(self):
+        with self._lock:
+            self._secrets.clear()
+
+
+# secrets shared by all tasks of the process
+SECRETS = SecretCache()
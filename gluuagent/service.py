@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+import collections
+import os
+import threading
+import time
+
+from .constants import RECOVERY_WORKERS
+from .eventlog import new_run
+from .lock import Coalescer
+from .rpc import RpcServer
+from .tasks import ImageUpdateTask
+from .tasks import RecoveryTask
+from .tasks import format_node
+from .utils import get_logger
+
+
+class ResidentRecoveryTask(RecoveryTask):
+    """Recovery task kept alive between commands; local provider is only
+    looked up again after the database file has changed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ResidentRecoveryTask, self).__init__(*args, **kwargs)
+        self._providers = None
+        self._provider = None
+
+    def get_provider(self):
+        # snapshot replaces its tables whenever the file is reloaded
+        providers = self.db.table("providers")
+        if providers is not self._providers:
+            self._provider = super(ResidentRecoveryTask, self).get_provider()
+            self._providers = providers
+        return dict(self._provider)
+
+
+class AgentService(object):
+    """Runs commands sent over the control socket, reusing the database
+    snapshot, docker client (and its connection pool) and local provider
+    between commands.
+
+    Commands changing containers run one at a time (holding the host
+    lock, if given); plain ``recover`` requests arriving while a command
+    runs are served by a single follow-up run. ``status`` is answered
+    immediately.
+    """
+
+    def __init__(self, db, logger=None, encrypted=False,
+                 workers=RECOVERY_WORKERS, state_file=None, lock=None):
+        self.logger = logger or get_logger(
+            name=__name__ + "." + self.__class__.__name__
+        )
+        self.db = db
+        self.task = ResidentRecoveryTask(db, self.logger, encrypted, workers,
+                                         state_file=state_file)
+        self.task.lock = lock
+        self.started_at = time.time()
+        self.requests = collections.Counter()
+        self.running = None
+        self.last_run = None
+        self._lock = threading.Lock()
+        self._recover_changed = Coalescer(
+            lambda: self.run("recover", self._recover, False, None, None))
+
+    @property
+    def handlers(self):
+        return {
+            "recover": self.recover,
+            "recover-node": self.recover_node,
+            "update-images": self.update_images,
+            "status": self.status,
+        }
+
+    def run(self, command, func, *args):
+        return self.track(command, self.task.exclusive, command, func, *args)
+
+    def track(self, command, func, *args):
+        """Runs the command one at a time, keeping the outcome of the last
+        run for ``status``.
+        """
+        self.requests[command] += 1
+        with self._lock:
+            self.running = command
+            started_at = time.time()
+            outcome = "failure"
+            try:
+                result = func(*args)
+                outcome = "success"
+                return result
+            finally:
+                self.running = None
+                self.last_run = {
+                    "command": command,
+                    "outcome": outcome,
+                    "started_at": started_at,
+                    "duration": time.time() - started_at,
+                }
+
+    def recover(self, full=False, node_ids=None, node_types=None):
+        if not (full or node_ids or node_types):
+            return self._recover_changed()
+        return self.run("recover", self._recover, full, node_ids,
+                        node_types)
+
+    def _recover(self, full, node_ids, node_types):
+        plan = self.task.execute(node_ids, node_types, full)
+        return {
+            "provider": plan.provider["id"],
+            "actions": len(plan),
+            "errors": plan.errors,
+        }
+
+    def recover_node(self, node_id):
+        return self.run("recover-node", self._recover_node, node_id)
+
+    def _recover_node(self, node_id):
+        provider = self.task.get_provider()
+        node = self.db.get(node_id, "nodes")
+        if not node or node.get("provider_id") != provider["id"]:
+            raise ValueError("node {} is not found on {} provider "
+                             "{}".format(node_id, provider["type"],
+                                         provider["id"]))
+
+        new_run()
+        self.task.containers.clear()
+        executor = self.task.recover_node(format_node(node), provider,
+                                          self.task.get_cluster())
+        return {
+            "node": node["id"],
+            "type": node["type"],
+            "restarted": executor is not None,
+        }
+
+    def update_images(self, parallel=None, rolling=False, batch_size=None):
+        # host lock is only taken once the images are pulled
+        return self.track("update-images", self._update_images, parallel,
+                          rolling, batch_size)
+
+    def _update_images(self, parallel, rolling, batch_size):
+        kwargs = {"rolling": rolling, "docker_client": self.task.docker,
+                  "recovery_task": self.task}
+        if parallel:
+            kwargs["pull_workers"] = parallel
+        if batch_size:
+            kwargs["batch_size"] = batch_size
+        ImageUpdateTask(self.db, self.logger, self.task.encrypted,
+                        **kwargs).execute()
+        return {}
+
+    def status(self):
+        provider = self.task.get_provider()
+        return {
+            "pid": os.getpid(),
+            "uptime": time.time() - self.started_at,
+            "database": self.db.database_uri,
+            "provider": {"id": provider["id"], "type": provider["type"]},
+            "running": self.running,
+            "requests": dict(self.requests),
+            "last_run": self.last_run,
+        }
+
+    def serve(self, path):
+        """Accepts commands on the unix-domain socket at ``path`` until
+        interrupted.
+        """
+        server = RpcServer(path, self.handlers, self.logger)
+        self.logger.info("listening for commands on {}".format(path))
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
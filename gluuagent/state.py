@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+import hashlib
+import json
+import os
+import tempfile
+
+from .utils import get_logger
+
+
+def fingerprint(*values):
+    """Computes a short digest of JSON-serializable ``values``.
+    """
+    data = json.dumps(values, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+class StateStore(object):
+    """Persists the state of the last successful recovery, i.e. fingerprint
+    of weave container and fingerprint of every recovered node, so the next
+    run can skip nodes which haven't changed since then.
+    """
+
+    def __init__(self, path, logger=None):
+        self.path = path
+        self.logger = logger or get_logger(
+            name=__name__ + "." + self.__class__.__name__
+        )
+
+    def load(self):
+        """Loads the saved state; an empty state is returned if the file
+        is missing or unreadable.
+        """
+        try:
+            with open(self.path) as fp:
+                state = json.load(fp)
+        except IOError:
+            return {"weave": None, "nodes": {}}
+        except ValueError as exc:
+            self.logger.warn("unable to read state file {}; "
+                             "reason={}".format(self.path, exc))
+            return {"weave": None, "nodes": {}}
+        return {"weave": state.get("weave"),
+                "nodes": state.get("nodes") or {}}
+
+    def save(self, weave, nodes):
+        """Saves fingerprint of weave container and ``nodes`` (a mapping
+        of node ID and its state).
+        """
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        # the file is replaced atomically, so a crashed run never leaves
+        # a partially written state
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as fp:
+                json.dump({"weave": weave, "nodes": nodes}, fp,
+                          sort_keys=True)
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
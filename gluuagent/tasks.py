@@ -4,27 +4,55 @@
 # All rights reserved.
 
 import abc
+import functools
 import json
-import socket
 import sys
+import threading
+import time
 
-import docker
 import docker.errors
-import sh
-import yaml
+import requests.exceptions
 
 from .constants import STATE_SUCCESS
 from .constants import STATE_DISABLED
+from .constants import NODE_IMAGES
+from .constants import PULL_RETRIES
+from .constants import PULL_WORKERS
 from .constants import RECOVERY_PRIORITY_CHOICES
+from .constants import RECOVERY_WORKERS
+from .constants import ROLLING_BATCH_SIZE
+from .constants import WATCH_DEDUP_WINDOW
+from .constants import WATCH_EVENTS
+from .constants import WATCH_RECONNECT_DELAY
+from .containers import ContainerStateCache
+from .engine import get_docker_client
+from .eventlog import new_run
+from .eventlog import span
 from .executors import LdapExecutor
 from .executors import OxauthExecutor
 from .executors import OxtrustExecutor
 from .executors import OxidpExecutor
 from .executors import NginxExecutor
+from .images import PullProgress
+from .lock import run_exclusive
+from .metrics import CONTAINER_RUNNING
+from .metrics import RESTARTS
+from .planner import Planner
+from .planner import get_node_hostnames
+from .planner import get_recovery_tiers
+from .planner import resolve_nodes
+from .secrets import SECRETS
+from .state import StateStore
+from .state import fingerprint
+from .images import get_local_digest
+from .images import get_registry_digest
 from .utils import get_logger
-from .utils import decrypt_text
-from .utils import get_exposed_cidr
-from .utils import get_prometheus_cidr
+from .utils import get_local_hostnames
+from .utils import run_concurrently
+from .weave import DnsReconciler
+from .weave import WeaveBatch
+from .weave import WeaveClient
+from .weave import weave_cli
 
 
 def format_node(data):
@@ -37,21 +65,49 @@ def format_node(data):
     return data
 
 
+# entrypoint of every node type
+NODE_EXECUTORS = {
+    "ldap": LdapExecutor,
+    "oxauth": OxauthExecutor,
+    "oxtrust": OxtrustExecutor,
+    "oxidp": OxidpExecutor,
+    "nginx": NginxExecutor,
+}
+
+
 class BaseTask(object):
     @abc.abstractmethod
     def execute(self):
         pass
 
-    def __init__(self, db, logger=None, encrypted=False):
+    def __init__(self, db, logger=None, encrypted=False,
+                 container_filters=None, docker_client=None,
+                 docker_env=None):
         self.logger = logger or get_logger(
             name=__name__ + "." + self.__class__.__name__
         )
         self.db = db
         self.encrypted = encrypted
 
-        # as we only need to recover containers locally,
-        # we use docker.Client with unix socket connection
-        self.docker = docker.Client()
+        # by default we only need to recover containers locally,
+        # hence we use docker.Client with pooled unix socket connections,
+        # shared by all recovery workers
+        self.docker = docker_client or get_docker_client()
+
+        # environment of docker CLI and weave script run by the task,
+        # e.g. ``DOCKER_HOST`` when ``docker_client`` is a remote engine
+        self.docker_env = docker_env
+
+        # state of all containers is loaded at once on first lookup
+        self.containers = ContainerStateCache(self.docker,
+                                              container_filters)
+
+    def get_cluster(self):
+        try:
+            return self.db.all("clusters")[0]
+        except IndexError:
+            self.logger.error("cluster is not found")
+            sys.exit(1)
 
     def get_provider(self):
         try:
@@ -60,10 +116,11 @@ class BaseTask(object):
             # 1. find by FQDN
             # 2. find by hostname of the machine where the Python interpreter
             #    is currently executing
+            fqdn, hostname = get_local_hostnames()
             provider = self.db.search_from_table(
                 "providers",
-                (self.db.where("hostname") == socket.getfqdn())
-                | (self.db.where("hostname") == socket.gethostname()),
+                (self.db.where("hostname") == fqdn)
+                | (self.db.where("hostname") == hostname),
             )[0]
             return provider
         except IndexError:
@@ -72,94 +129,278 @@ class BaseTask(object):
 
 
 class RecoveryTask(BaseTask):
-    def execute(self):
-        try:
-            cluster = self.db.all("clusters")[0]
-        except IndexError:
-            self.logger.error("cluster is not found")
-            sys.exit(1)
-
-        provider = self.get_provider()
+    def __init__(self, db, logger=None, encrypted=False,
+                 workers=RECOVERY_WORKERS, container_filters=None,
+                 state_file=None, docker_client=None, docker_env=None):
+        super(RecoveryTask, self).__init__(db, logger, encrypted,
+                                           container_filters, docker_client,
+                                           docker_env)
+        self.workers = workers
+
+        # state of the last successful recovery; without state file,
+        # every node is checked on each run
+        self.state = None
+        if state_file:
+            self.state = StateStore(state_file, self.logger)
+        self.known_nodes = {}
+
+        # connection to weave router's HTTP API is reused by all batches
+        self.weave = WeaveClient()
+
+        # host lock held while containers are changed, so runs of other
+        # agent processes don't overlap; not used if omitted
+        self.lock = None
+
+    def execute(self, node_ids=None, node_types=None, full=False):
+        new_run()
+
+        # with ``full``, every node is checked regardless of the state
+        # of last recovery
+        if full and self.state:
+            self.state.clear()
+
+        plan = self.get_plan(node_ids, node_types)
+        provider = plan.provider
 
         self.logger.info("trying to recover {} provider {}".format(
             provider["type"], provider["id"],
         ))
-
-        # recover weave container
-        self.recover_weave(provider, cluster)
-
-        # recover all provider's nodes
-        self.recover_nodes(provider, cluster)
-
-        # recover prometheus container
-        self.recover_prometheus(provider, cluster)
+        executors = self.run_plan(plan)
+
+        # state is only saved after the recovery is finished; nodes which
+        # are not recovered are left out, so the next run checks them
+        # again
+        if self.state is not None and not (node_ids or node_types):
+            failed = set(error["target"] for error in plan.errors)
+            failed.update(
+                node_id for node_id, executor in executors.items()
+                if executor and executor.readiness is not None
+                and not executor.readiness.ready
+            )
+            self.save_state([node for node in self.get_nodes(provider)
+                             if node["id"] not in failed], plan.cluster)
 
         self.logger.info(
             "recovery process for {} provider {} is finished".format(
                 provider["type"], provider["id"])
         )
+        return plan
+
+    @property
+    def options(self):
+        """Settings of the recovery; requests of other processes are only
+        served by a follow-up recovery running with the same settings.
+        """
+        return {
+            "encrypted": self.encrypted,
+            "workers": self.workers,
+            "state_file": self.state.path if self.state else None,
+        }
+
+    def exclusive(self, command, func, *args, **kwargs):
+        """Runs ``func`` while holding the host lock; recoveries requested
+        by other processes in the meantime are run once afterwards.
+
+        With ``coalesce=True``, the call is left to another process
+        already holding the lock (and ``None`` is returned).
+        """
+        if self.lock is None:
+            return func(*args)
+        return run_exclusive(
+            self.lock, command, lambda: func(*args),
+            followup=functools.partial(RecoveryTask.execute, self),
+            options=self.options,
+            coalesce=kwargs.get("coalesce", False),
+        )
 
-    def container_stopped(self, container):
-        meta = self.docker.inspect_container(container)
-        return meta["State"]["Running"] is False
+    def get_plan(self, node_ids=None, node_types=None):
+        """Builds the recovery plan of local provider; nothing is changed
+        until the plan is passed to ``run_plan``.
 
-    def recover_prometheus(self, provider, cluster):
-        if provider["type"] == "master":
-            if not self.container_stopped("prometheus"):
-                self.logger.info("prometheus container is already running")
-                return
+        If ``node_ids`` or ``node_types`` is given, only the matching
+        nodes and the nodes they depend on are recovered.
+        """
+        # make sure we're working with fresh snapshot of containers
+        self.containers.clear()
 
-            self.logger.warn("prometheus container is not running")
-            self.logger.info("restarting prometheus container")
-            self.docker.restart("prometheus")
+        cluster = self.get_cluster()
+        provider = self.get_provider()
+        nodes = self.get_nodes(provider)
 
-            addr, prefixlen = get_prometheus_cidr(cluster["weave_ip_network"])
-            sh.weave("attach", "{}/{}".format(addr, prefixlen), "prometheus")
+        with span(self.logger, "plan") as event:
+            planner = self.get_planner(provider, cluster)
+            planner.index_nodes(nodes)
 
-    def recover_weave(self, provider, cluster):
+            if node_ids or node_types:
+                self.plan_targets(planner, nodes, node_ids or (),
+                                  node_types or ())
+                event["actions"] = len(planner.plan)
+                return planner.plan
+
+            planner.plan_weave()
+
+            changed_nodes = nodes
+            if self.state is not None:
+                changed_nodes = self.get_changed_nodes(
+                    nodes, cluster, bool(planner.weave_actions),
+                )
+                planner.known_nodes = self.known_nodes
+                self.logger.info("{} of {} nodes have changed since last "
+                                 "recovery".format(len(changed_nodes),
+                                                   len(nodes)))
+
+            if changed_nodes:
+                # current weaveDNS entries are loaded once; only
+                # the difference with the desired entries is planned
+                # (entries of another host are not reachable, hence
+                # all of them are added)
+                if self.docker_env is None:
+                    planner.dns.load()
+                planner.plan_nodes(changed_nodes)
+
+            planner.plan_prometheus()
+            event["actions"] = len(planner.plan)
+        return planner.plan
+
+    def plan_targets(self, planner, nodes, node_ids, node_types):
+        """Plans the recovery of the given nodes (and their dependencies)
+        only; weave is relaunched if needed, prometheus is left alone.
+        """
+        known_ids = set(node["id"] for node in nodes)
+        for node_id in node_ids:
+            if node_id not in known_ids:
+                self.logger.error("node {} is not found".format(node_id))
+                planner.plan.errors.append({"target": node_id,
+                                            "node_type": "",
+                                            "error": "node is not found"})
+        for node_type in node_types:
+            if not any(node["type"] == node_type for node in nodes):
+                self.logger.warn("no {} node is found".format(node_type))
+
+        selected = resolve_nodes(nodes, node_ids, node_types)
+        if not selected:
+            return
+
+        self.logger.info("recovering {} of {} nodes".format(
+            len(selected), len(nodes)))
+        planner.plan_weave()
+        if self.docker_env is None:
+            planner.dns.load()
+        planner.plan_nodes(selected)
+
+    def get_planner(self, provider, cluster):
+        return Planner(provider, cluster, self.containers,
+                       DnsReconciler(self.weave, self.logger),
+                       NODE_EXECUTORS, logger=self.logger)
+
+    def run_plan(self, plan):
+        """Runs the plan level by level; actions of the same level don't
+        depend on each other, hence they run simultaneously.
+
+        Returns executors of the nodes whose entrypoint has been run,
+        keyed by node ID.
+        """
+        executors = {}
         try:
-            if not self.container_stopped("weave"):
-                self.logger.info("weave container is already running")
-                return
-        except docker.errors.APIError as exc:
-            err_code = exc.response.status_code
-            if err_code == 404:
-                self.logger.warn(exc)
-            else:
-                raise
-
-        self.logger.warn("weave container is not running")
-        self.logger.info("restarting weave container")
+            for level in plan.levels():
+                batch = WeaveBatch(self.weave, self.logger, self.workers,
+                                   self.docker_env)
+                actions = []
+                for action in level:
+                    if not self.queue_action(action, batch):
+                        actions.append(action)
+
+                results = run_concurrently(
+                    lambda action: self.run_action(action, plan),
+                    actions,
+                    self.workers,
+                )
+                # weave operations of the level are sent at once
+                batch.flush()
+
+                for action, result in zip(actions, results):
+                    if action.kind == "entrypoint":
+                        executors[action.target] = result
+        finally:
+            self.weave.close()
+        return executors
+
+    def queue_action(self, action, batch):
+        """Queues weave operations into ``batch``; returns ``False``
+        if the action is not a weave operation.
+        """
+        if action.kind == "attach":
+            self.logger.info("attaching weave IP {}".format(
+                action.params["cidr"]))
+            batch.attach(action.params["cidr"], action.target,
+                         action.node_type)
+        elif action.kind == "dns_add":
+            self.logger.info("adding {} to local DNS server".format(
+                action.params["fqdn"]))
+            batch.dns_add(action.target, action.params["ip"],
+                          action.params["fqdn"], action.node_type)
+        elif action.kind == "dns_remove":
+            batch.dns_remove(action.target, action.params["ip"],
+                             action.params["fqdn"], action.node_type)
+        else:
+            return False
+        return True
 
+    def run_action(self, action, plan):
+        if action.kind == "launch_weave":
+            with span(self.logger, "weave"):
+                self.launch_weave(plan.provider, plan.cluster)
+        elif action.kind == "expose_weave":
+            weave_cli("expose", action.params["cidr"], env=self.docker_env)
+        elif action.kind == "restart":
+            self.logger.info("restarting {} container".format(action.target))
+            self.restart_container(action.target, action.node_type)
+        elif action.kind == "entrypoint":
+            return self.setup_node(plan.nodes[action.target],
+                                   plan.provider, plan.cluster)
+
+    def container_stopped(self, container, node_type=""):
+        running = self.containers.running(container)
+        CONTAINER_RUNNING.set(int(running), container=container,
+                              node_type=node_type)
+        return running is False
+
+    def restart_container(self, container, node_type=""):
+        with span(self.logger, "restart", node_type, container=container):
+            self.docker.restart(container)
+        self.containers.invalidate(container)
+        RESTARTS.inc(node_type=node_type)
+        CONTAINER_RUNNING.set(1, container=container, node_type=node_type)
+
+    def launch_weave(self, provider, cluster):
         passwd = ""
         if self.encrypted:
-            passwd = decrypt_text(cluster["admin_pw"], cluster["passkey"])
-
-        if provider["type"] == "master":
-            sh.weave(
-                "launch-router",
-                "--password", passwd,
-                "--dns-domain", "gluu.local",
-                "--ipalloc-range", cluster["weave_ip_network"],
-                "--ipalloc-default-subnet", cluster["weave_ip_network"],
-            )
-        else:
-            with open("/etc/salt/minion") as fp:
-                config = fp.read()
-                opts = yaml.safe_load(config)
-                sh.weave(
-                    "launch-router",
-                    "--password", passwd,
-                    "--dns-domain", "gluu.local",
-                    "--ipalloc-range", cluster["weave_ip_network"],
-                    "--ipalloc-default-subnet", cluster["weave_ip_network"],
-                    opts["master"],
-                )
-
-        addr, prefixlen = get_exposed_cidr(cluster["weave_ip_network"])
-        sh.weave("expose", "{}/{}".format(addr, prefixlen))
-
-    def recover_nodes(self, provider, cluster):
+            passwd = SECRETS.admin_password(cluster)
+
+        args = [
+            "launch-router",
+            "--password", passwd,
+            "--dns-domain", "gluu.local",
+            "--ipalloc-range", cluster["weave_ip_network"],
+            "--ipalloc-default-subnet", cluster["weave_ip_network"],
+        ]
+        # consumer's router connects to master's router
+        if provider["type"] != "master":
+            args.append(self.get_master_address())
+        weave_cli(*args, env=self.docker_env)
+
+        self.containers.invalidate("weave")
+
+    def get_master_address(self):
+        # only consumer providers read salt minion config
+        import yaml
+
+        with open("/etc/salt/minion") as fp:
+            config = fp.read()
+            opts = yaml.safe_load(config)
+            return opts["master"]
+
+    def get_nodes(self, provider):
         _nodes = self.db.search_from_table(
             "nodes",
             (self.db.where("provider_id") == provider["id"])
@@ -180,67 +421,233 @@ class RecoveryTask(BaseTask):
         # attach the recovery priority
         disabled_nodes = [format_node(node) for node in _nodes]
 
-        # sort nodes by its recovery_priority property
-        # so we will have a fully recovered nodes
-        nodes = sorted(success_nodes + disabled_nodes,
-                       key=lambda node: node["recovery_priority"])
+        return success_nodes + disabled_nodes
 
-        for node in nodes:
-            if not self.container_stopped(node["id"]):
-                self.logger.info("{} node {} is already running".format(
-                    node["type"], node["id"]
-                ))
+    def weave_fingerprint(self):
+        try:
+            return fingerprint(self.containers.container_id("weave"),
+                               self.containers.started_at("weave"))
+        except docker.errors.APIError:
+            return None
+
+    def node_state(self, node, cluster):
+        """Gets the current state of the node to be compared with
+        the state saved by the last successful recovery.
+        """
+        container_id = self.containers.container_id(node["id"])
+        started_at = self.containers.started_at(node["id"])
+        return {
+            "container": container_id,
+            "started_at": started_at,
+            "fingerprint": fingerprint(
+                container_id, started_at, node["state"],
+                node.get("weave_ip"), get_node_hostnames(node, cluster),
+            ),
+        }
 
-                # if weave is relaunched by another tool, DNS entries
-                # might not be restored, hence we're readding the entries
-                sh.weave("dns-add", node["id"], "-h", node["domain_name"])
-                if node["type"] == "ldap":
-                    sh.weave("dns-add", node["id"], "-h", "ldap.gluu.local")
+    def get_changed_nodes(self, nodes, cluster, weave_relaunched=False):
+        """Filters out running nodes whose state is the same as saved
+        by the last successful recovery.
+        """
+        saved = self.state.load()
+        if weave_relaunched or saved["weave"] != self.weave_fingerprint():
+            # relaunched weave has lost IP addresses and DNS entries
+            # of every node
+            self.known_nodes = {}
+        else:
+            self.known_nodes = saved["nodes"]
+
+        def changed(node):
+            if self.container_stopped(node["id"], node["type"]):
+                return True
+            known = self.known_nodes.get(str(node["id"]))
+            if not known:
+                return True
+            state = self.node_state(node, cluster)
+            return known["fingerprint"] != state["fingerprint"]
+
+        flags = run_concurrently(changed, nodes, self.workers)
+        return [node for node, flag in zip(nodes, flags) if flag]
+
+    def save_state(self, nodes, cluster):
+        states = run_concurrently(
+            lambda node: self.node_state(node, cluster),
+            nodes,
+            self.workers,
+        )
+        self.state.save(self.weave_fingerprint(), dict(
+            (str(node["id"]), state) for node, state in zip(nodes, states)
+        ))
 
-                if node["type"] == "nginx":
-                    sh.weave("dns-add", node["id"], "-h", cluster["ox_cluster_hostname"])  # noqa
-                continue
+    def recover_node(self, node, provider, cluster):
+        """Recovers a single node; returns the executor if node has been
+        restarted.
+        """
+        return self.recover_nodes([node], provider, cluster).get(node["id"])
+
+    def recover_nodes(self, nodes, provider, cluster):
+        """Recovers ``nodes`` with a single plan; returns the executors
+        of restarted nodes, keyed by node ID.
+        """
+        planner = self.get_planner(provider, cluster)
+        planner.index_nodes(self.get_nodes(provider))
+        planner.dns.load()
+        planner.plan_nodes(nodes)
+        return self.run_plan(planner.plan)
 
-            self.logger.warn("{} node {} is not running; restarting ..".format(
-                node["type"], node["id"]
-            ))
+    def setup_node(self, node, provider, cluster):
+        exec_cls = NODE_EXECUTORS.get(node["type"])
+        if exec_cls:
+            self.logger.info("running entrypoint for "
+                             "{} node {}".format(node["type"], node["id"]))
+            executor = exec_cls(node, provider, cluster,
+                                self.docker, self.db, self.logger,
+                                self.docker_env)
+            try:
+                with span(self.logger, "entrypoint", node["type"],
+                          node_id=node["id"]):
+                    executor.run_entrypoint()
+            finally:
+                # shell session is restarted if executor is used again
+                executor.close()
+            return executor
+
+
+class WatchTask(RecoveryTask):
+    """Recovers nodes as soon as docker reports they are stopped.
+
+    Events are only queued while they're read; nodes which died in the
+    meantime are recovered at once by a worker thread, e.g. while the
+    host lock is held by another process.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(WatchTask, self).__init__(*args, **kwargs)
+        # time the last recovery of a node has started, keyed by
+        # container ID
+        self.recovered_at = {}
+        # time of the latest event of containers waiting for recovery,
+        # keyed by container ID
+        self.pending = {}
+        self._pending_cond = threading.Condition()
 
-            self.docker.restart(node["id"])
-            if node["state"] == STATE_SUCCESS:
-                cidr = "{}/{}".format(node["weave_ip"],
-                                      node["weave_prefixlen"])
-                self.logger.info("attaching weave IP {}".format(cidr))
-                sh.weave("attach", "{}".format(cidr), node["id"])
+    def execute(self):
+        cluster = self.get_cluster()
+        provider = self.get_provider()
 
-                self.logger.info("adding {} to local "
-                                 "DNS server".format(node["domain_name"]))
-                sh.weave("dns-add", node["id"], "-h", node["domain_name"])
+        worker = threading.Thread(target=self.recover_forever,
+                                  args=(provider, cluster))
+        worker.daemon = True
+        worker.start()
 
-                if node["type"] == "ldap":
-                    self.logger.info("adding ldap.gluu.local to "
-                                     "local DNS server")
-                    sh.weave("dns-add", node["id"], "-h", "ldap.gluu.local")
+        while True:
+            try:
+                # subscribe before running the catch-up recovery,
+                # so events emitted in the meantime are not missed
+                events = self.docker.events(
+                    filters={"event": list(WATCH_EVENTS)}, decode=True,
+                )
+                self.exclusive("watch", super(WatchTask, self).execute,
+                               coalesce=True)
 
-                if node["type"] == "nginx":
-                    sh.weave("dns-add", node["id"], "-h", cluster["ox_cluster_hostname"])  # noqa
-            self.setup_node(node, provider, cluster)
+                self.logger.info("watching events of {} provider {}".format(
+                    provider["type"], provider["id"],
+                ))
+                for event in events:
+                    self.handle_event(event)
+            except (docker.errors.APIError,
+                    requests.exceptions.RequestException) as exc:
+                self.logger.warn("lost connection to docker events; "
+                                 "reason={}".format(exc))
+            time.sleep(WATCH_RECONNECT_DELAY)
+
+    def handle_event(self, event):
+        # newer docker API reports event name as ``Action``
+        status = event.get("status") or event.get("Action")
+        if status not in WATCH_EVENTS or not event.get("id"):
+            return
+
+        # ``timeNano`` is only reported by newer docker API
+        if event.get("timeNano"):
+            event_time = event["timeNano"] / 1e9
+        else:
+            event_time = event.get("time") or time.time()
 
-    def setup_node(self, node, provider, cluster):
-        executors = {
-            "ldap": LdapExecutor,
-            "oxauth": OxauthExecutor,
-            "oxtrust": OxtrustExecutor,
-            "oxidp": OxidpExecutor,
-            "nginx": NginxExecutor,
-        }
+        with self._pending_cond:
+            if event_time > self.pending.get(event["id"], 0):
+                self.pending[event["id"]] = event_time
+            self._pending_cond.notify()
 
-        exec_cls = executors.get(node["type"])
-        if exec_cls:
-            self.logger.info("running entrypoint for "
-                             "{} node {}".format(node["type"], node["id"]))
-            executor = exec_cls(node, provider, cluster,
-                                self.docker, self.db, self.logger)
-            executor.run_entrypoint()
+    def recover_forever(self, provider, cluster):
+        while True:
+            with self._pending_cond:
+                while not self.pending:
+                    self._pending_cond.wait()
+            self.recover_pending(provider, cluster)
+
+    def recover_pending(self, provider, cluster):
+        """Recovers the nodes whose container died since the last pass
+        in one go.
+        """
+        with self._pending_cond:
+            pending, self.pending = self.pending, {}
+
+        now = time.time()
+        self.recovered_at = dict(
+            (container_id, started_at) for container_id, started_at
+            in self.recovered_at.items()
+            if now - started_at < WATCH_DEDUP_WINDOW
+        )
+        # e.g. ``die`` following ``oom`` is handled by the recovery
+        # of the ``oom`` event
+        container_ids = [
+            container_id for container_id, event_time in pending.items()
+            if event_time >= self.recovered_at.get(container_id, 0)
+        ]
+        if not container_ids:
+            return
+
+        nodes = self.find_nodes(container_ids, provider)
+        if not nodes:
+            return
+
+        new_run()
+        for node in nodes.values():
+            self.logger.warn("{} node {} has died".format(node["type"],
+                                                          node["id"]))
+        started_at = time.time()
+        try:
+            # the follow-up recovery of another process holding the lock
+            # recovers every stopped node
+            executors = self.exclusive("watch", self.recover_nodes,
+                                       list(nodes.values()), provider,
+                                       cluster, coalesce=True)
+        except Exception as exc:
+            # a failed recovery must not stop the watcher
+            self.logger.error("unable to recover {} nodes; "
+                              "reason={}".format(len(nodes), exc))
+            return
+
+        if executors is not None:
+            for container_id in nodes:
+                self.recovered_at[container_id] = started_at
+
+    def find_nodes(self, container_ids, provider):
+        """Gets the nodes running in ``container_ids``, keyed by container
+        ID; containers of other than nodes are left out.
+        """
+        # nodes might be added/removed while watching,
+        # hence we're reloading them every time
+        self.containers.clear()
+        nodes = {}
+        for node in self.get_nodes(provider):
+            try:
+                container_id = self.containers.container_id(node["id"])
+            except docker.errors.APIError:
+                continue
+            if container_id in container_ids:
+                nodes[container_id] = node
+        return nodes
 
 
 class ImageUpdateTask(BaseTask):
@@ -254,14 +661,67 @@ class ImageUpdateTask(BaseTask):
         "gluunginx",
     ]
 
+    def __init__(self, db, logger=None, encrypted=False,
+                 pull_workers=PULL_WORKERS, rolling=False,
+                 batch_size=ROLLING_BATCH_SIZE, docker_client=None,
+                 recovery_task=None):
+        super(ImageUpdateTask, self).__init__(db, logger, encrypted,
+                                              docker_client=docker_client)
+        self.pull_workers = pull_workers
+        self.rolling = rolling
+        self.batch_size = batch_size
+
+        # task recovering the re-provisioned nodes; the host lock (if
+        # any) is held while nodes are stopped and recovered, but not
+        # while images are pulled
+        self.recovery_task = recovery_task or RecoveryTask(
+            db, self.logger, encrypted, docker_client=self.docker,
+        )
+
     def execute(self):
-        for image in self.images:
-            new_image = "{}/{}".format(self.registry_base_url, image)
+        new_run()
+
+        # images pulled in this run are the ones whose ID has changed
+        previous_ids = self.get_image_ids()
 
-            # pull the updates from registry
-            self.logger.info("pulling {} updates".format(new_image))
-            self.pull_image(new_image)
+        # pull the updates from registry
+        updated = run_concurrently(self.update_image, self.images,
+                                   self.pull_workers)
 
+        if not any(updated):
+            self.logger.info("all images are up-to-date; "
+                             "skipping re-provisioning")
+            return
+
+        if self.rolling:
+            image_ids = dict(
+                (image, image_id) for image, image_id
+                in self.get_image_ids().items()
+                if previous_ids.get(image) != image_id
+            )
+            self.recovery_task.exclusive("update-images",
+                                         self.rolling_update, image_ids)
+            return
+
+        self.recovery_task.exclusive("update-images", self.reprovision)
+
+    def get_image_ids(self):
+        """Gets the ID of local copy of each image; missing images are
+        left out.
+        """
+        image_ids = {}
+        for image in self.images:
+            try:
+                image_ids[image] = self.docker.inspect_image(
+                    "{}/{}".format(self.registry_base_url, image)
+                )["Id"]
+            except docker.errors.APIError:
+                continue
+        return image_ids
+
+    def reprovision(self):
+        """Stops all nodes and recovers them from updated images.
+        """
         provider = self.get_provider()
         nodes = self.db.search_from_table(
             "nodes",
@@ -271,26 +731,134 @@ class ImageUpdateTask(BaseTask):
         )
 
         self.logger.info("stopping all nodes for re-provisioning")
-        for node in nodes:
-            self.docker.stop(node["id"])
+        run_concurrently(self.docker.stop, [node["id"] for node in nodes],
+                         RECOVERY_WORKERS)
 
         # recover the nodes
-        recovery_task = RecoveryTask(self.db, self.logger)
-        recovery_task.execute()
+        self.recovery_task.execute()
+
+    def rolling_update(self, image_ids):
+        """Restarts nodes not running the images pulled in this run
+        (``image_ids``, keyed by image name) a batch at a time (following
+        their recovery priority), waiting for each batch to be ready
+        before moving on.
+        """
+        recovery_task = self.recovery_task
+        cluster = recovery_task.get_cluster()
+        provider = recovery_task.get_provider()
+
+        for tier in get_recovery_tiers(recovery_task.get_nodes(provider)):
+            nodes = [node for node in tier
+                     if self.node_outdated(node, image_ids)]
+
+            for pos in range(0, len(nodes), self.batch_size):
+                batch = nodes[pos:pos + self.batch_size]
+                for node in batch:
+                    self.logger.info("stopping {} node {} for "
+                                     "re-provisioning".format(node["type"],
+                                                              node["id"]))
+                run_concurrently(self.docker.stop,
+                                 [node["id"] for node in batch],
+                                 self.batch_size)
+
+                recovery_task.containers.clear()
+                executors = run_concurrently(
+                    lambda node: recovery_task.recover_node(node, provider,
+                                                            cluster),
+                    batch,
+                    self.batch_size,
+                )
 
-    def pull_image(self, image):
-        resp = self.docker.pull(repository=image, stream=True)
-        output = ""
+                for node, executor in zip(batch, executors):
+                    if not executor:
+                        continue
+                    # not every executor waits for the node
+                    # in its entrypoint
+                    if executor.readiness is None:
+                        executor.wait_ready()
+                        executor.close()
+                    if not executor.readiness.ready:
+                        # stop here to keep the rest of nodes running
+                        self.logger.error(
+                            "{} node {} is not ready; aborting rolling "
+                            "update".format(node["type"], node["id"])
+                        )
+                        return
+
+        self.logger.info("rolling update for {} provider {} is "
+                         "finished".format(provider["type"], provider["id"]))
+
+    def node_outdated(self, node, image_ids):
+        image_id = image_ids.get(NODE_IMAGES.get(node["type"]))
+        if not image_id:
+            return False
 
-        while True:
-            try:
-                output = resp.next()
-                self.logger.info(output)
-            except StopIteration:
-                break
-
-        result = json.loads(output)
-        if "errorDetail" in result:
-            self.logger.error(result)
+        try:
+            running_image = self.docker.inspect_container(node["id"])["Image"]
+        except docker.errors.APIError:
+            return False
+
+        if running_image == image_id:
+            self.logger.info("{} node {} is running latest image; "
+                             "skipping".format(node["type"], node["id"]))
             return False
         return True
+
+    def update_image(self, image):
+        """Pulls the image unless the local copy is up-to-date;
+        returns ``True`` if image is pulled.
+        """
+        new_image = "{}/{}".format(self.registry_base_url, image)
+
+        local_digest = get_local_digest(self.docker, new_image)
+        if local_digest:
+            try:
+                remote_digest = get_registry_digest(new_image)
+            except requests.exceptions.RequestException as exc:
+                self.logger.warn("unable to get digest of {} from registry; "
+                                 "reason={}".format(new_image, exc))
+                remote_digest = None
+
+            if local_digest == remote_digest:
+                self.logger.info("{} is up-to-date".format(new_image))
+                return False
+
+        self.logger.info("pulling {} updates".format(new_image))
+        node_types = [node_type for node_type, node_image
+                      in NODE_IMAGES.items() if node_image == image]
+        with span(self.logger, "image_pull",
+                  node_types[0] if node_types else "",
+                  image=new_image) as event:
+            pulled = self.pull_image(new_image)
+            if not pulled:
+                event["outcome"] = "failure"
+            return pulled
+
+    def pull_image(self, image):
+        progress = PullProgress(image, self.logger)
+
+        # failed pull is retried; layers which have been pulled
+        # are not downloaded again
+        for attempt in range(1, PULL_RETRIES + 1):
+            progress.error = None
+            try:
+                resp = self.docker.pull(repository=image, stream=True)
+                for chunk in resp:
+                    for line in chunk.splitlines():
+                        if line.strip():
+                            progress.update(json.loads(line))
+            except (docker.errors.APIError,
+                    requests.exceptions.RequestException) as exc:
+                progress.error = exc
+
+            if not progress.error:
+                progress.log()
+                self.logger.info("{}: {}".format(image, progress.status))
+                return True
+
+            self.logger.warn("attempt {} to pull {} is failed; "
+                             "reason={}".format(attempt, image,
+                                                progress.error))
+
+        self.logger.error("unable to pull {}".format(image))
+        return False
@@ -6,12 +6,15 @@
 import base64
 import logging
 import logging.handlers
+import Queue
+import socket
+import threading
 
-from M2Crypto.EVP import Cipher
-from netaddr import IPNetwork
+from .eventlog import JsonFormatter
+from .eventlog import QueueHandler
 
 
-def get_logger(logfile=None, name=None):
+def get_logger(logfile=None, name=None, json_format=False):
     logger = logging.getLogger(name or "gluuagent")
     logger.setLevel(logging.INFO)
 
@@ -24,17 +27,42 @@ def get_logger(logfile=None, name=None):
             interval=1,
             backupCount=1,
         )
-    fmt = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    ch.setFormatter(fmt)
+
+    if json_format:
+        # structured logs include span events which are logged
+        # in debug level
+        logger.setLevel(logging.DEBUG)
+        ch.setFormatter(JsonFormatter())
+        ch = QueueHandler(ch)
+    else:
+        fmt = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        )
+        ch.setFormatter(fmt)
     logger.addHandler(ch)
     return logger
 
 
+def get_local_hostnames():
+    """Gets FQDN and hostname of the machine where the Python interpreter
+    is currently executing.
+    """
+    return [socket.getfqdn(), socket.gethostname()]
+
+
 def decrypt_text(encrypted_text, key):
     # Porting from pyDes-based encryption (see http://git.io/htpk)
     # to use M2Crypto instead (see https://gist.github.com/mrluanma/917014)
+    # M2Crypto is only needed when weave encryption is enabled
+    try:
+        from M2Crypto.EVP import Cipher
+    except ImportError:
+        # pure-Python cipher is slower, but good enough for a short secret
+        from .des import triple_des_decrypt
+        return triple_des_decrypt(
+            base64.b64decode(b"{}".format(encrypted_text)), b"{}".format(key)
+        )
+
     cipher = Cipher(alg="des_ede3_ecb",
                     key=b"{}".format(key),
                     op=0,
@@ -46,17 +74,45 @@ def decrypt_text(encrypted_text, key):
     return decrypted_text
 
 
-def get_exposed_cidr(ip_network):
-    pool = IPNetwork(ip_network)
-    # as the last element of pool is a broadcast address, we cannot use it;
-    # hence we fetch the last 2nd element from the pool
-    addr = pool[-2]
-    return str(addr), pool.prefixlen
+def run_concurrently(func, items, workers=1):
+    """Calls ``func`` for each item using a bounded pool of threads.
+
+    Results are returned in the same order as ``items``. If any call
+    raises an exception, the first one is re-raised after every call
+    has finished, so no work is left running in the background.
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    # plain threads are used instead of ``ThreadPool``, whose ``join``
+    # may take up to 100ms to notice the workers are finished
+    results = [None] * len(items)
+    errors = [None] * len(items)
+    pending = Queue.Queue()
+    for pos, item in enumerate(items):
+        pending.put((pos, item))
+
+    def worker():
+        while True:
+            try:
+                pos, item = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[pos] = func(item)
+            except Exception as exc:
+                errors[pos] = exc
 
+    threads = [threading.Thread(target=worker)
+               for _ in range(min(workers, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
 
-def get_prometheus_cidr(ip_network):
-    pool = IPNetwork(ip_network)
-    # as the last element of pool is a broadcast address, we cannot use it;
-    # hence we fetch the last 3rd element from the pool
-    addr = pool[-3]
-    return str(addr), pool.prefixlen
+    for error in errors:
+        if error is not None:
+            raise error
+    return results
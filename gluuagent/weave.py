@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Gluu
+#
+# All rights reserved.
+
+import httplib
+import json
+import os
+import socket
+import threading
+from collections import OrderedDict
+from urllib import urlencode
+
+from .constants import WEAVE_HTTP_HOST
+from .constants import WEAVE_HTTP_PORT
+from .eventlog import span
+from .utils import get_logger
+from .utils import run_concurrently
+
+
+class WeaveError(Exception):
+    pass
+
+
+class WeaveConnectionError(WeaveError):
+    pass
+
+
+def weave_cli(*args, **kwargs):
+    """Runs ``weave`` command; all weave CLI calls should go through
+    this function.
+
+    ``env`` adds environment variables to the command, e.g.
+    ``DOCKER_HOST`` to manage weave of another host.
+    """
+    # ``sh`` is slow to import and not needed when weave API is reachable
+    import sh
+
+    env = kwargs.get("env")
+    if env:
+        return sh.weave(*args, _env=dict(os.environ, **env))
+    return sh.weave(*args)
+
+
+class WeaveClient(object):
+    """A client for weave router's local HTTP API.
+
+    A single connection is kept open and reused for every request
+    instead of forking ``weave`` script per call.
+    """
+
+    def __init__(self, host=WEAVE_HTTP_HOST, port=WEAVE_HTTP_PORT,
+                 timeout=10):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def request(self, method, path, params=None):
+        body = None
+        headers = {}
+        if params:
+            body = urlencode(params)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+        with self._lock:
+            # the kept-alive connection might be closed by the router;
+            # hence we retry once using a new connection
+            for retry in (False, True):
+                if self._conn is None:
+                    self._conn = httplib.HTTPConnection(
+                        self.host, self.port, timeout=self.timeout,
+                    )
+                try:
+                    self._conn.request(method, path, body, headers)
+                    resp = self._conn.getresponse()
+                    data = resp.read()
+                    break
+                except (httplib.HTTPException, socket.error) as exc:
+                    self._close()
+                    if retry:
+                        raise WeaveConnectionError(
+                            "unable to connect to weave router; "
+                            "reason={}".format(exc)
+                        )
+
+        if resp.status >= 400:
+            raise WeaveError("{} {} returned status code {}; "
+                             "reason={}".format(method, path, resp.status,
+                                                data.strip()))
+        return data
+
+    def dns_add(self, container_id, ip, fqdn):
+        self.request("PUT", "/name/{}/{}".format(container_id, ip),
+                     {"fqdn": fqdn})
+
+    def dns_remove(self, container_id, ip, fqdn):
+        self.request("DELETE", "/name/{}/{}?{}".format(
+            container_id, ip, urlencode({"fqdn": fqdn}),
+        ))
+
+    def dns_entries(self):
+        """Gets all (non-tombstoned) weaveDNS entries.
+        """
+        report = json.loads(self.request("GET", "/report"))
+        entries = (report.get("DNS") or {}).get("Entries") or []
+        return [entry for entry in entries if not entry.get("Tombstone")]
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+class WeaveBatch(object):
+    """Collects weave attach and DNS operations and runs them in bulk
+    when ``flush`` is called.
+    """
+
+    def __init__(self, client=None, logger=None, workers=1, env=None):
+        self.logger = logger or get_logger(
+            name=__name__ + "." + self.__class__.__name__
+        )
+        self.client = client or WeaveClient()
+        self.workers = workers
+        # weave router's API only listens on local host; operations on
+        # another host (``env`` with its ``DOCKER_HOST``) use weave script
+        self.env = env
+        self._attachments = OrderedDict()
+        self._records = []
+        self._removed_records = []
+        self._lock = threading.Lock()
+
+    def attach(self, cidr, container, node_type=""):
+        with self._lock:
+            cidrs, _ = self._attachments.setdefault(container,
+                                                    ([], node_type))
+            cidrs.append(cidr)
+
+    def dns_add(self, container_id, ip, fqdn, node_type=""):
+        with self._lock:
+            self._records.append((container_id, ip, fqdn, node_type))
+
+    def dns_remove(self, container_id, ip, fqdn, node_type=""):
+        with self._lock:
+            self._removed_records.append((container_id, ip, fqdn,
+                                          node_type))
+
+    def _attach(self, container, cidrs, node_type):
+        with span(self.logger, "attach", node_type, container=container,
+                  cidrs=cidrs):
+            weave_cli("attach", *(cidrs + [container]), env=self.env)
+
+    def _dns(self, action, container_id, ip, fqdn, node_type, use_api):
+        """Adds or removes a DNS record; returns whether the router's
+        API is still usable.
+        """
+        with span(self.logger, "dns", node_type, action=action,
+                  container=container_id, fqdn=fqdn):
+            if use_api and ip:
+                try:
+                    if action == "dns-add":
+                        self.client.dns_add(container_id, ip, fqdn)
+                    else:
+                        self.client.dns_remove(container_id, ip, fqdn)
+                    return True
+                except WeaveConnectionError as exc:
+                    # router's API is not reachable; falls back to weave
+                    # script for the rest of the records
+                    self.logger.warn(exc)
+                    use_api = False
+                except WeaveError as exc:
+                    self.logger.warn(exc)
+                    if action == "dns-remove":
+                        return use_api
+
+            args = [ip] if ip else []
+            weave_cli(action, *(args + [container_id, "-h", fqdn]),
+                      env=self.env)
+            return use_api
+
+    def flush(self):
+        with self._lock:
+            attachments = self._attachments.items()
+            records = self._records
+            removed_records = self._removed_records
+            self._attachments = OrderedDict()
+            self._records = []
+            self._removed_records = []
+
+        # attaching IP requires access to container's network namespace
+        # which is only doable via weave script; at least all CIDRs
+        # of a container are attached in a single call
+        run_concurrently(
+            lambda item: self._attach(item[0], *item[1]),
+            attachments,
+            self.workers,
+        )
+
+        use_api = self.env is None
+        for container_id, ip, fqdn, node_type in removed_records:
+            use_api = self._dns("dns-remove", container_id, ip, fqdn,
+                                node_type, use_api)
+        for container_id, ip, fqdn, node_type in records:
+            use_api = self._dns("dns-add", container_id, ip, fqdn,
+                                node_type, use_api)
+
+    def close(self):
+        self.client.close()
+
+
+class DnsReconciler(object):
+    """Compares desired DNS records with the ones registered in weaveDNS,
+    so only missing records are added and stale ones are removed.
+
+    Current entries are loaded once via ``load`` and kept up-to-date
+    with every change queued by ``reconcile``.
+    """
+
+    def __init__(self, client, logger=None):
+        self.logger = logger or get_logger(
+            name=__name__ + "." + self.__class__.__name__
+        )
+        self.client = client
+        self._records = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            entries = self.client.dns_entries()
+        except (WeaveError, ValueError) as exc:
+            # without knowing the current entries, every desired record
+            # will be added
+            self.logger.warn("unable to load weaveDNS entries; "
+                             "reason={}".format(exc))
+            self._records = None
+            return
+        self._records = set(
+            (entry["ContainerID"], entry["Address"],
+             entry["Hostname"].rstrip("."))
+            for entry in entries
+        )
+
+    def forget(self, container_id):
+        """Drops known records of the container (e.g. after restarting
+        it, as weave removes the records of stopped container).
+        """
+        with self._lock:
+            if self._records is None:
+                return
+            self._records = set(record for record in self._records
+                                if record[0] != container_id)
+
+    def reconcile(self, desired, batch, node_type=""):
+        """Queues the difference between ``desired`` records (a list of
+        ``(container_id, ip, fqdn)``) and current records of the same
+        containers into ``batch``.
+
+        A desired record without IP is satisfied by any record of
+        the same container and hostname.
+        """
+        # removes duplicates while keeping the order
+        desired = list(OrderedDict.fromkeys(desired))
+        added = []
+        removed = []
+
+        with self._lock:
+            if self._records is None:
+                added = desired
+            else:
+                containers = set(record[0] for record in desired)
+                current = set(record for record in self._records
+                              if record[0] in containers)
+                wanted = set((cid, fqdn) for cid, ip, fqdn in desired
+                             if not ip)
+
+                for record in desired:
+                    container_id, ip, fqdn = record
+                    if ip and record in current:
+                        continue
+                    if not ip and any(cid == container_id and name == fqdn
+                                      for cid, _, name in current):
+                        continue
+                    added.append(record)
+
+                for record in current:
+                    if record in desired or (record[0], record[2]) in wanted:
+                        continue
+                    removed.append(record)
+
+                self._records.difference_update(removed)
+                self._records.update(record for record in added
+                                     if record[1])
+
+        for record in removed:
+            self.logger.info("removing stale {} from local "
+                             "DNS server".format(record[2]))
+            batch.dns_remove(*record, node_type=node_type)
+        for record in added:
+            batch.dns_add(*record, node_type=node_type)
+        return added, removed
@@ -36,14 +36,14 @@ setup(
     author_email="info@gluu.org",
     description="A tool to ensure provider is reachable within cluster.",
     long_description=__doc__,
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks"]),
     zip_safe=False,
     install_requires=[
         "click",
         "m2crypto<=0.22.3",
-        "netaddr",
         "pyyaml",
         "docker-py>=1.5.0",
+        "requests>=2.5.2",
         "sh",
         "tinydb",
     ],
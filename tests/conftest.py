@@ -66,12 +66,11 @@ def httpd_node(cluster, master_provider):
 
 
 @pytest.fixture
-def db(request, cluster, master_provider, consumer_provider,
-       ldap_node, oxauth_node, oxtrust_node, httpd_node):
+def database_uri(request, cluster, master_provider, consumer_provider,
+                 ldap_node, oxauth_node, oxtrust_node, httpd_node):
     import json
     import os
     import tempfile
-    from gluuagent.database import Database
 
     _, database_uri = tempfile.mkstemp(suffix=".json")
 
@@ -96,9 +95,20 @@ def db(request, cluster, master_provider, consumer_provider,
     def teardown():
         os.unlink(database_uri)
 
-    db = Database(database_uri)
     request.addfinalizer(teardown)
-    return db
+    return database_uri
+
+
+@pytest.fixture
+def db(database_uri):
+    from gluuagent.database import Database
+    return Database(database_uri)
+
+
+@pytest.fixture
+def snapshot_db(database_uri):
+    from gluuagent.database import Database
+    return Database(database_uri, snapshot=True)
 
 
 @pytest.fixture(scope="session")
@@ -0,0 +1,56 @@
+import pytest
+
+
+@pytest.mark.parametrize("ip_network, exposed, prometheus", [
+    ("10.2.3.4/16", ("10.2.255.254", 16), ("10.2.255.253", 16)),
+    ("10.1.1.0/24", ("10.1.1.254", 24), ("10.1.1.253", 24)),
+])
+def test_address_plan_cidr(ip_network, exposed, prometheus):
+    from gluuagent.addressing import AddressPlan
+
+    plan = AddressPlan(ip_network)
+    assert plan.exposed_cidr == exposed
+    assert plan.prometheus_cidr == prometheus
+
+
+def test_address_plan_reserved():
+    from gluuagent.addressing import AddressError
+    from gluuagent.addressing import AddressPlan
+
+    plan = AddressPlan("10.2.3.4/16")
+    for ip, name in [("10.2.0.0", "network"), ("10.2.255.255", "broadcast"),
+                     ("10.2.255.254", "exposed"),
+                     ("10.2.255.253", "prometheus")]:
+        with pytest.raises(AddressError) as exc:
+            plan.allocate(ip, "node-1")
+        assert name in str(exc.value)
+
+
+def test_address_plan_allocate():
+    from gluuagent.addressing import AddressConflict
+    from gluuagent.addressing import AddressError
+    from gluuagent.addressing import AddressPlan
+
+    plan = AddressPlan("10.2.0.0/16")
+    plan.allocate("10.2.1.1", "node-1")
+    # allocating the same IP to the same node is allowed
+    plan.allocate("10.2.1.1", "node-1")
+
+    with pytest.raises(AddressConflict) as exc:
+        plan.allocate("10.2.1.1", "node-2")
+    assert exc.value.holder == "node-1"
+    assert "node-1" in str(exc.value)
+
+    for ip in ["10.3.0.1", "not-an-ip"]:
+        with pytest.raises(AddressError):
+            plan.allocate(ip, "node-2")
+
+
+@pytest.mark.parametrize("ip_network", ["10.2.0.0", "10.2.0.0/31",
+                                        "10.2.0.300/16", None])
+def test_address_plan_invalid_network(ip_network):
+    from gluuagent.addressing import AddressError
+    from gluuagent.addressing import AddressPlan
+
+    with pytest.raises(AddressError):
+        AddressPlan(ip_network)
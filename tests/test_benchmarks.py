@@ -0,0 +1,50 @@
+import pytest
+
+
+@pytest.mark.parametrize("weave_api", [True, False])
+def test_recovery_benchmark(weave_api):
+    from benchmarks.recovery import run_benchmark
+
+    result = run_benchmark("recover", providers=2, nodes=5,
+                           weave_api=weave_api)
+
+    assert result["local_nodes"] == 5
+    # every local node and prometheus are restarted
+    assert result["docker_calls"]["container_restart"] == 6
+    assert result["docker_calls"]["containers_list"] == 1
+    assert result["command_calls"]["weave attach"] == 6
+    if weave_api:
+        assert result["weave_api_calls"]["dns_add"] == 7
+    else:
+        assert result["command_calls"]["weave dns-add"] == 7
+
+
+def test_image_update_benchmark():
+    from benchmarks.recovery import run_benchmark
+
+    result = run_benchmark("update-images", providers=1, nodes=5)
+
+    assert result["docker_calls"]["image_pull"] == 5
+    assert result["docker_calls"]["container_stop"] == 5
+    assert result["docker_calls"]["container_restart"] == 6
+
+
+def test_incremental_recovery_benchmark():
+    from benchmarks.recovery import run_benchmark
+
+    result = run_benchmark("recover", providers=1, nodes=5,
+                           incremental=True)
+
+    # nothing has changed since the previous run
+    assert "container_restart" not in result["docker_calls"]
+    assert result["weave_api_calls"] == {}
+    assert result["command_calls"] == {}
+
+
+def test_decrypt_benchmark():
+    from benchmarks.decrypt import run_benchmark
+
+    results = run_benchmark(calls=3)
+    # cached secret is decrypted only once
+    assert results["cached"]["decrypts"] == 1
+    assert results["pure-python"]["decrypts"] == 3
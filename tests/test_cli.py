@@ -0,0 +1,235 @@
+import os
+import subprocess
+import sys
+
+
+def test_cli_lazy_imports():
+    # ``--help`` or a host without database shouldn't pay import time
+    # of modules only used by the tasks
+    code = "import sys, gluuagent.cli; " \
+           "print(','.join(sorted(set(name.split('.')[0] " \
+           "for name in sys.modules))))"
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env.get("PYTHONPATH"),
+    ]))
+    output = subprocess.check_output([sys.executable, "-c", code], env=env)
+    modules = output.strip().split(",")
+
+    for name in ("docker", "requests", "yaml", "sh", "M2Crypto", "netaddr",
+                 "tinydb"):
+        assert name not in modules
+
+
+def test_recover_missing_database(tmpdir):
+    from click.testing import CliRunner
+    from gluuagent.cli import main
+
+    database = str(tmpdir.join("db.json"))
+    result = CliRunner().invoke(main, ["recover", "--database", database])
+    assert result.exit_code == 0
+
+
+def test_recover_plan(tmpdir, monkeypatch):
+    import json
+    from click.testing import CliRunner
+    from benchmarks.dbgen import generate_database
+    from benchmarks.fakes import FakeDockerEngine
+    from gluuagent.cli import main
+    from gluuagent.utils import get_local_hostnames
+
+    database = str(tmpdir.join("db.json"))
+    data = generate_database(database, nodes=2,
+                             hostname=get_local_hostnames()[0])
+    engine = FakeDockerEngine(str(tmpdir.join("docker.sock")))
+    for node in data["nodes"].values():
+        engine.add_container(node["id"], node["name"])
+    engine.add_container("weave" * 12, "weave", running=True)
+    engine.add_container("prometheus" * 6, "prometheus", running=True)
+    engine.start()
+    monkeypatch.setenv("DOCKER_HOST", engine.base_url)
+
+    try:
+        result = CliRunner().invoke(main, [
+            "recover", "--database", database, "--plan",
+            "--state-file", str(tmpdir.join("state.json")),
+            "--logfile", str(tmpdir.join("agent.log")),
+        ])
+    finally:
+        engine.stop()
+
+    assert result.exit_code == 0
+    plan = json.loads(result.output)
+    assert [action["action"] for action in plan["actions"]
+            if action["action"] in ("restart", "entrypoint")] == [
+        "restart", "entrypoint", "restart", "entrypoint",
+    ]
+    assert plan["estimated_duration"] > 0
+    # nothing is changed while planning
+    assert "container_restart" not in engine.calls
+    assert not tmpdir.join("state.json").check()
+
+
+def test_recover_full_plan_keeps_state(tmpdir, monkeypatch):
+    import json
+    from click.testing import CliRunner
+    from benchmarks.dbgen import generate_database
+    from benchmarks.fakes import FakeDockerEngine
+    from gluuagent.cli import main
+    from gluuagent.utils import get_local_hostnames
+
+    database = str(tmpdir.join("db.json"))
+    data = generate_database(database, nodes=2,
+                             hostname=get_local_hostnames()[0])
+    engine = FakeDockerEngine(str(tmpdir.join("docker.sock")))
+    for node in data["nodes"].values():
+        engine.add_container(node["id"], node["name"])
+    engine.add_container("weave" * 12, "weave", running=True)
+    engine.add_container("prometheus" * 6, "prometheus", running=True)
+    engine.start()
+    monkeypatch.setenv("DOCKER_HOST", engine.base_url)
+
+    state_file = tmpdir.join("state.json")
+    state = {"weave": "fingerprint", "nodes": {"node": "fingerprint"}}
+    state_file.write(json.dumps(state))
+
+    try:
+        result = CliRunner().invoke(main, [
+            "recover", "--database", database, "--plan", "--full",
+            "--state-file", str(state_file),
+            "--logfile", str(tmpdir.join("agent.log")),
+        ])
+    finally:
+        engine.stop()
+
+    assert result.exit_code == 0
+    # state of the last recovery is only cleared when recovering
+    assert json.loads(state_file.read()) == state
+
+
+def test_recover_targeted_plan(tmpdir, monkeypatch):
+    import json
+    from click.testing import CliRunner
+    from benchmarks.dbgen import generate_database
+    from benchmarks.fakes import FakeDockerEngine
+    from gluuagent.cli import main
+    from gluuagent.utils import get_local_hostnames
+
+    database = str(tmpdir.join("db.json"))
+    data = generate_database(database, nodes=5,
+                             hostname=get_local_hostnames()[0])
+    engine = FakeDockerEngine(str(tmpdir.join("docker.sock")))
+    for node in data["nodes"].values():
+        engine.add_container(node["id"], node["name"])
+    engine.add_container("weave" * 12, "weave", running=True)
+    engine.start()
+    monkeypatch.setenv("DOCKER_HOST", engine.base_url)
+
+    args = ["recover", "--database", database, "--plan",
+            "--logfile", str(tmpdir.join("agent.log"))]
+    try:
+        runner = CliRunner()
+        result = runner.invoke(main, args + ["--type", "oxauth"])
+        missing = runner.invoke(main, args + ["--node", "unknown"])
+    finally:
+        engine.stop()
+
+    assert result.exit_code == 0
+    plan = json.loads(result.output)
+    # oxauth and the ldap node it depends on; prometheus is left alone
+    assert [(action["action"], action["node_type"])
+            for action in plan["actions"]
+            if action["action"] == "restart"] == [
+        ("restart", "ldap"), ("restart", "oxauth"),
+    ]
+    assert json.loads(missing.output)["errors"][0]["target"] == "unknown"
+
+
+def test_recover_coalesced(tmpdir):
+    import json
+    from click.testing import CliRunner
+    from benchmarks.dbgen import generate_database
+    from gluuagent.cli import main
+    from gluuagent.lock import HostLock
+    from gluuagent.utils import get_local_hostnames
+
+    database = str(tmpdir.join("db.json"))
+    generate_database(database, hostname=get_local_hostnames()[0])
+    lock_file = str(tmpdir.join("agent.lock"))
+    state_file = str(tmpdir.join("state.json"))
+
+    # another process is recovering the nodes with the same settings
+    holder = HostLock(lock_file)
+    holder.acquire("recover", followup=True, options={
+        "encrypted": False, "workers": 4, "state_file": state_file,
+    })
+    try:
+        result = CliRunner().invoke(main, [
+            "recover", "--database", database, "--lock-file", lock_file,
+            "--state-file", state_file, "--workers", "4",
+            "--logfile", str(tmpdir.join("agent.log")),
+        ])
+        assert result.exit_code == 0
+        with open(lock_file) as fp:
+            assert json.load(fp)["followup_requested"] is True
+    finally:
+        holder.release()
+
+
+def test_recover_full_not_coalesced(tmpdir, monkeypatch):
+    import json
+    from click.testing import CliRunner
+    from benchmarks.dbgen import generate_database
+    from gluuagent.cli import main
+    from gluuagent.utils import get_local_hostnames
+
+    database = str(tmpdir.join("db.json"))
+    generate_database(database, hostname=get_local_hostnames()[0])
+    state_file = tmpdir.join("state.json")
+    state_file.write(json.dumps({"weave": "fingerprint", "nodes": {}}))
+
+    calls = []
+    monkeypatch.setattr(
+        "gluuagent.tasks.run_exclusive",
+        lambda lock, command, func, **kwargs: calls.append(kwargs),
+    )
+    result = CliRunner().invoke(main, [
+        "recover", "--database", database, "--full",
+        "--state-file", str(state_file),
+        "--lock-file", str(tmpdir.join("agent.lock")),
+        "--logfile", str(tmpdir.join("agent.log")),
+    ])
+
+    assert result.exit_code == 0
+    assert [kwargs["coalesce"] for kwargs in calls] == [False]
+    # state is cleared by the recovery, once the lock is taken
+    assert state_file.check()
+
+
+def test_ctl(tmpdir):
+    import json
+    import threading
+    from click.testing import CliRunner
+    from gluuagent.cli import main
+    from gluuagent.rpc import RpcServer
+
+    handlers = {"recover-node": lambda node_id: {"node": node_id}}
+    server = RpcServer(str(tmpdir.join("agent.sock")), handlers)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        runner = CliRunner()
+        result = runner.invoke(main, ["ctl", "recover-node", "--node", "abc",
+                                      "--socket", server.path])
+        assert result.exit_code == 0
+        assert json.loads(result.output) == {"node": "abc"}
+
+        result = runner.invoke(main, ["ctl", "status",
+                                      "--socket", server.path])
+        assert result.exit_code == 1
+    finally:
+        server.shutdown()
+        server.server_close()
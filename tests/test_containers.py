@@ -0,0 +1,60 @@
+import pytest
+
+
+class FakeClient(object):
+    def __init__(self, containers):
+        self._containers = containers
+        self.calls = []
+
+    def containers(self, all=False, filters=None):
+        self.calls.append("containers")
+        return self._containers
+
+    def inspect_container(self, container):
+        self.calls.append("inspect_container")
+        return {"Id": container * 4, "State": {"Running": True}}
+
+
+@pytest.fixture
+def client():
+    return FakeClient([
+        {"Id": "a" * 64, "Names": ["/weave"], "Status": "Up 2 hours"},
+        {"Id": "b" * 64, "Names": ["/node-b"], "Status": "Exited (0)"},
+        {"Id": "c" * 64, "Names": ["/node-c"], "State": "running"},
+    ])
+
+
+def test_container_state_single_listing(client):
+    from gluuagent.containers import ContainerStateCache
+
+    cache = ContainerStateCache(client)
+    assert cache.running("weave") is True
+    assert cache.running("b" * 64) is False
+    assert cache.running("c" * 12) is True
+    assert cache.container_id("node-b") == "b" * 64
+    assert client.calls == ["containers"]
+
+
+def test_container_state_invalidate(client):
+    from gluuagent.containers import ContainerStateCache
+
+    cache = ContainerStateCache(client)
+    assert cache.running("node-b") is False
+
+    cache.invalidate("node-b")
+    assert cache.running("node-b") is True
+    assert client.calls == ["containers", "inspect_container"]
+
+    # other containers are still served from the snapshot
+    assert cache.running("weave") is True
+    assert client.calls == ["containers", "inspect_container"]
+
+
+def test_container_started_at(client):
+    from gluuagent.containers import ContainerStateCache
+
+    cache = ContainerStateCache(client)
+    cache.started_at("weave")
+    # start time is kept in the snapshot once inspected
+    cache.started_at("a" * 12)
+    assert client.calls == ["containers", "inspect_container"]
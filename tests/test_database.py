@@ -1,3 +1,6 @@
+import pytest
+
+
 def test_database_get(db):
     assert db.get(1, "providers")["type"] == "master"
 
@@ -9,3 +12,106 @@ def test_database_all(db):
 def test_database_search(db):
     result = db.search_from_table("providers", db.where("type") == "master")
     assert len(result) == 1
+
+
+def test_snapshot_get(snapshot_db):
+    assert snapshot_db.get(1, "providers")["type"] == "master"
+    assert snapshot_db.get(100, "providers") is None
+
+
+def test_snapshot_all(snapshot_db):
+    assert len(snapshot_db.all("providers")) == 2
+    assert snapshot_db.all("unknown") == []
+
+
+def test_snapshot_search(snapshot_db):
+    where = snapshot_db.where
+    result = snapshot_db.search_from_table(
+        "nodes",
+        (where("provider_id") == 1)
+        & ((where("state") == "SUCCESS") | (where("state") == "DISABLED"))
+        & (where("weave_ip") == "10.2.1.2"),
+    )
+    assert [node["id"] for node in result] == [2]
+
+
+def test_snapshot_search_unindexed(snapshot_db):
+    result = snapshot_db.search_from_table(
+        "nodes", snapshot_db.where("weave_ip").matches("10.2.1.[12]"),
+    )
+    assert [node["id"] for node in result] == [1, 2]
+
+
+def test_snapshot_index_candidates(snapshot_db):
+    where = snapshot_db.where
+    table = snapshot_db.table("nodes")
+    cond = (where("type") == "ldap") | (where("type") == "oxauth")
+    assert table.candidates(cond.hashval) == set([0, 1])
+    assert table.candidates((where("weave_ip") == "x").hashval) is None
+
+
+def test_snapshot_reload(snapshot_db, database_uri):
+    import json
+    import os
+
+    assert len(snapshot_db.all("providers")) == 2
+
+    with open(database_uri) as fp:
+        data = json.load(fp)
+    data["providers"]["3"] = {"id": 3, "type": "consumer"}
+    with open(database_uri + ".tmp", "w") as fp:
+        json.dump(data, fp)
+    # replacing the file changes its inode
+    os.rename(database_uri + ".tmp", database_uri)
+
+    assert len(snapshot_db.all("providers")) == 3
+
+
+def test_snapshot_returns_copies(snapshot_db):
+    snapshot_db.get(1, "providers")["type"] = "changed"
+    assert snapshot_db.get(1, "providers")["type"] == "master"
+
+
+@pytest.mark.parametrize("indent", [None, 4])
+def test_stream_reader(database_uri, indent):
+    import json
+    from gluuagent.database import JSONStreamReader
+
+    with open(database_uri) as fp:
+        data = json.load(fp)
+    with open(database_uri, "w") as fp:
+        json.dump(data, fp, indent=indent)
+
+    # a tiny window forces the reader to grow it
+    with JSONStreamReader(database_uri, chunk_size=8) as reader:
+        result = dict((table_name, dict(docs))
+                      for table_name, docs in reader.iter_tables())
+    assert result == data
+
+
+def test_stream_load(database_uri):
+    import json
+    from gluuagent.database import stream_load
+
+    with open(database_uri) as fp:
+        data = json.load(fp)
+    data["providers"]["1"]["hostname"] = "master.example.com"
+    data["providers"]["2"]["hostname"] = "consumer.example.com"
+    data["nodes"]["5"] = {"id": 5, "provider_id": 2, "type": "oxauth"}
+    data["license_keys"] = {"1": {"id": 1}}
+    with open(database_uri, "w") as fp:
+        json.dump(data, fp)
+
+    tables = stream_load(database_uri, ["consumer.example.com"])
+    assert [doc["id"] for _, doc in tables["providers"]] == [2]
+    assert [doc["id"] for _, doc in tables["nodes"]] == [5]
+    assert len(tables["clusters"]) == 1
+
+
+def test_snapshot_hostnames(database_uri):
+    from gluuagent.database import Database
+
+    db = Database(database_uri, snapshot=True, hostnames=["unknown"])
+    assert db.all("providers") == []
+    assert db.all("nodes") == []
+    assert len(db.all("clusters")) == 1
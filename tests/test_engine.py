@@ -0,0 +1,89 @@
+import json
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def docker_engine(request, tmpdir):
+    import BaseHTTPServer
+    import SocketServer
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def address_string(self):
+            return "unix"
+
+        def do_GET(self):
+            # keep a few requests in flight at once
+            time.sleep(0.05)
+            body = json.dumps({"Id": self.path.split("/")[-2]})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+        daemon_threads = True
+        connections = 0
+
+        def get_request(self):
+            self.connections += 1
+            return SocketServer.UnixStreamServer.get_request(self)
+
+    path = str(tmpdir.join("docker.sock"))
+    server = Server(path, Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    def teardown():
+        server.shutdown()
+        server.server_close()
+
+    request.addfinalizer(teardown)
+    server.base_url = "unix://" + path
+    return server
+
+
+def test_pooled_client(docker_engine):
+    from gluuagent.engine import get_docker_client
+    from gluuagent.utils import run_concurrently
+
+    client = get_docker_client(docker_engine.base_url, pool_size=4)
+    ids = ["node-{}".format(i) for i in range(20)]
+
+    metas = run_concurrently(client.inspect_container, ids, 4)
+    assert [meta["Id"] for meta in metas] == ids
+    # connections are reused across endpoints and threads
+    assert docker_engine.connections <= 4
+
+
+def test_stock_client(docker_engine):
+    from docker.unixconn.unixconn import UnixAdapter
+    from gluuagent.engine import PooledUnixAdapter
+    from gluuagent.engine import get_docker_client
+
+    client = get_docker_client(docker_engine.base_url, pool_size=1)
+    assert type(client._custom_adapter) is UnixAdapter
+    assert not isinstance(client._custom_adapter, PooledUnixAdapter)
+    assert client.inspect_container("node-1")["Id"] == "node-1"
+
+
+def test_get_docker_env():
+    from gluuagent.engine import get_docker_env
+
+    assert get_docker_env("https://10.0.0.2:2376", "/certs") == {
+        "DOCKER_HOST": "tcp://10.0.0.2:2376",
+        "DOCKER_TLS_VERIFY": "1",
+        "DOCKER_CERT_PATH": "/certs",
+    }
+    assert get_docker_env("unix:///tmp/docker.sock", "/certs") == {
+        "DOCKER_HOST": "unix:///tmp/docker.sock",
+    }
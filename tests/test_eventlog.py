@@ -0,0 +1,90 @@
+import json
+import logging
+
+import pytest
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def logger(request):
+    logger = logging.getLogger("gluuagent.tests.eventlog")
+    logger.setLevel(logging.DEBUG)
+    handler = ListHandler()
+    logger.addHandler(handler)
+    request.addfinalizer(lambda: logger.removeHandler(handler))
+    logger.records = handler.records
+    return logger
+
+
+def test_json_formatter(logger):
+    from gluuagent.eventlog import JsonFormatter
+    from gluuagent.eventlog import new_run
+
+    run_id = new_run()
+    logger.info("restarting %s", "ldap", extra={"event": {"node_id": 1}})
+
+    data = json.loads(JsonFormatter().format(logger.records[0]))
+    assert data["message"] == "restarting ldap"
+    assert data["run_id"] == run_id
+    assert data["node_id"] == 1
+    assert data["level"] == "INFO"
+
+
+def test_queue_handler():
+    from gluuagent.eventlog import QueueHandler
+
+    target = ListHandler()
+    handler = QueueHandler(target)
+    logger = logging.getLogger("gluuagent.tests.queue")
+    logger.addHandler(handler)
+    try:
+        for i in range(10):
+            logger.warn("message %s", i)
+    finally:
+        logger.removeHandler(handler)
+        # pending records are written when handler is closed
+        handler.close()
+
+    assert [record.msg for record in target.records] == [
+        "message {}".format(i) for i in range(10)
+    ]
+
+
+def test_span(logger):
+    from gluuagent.eventlog import span
+
+    with span(logger, "restart", "ldap", node_id=1) as event:
+        event["exit_code"] = 0
+
+    start, end = [record.event for record in logger.records]
+    assert start["event"] == "start"
+    assert end["event"] == "end"
+    assert end["span_id"] == start["span_id"]
+    assert end["outcome"] == "success"
+    assert end["exit_code"] == 0
+    assert end["node_id"] == 1
+    assert end["duration"] >= 0
+
+
+def test_span_failure(logger):
+    from gluuagent.eventlog import span
+
+    class CommandError(Exception):
+        exit_code = 2
+
+    with pytest.raises(CommandError):
+        with span(logger, "attach", "oxauth"):
+            raise CommandError("failed")
+
+    end = logger.records[-1].event
+    assert end["outcome"] == "failure"
+    assert end["exit_code"] == 2
+    assert end["error"] == "failed"
@@ -1,6 +1,19 @@
 import pytest
 
 
+@pytest.fixture
+def clock(monkeypatch):
+    # a fake clock where ``time.sleep`` moves the time forward
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    monkeypatch.setattr("time.time", lambda: now[0])
+    monkeypatch.setattr("time.sleep", sleep)
+    return now
+
+
 def test_run_docker_exec(monkeypatch, docker_client):
     from gluuagent.executors import run_docker_exec
 
@@ -23,7 +36,7 @@ def test_run_docker_exec(monkeypatch, docker_client):
 
 @pytest.mark.parametrize("exit_code", [0, 1])
 def test_oxauth_entrypoint(monkeypatch, docker_client, db, oxauth_node,
-                           master_provider, cluster, exit_code):
+                           master_provider, cluster, exit_code, clock):
     from gluuagent.executors import DockerExecResult
     from gluuagent.executors import OxauthExecutor
 
@@ -36,10 +49,6 @@ def test_oxauth_entrypoint(monkeypatch, docker_client, db, oxauth_node,
         "docker.Client.stop",
         lambda cls, container: None,
     )
-    monkeypatch.setattr(
-        "time.sleep",
-        lambda t: None,
-    )
     executor = OxauthExecutor(oxauth_node, master_provider, cluster,
                               docker_client, db)
     executor.run_entrypoint()
@@ -63,3 +72,165 @@ def test_oxtrust_entrypoint(monkeypatch, docker_client, db, oxtrust_node,
     executor = OxtrustExecutor(oxtrust_node, master_provider, cluster,
                                docker_client, db)
     executor.run_entrypoint()
+
+
+def test_wait_until_ready(clock):
+    from gluuagent.executors import wait_until
+
+    results = iter([False, False, True])
+    result = wait_until(lambda: next(results), 10)
+    assert result.ready is True
+    assert result.attempts == 3
+    assert result.elapsed == 0.75
+
+
+def test_wait_until_timeout(clock):
+    from gluuagent.executors import wait_until
+
+    result = wait_until(lambda: False, 10)
+    assert result.ready is False
+    assert result.elapsed == 10
+
+
+def test_port_probe():
+    import socket
+    from gluuagent.executors import port_probe
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(1)
+    port = sock.getsockname()[1]
+    try:
+        assert port_probe("127.0.0.1", port)() is True
+    finally:
+        sock.close()
+    assert port_probe("127.0.0.1", port)() is False
+
+
+@pytest.mark.parametrize("retval, ready", [
+    ("httpd RUNNING pid 10, uptime 0:00:01", True),
+    ("httpd FATAL Exited too quickly", False),
+])
+def test_oxauth_readiness(monkeypatch, docker_client, db, oxauth_node,
+                          master_provider, cluster, clock, retval, ready):
+    from gluuagent.executors import DockerExecResult
+    from gluuagent.executors import OxauthExecutor
+
+    monkeypatch.setattr(
+        "gluuagent.executors.run_docker_exec",
+        lambda client, node_id, cmd: DockerExecResult(cmd, 0, retval),
+    )
+    executor = OxauthExecutor(oxauth_node, master_provider, cluster,
+                              docker_client, db)
+    assert executor.wait_ready().ready is ready
+
+
+def test_oxauth_clean_restart(monkeypatch, docker_client, db, oxauth_node,
+                              master_provider, cluster, clock):
+    from gluuagent.executors import DockerExecResult
+    from gluuagent.executors import OxauthExecutor
+
+    commands = []
+
+    def run_docker_exec(client, node_id, cmd):
+        commands.append(cmd)
+        if any("supervisorctl restart" in command for command in commands):
+            return DockerExecResult(cmd, 0, "httpd RUNNING pid 10")
+        return DockerExecResult(cmd, 0, "httpd FATAL Exited too quickly")
+
+    monkeypatch.setattr("gluuagent.executors.run_docker_exec",
+                        run_docker_exec)
+    executor = OxauthExecutor(oxauth_node, master_provider, cluster,
+                              docker_client, db)
+    executor.clean_restart_httpd()
+    # readiness is checked again after httpd is restarted
+    assert executor.readiness.ready
+
+
+@pytest.fixture
+def shell_session(request):
+    from gluuagent.executors import ExecSession
+
+    # a local shell stands in for ``docker exec -i <container> sh``
+    session = ExecSession("random-id", argv=["sh"], timeout=5)
+    request.addfinalizer(session.close)
+    return session
+
+
+def test_exec_session(shell_session):
+    result = shell_session.run("echo foo; echo bar >&2")
+    assert result.exit_code == 0
+    assert result.retval == "foo\nbar"
+
+    pid = shell_session._proc.pid
+    assert shell_session.run("printf 'no newline'; exit 3") == (
+        "printf 'no newline'; exit 3", 3, "no newline")
+    # commands are run by the same shell
+    assert shell_session._proc.pid == pid
+
+
+def test_exec_session_timeout(shell_session):
+    shell_session.timeout = 0.2
+    assert shell_session.run("sleep 5").exit_code == -1
+    # a new shell is started for the next command
+    assert shell_session.run("true").exit_code == 0
+
+
+def test_exec_session_fallback(monkeypatch, docker_client, db, oxauth_node,
+                               master_provider, cluster):
+    from gluuagent.executors import DockerExecResult
+    from gluuagent.executors import ExecSession
+    from gluuagent.executors import OxauthExecutor
+
+    commands = []
+
+    def run_docker_exec(client, node_id, cmd):
+        commands.append(cmd)
+        return DockerExecResult(cmd, 0, "")
+
+    monkeypatch.setattr("gluuagent.executors.run_docker_exec",
+                        run_docker_exec)
+    executor = OxauthExecutor(oxauth_node, master_provider, cluster,
+                              docker_client, db)
+    executor.session = ExecSession(oxauth_node["id"],
+                                   argv=["/nonexistent/docker"])
+
+    assert executor.run_command("true").exit_code == 0
+    # a new shell is tried on the next command
+    assert executor.session is not None
+    assert executor.run_command("false").exit_code == 0
+    assert executor.session is None
+    assert commands == ['sh -c "true"', 'sh -c "false"']
+
+
+def test_exec_session_restart(monkeypatch, docker_client, db, oxauth_node,
+                              master_provider, cluster):
+    from gluuagent.executors import DockerExecResult
+    from gluuagent.executors import ExecSession
+    from gluuagent.executors import OxauthExecutor
+
+    commands = []
+
+    def run_docker_exec(client, node_id, cmd):
+        commands.append(cmd)
+        return DockerExecResult(cmd, 0, "")
+
+    monkeypatch.setattr("gluuagent.executors.run_docker_exec",
+                        run_docker_exec)
+    executor = OxauthExecutor(oxauth_node, master_provider, cluster,
+                              docker_client, db)
+    # shell exits before running the first command
+    executor.session = ExecSession(oxauth_node["id"],
+                                   argv=["sh", "-c", "exit 1"], timeout=5)
+
+    assert executor.run_command("true").exit_code == 0
+    assert commands == ['sh -c "true"']
+
+    executor.session.argv = ["sh"]
+    try:
+        assert executor.run_command("exit 3").exit_code == 3
+        assert executor.run_command("echo foo").retval == "foo"
+    finally:
+        executor.close()
+    # both commands were run by the restarted shell
+    assert commands == ['sh -c "true"']
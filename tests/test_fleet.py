@@ -0,0 +1,102 @@
+import json
+import os
+
+import pytest
+
+
+@pytest.fixture
+def fleet(tmpdir, monkeypatch):
+    from benchmarks.dbgen import generate_database
+    from benchmarks.fakes import FakeDockerEngine
+    from benchmarks.fakes import install_fake_commands
+    from benchmarks.recovery import PortListener
+    from gluuagent.executors import port_probe
+    from gluuagent.utils import get_local_hostnames
+
+    # fake commands are removed from environment after the test
+    for name in ("PATH", "GLUU_BENCH_CALLS", "GLUU_BENCH_DOCKER_LATENCY",
+                 "GLUU_BENCH_WEAVE_LATENCY"):
+        monkeypatch.setenv(name, os.environ.get(name, ""))
+    install_fake_commands(str(tmpdir), str(tmpdir.join("calls.log")))
+
+    database = str(tmpdir.join("db.json"))
+    data = generate_database(database, providers=4, nodes=2,
+                             hostname=get_local_hostnames()[0])
+
+    engines = {}
+    for num in (1, 2):
+        engine = FakeDockerEngine(
+            str(tmpdir.join("docker-{}.sock".format(num))))
+        engine.add_container("weave" * 12, "weave", running=True)
+        engine.add_container("prometheus" * 6, "prometheus", running=True)
+        engines["provider-{}".format(num)] = engine
+    for node in data["nodes"].values():
+        if node["provider_id"] in engines:
+            engines[node["provider_id"]].add_container(node["id"],
+                                                       node["name"])
+
+    # provider-3 is unreachable and provider-4 has no docker API
+    data["providers"]["2"]["docker_base_url"] = engines["provider-2"].base_url
+    data["providers"]["3"]["docker_base_url"] = "unix://" + str(
+        tmpdir.join("missing.sock"))
+    with open(database, "w") as fp:
+        json.dump(data, fp)
+
+    monkeypatch.setenv("DOCKER_HOST", engines["provider-1"].base_url)
+    # weave IP of ldap node is not routable here
+    listener = PortListener("127.0.0.1")
+    monkeypatch.setattr(
+        "gluuagent.executors.port_probe",
+        lambda host, port, timeout=1: port_probe("127.0.0.1", listener.port,
+                                                 timeout),
+    )
+    for engine in engines.values():
+        engine.start()
+    yield database, engines
+    for engine in engines.values():
+        engine.stop()
+    listener.stop()
+
+
+def test_fleet_recovery(fleet):
+    from gluuagent.database import Database
+    from gluuagent.fleet import FleetRecoveryTask
+
+    database, engines = fleet
+    task = FleetRecoveryTask(Database(database, snapshot=True), workers=4)
+    results = dict((result["provider"], result) for result in task.execute())
+
+    assert results["provider-1"]["status"] == "success"
+    assert results["provider-2"]["status"] == "success"
+    assert results["provider-3"]["status"] == "failure"
+    assert results["provider-4"]["status"] == "skipped"
+
+    # nodes of each provider are restarted through its own docker API
+    for engine in engines.values():
+        assert engine.calls["container_restart"] == 2
+        assert all(meta["Running"] for meta in engine.containers.values())
+
+
+def test_fleet_recovery_lock(tmpdir, fleet):
+    from gluuagent.database import Database
+    from gluuagent.fleet import FleetRecoveryTask
+    from gluuagent.lock import HostLock
+
+    database, _ = fleet
+    task = FleetRecoveryTask(Database(database, snapshot=True), workers=1)
+    task.lock = HostLock(str(tmpdir.join("agent.lock")))
+
+    holders = {}
+    run_task = task.run_task
+
+    def record_holder(provider_task, result):
+        holders[result["provider"]] = task.lock.holder()
+        run_task(provider_task, result)
+
+    task.run_task = record_holder
+    task.execute()
+
+    # only the recovery of local provider changes containers of this host
+    assert holders["provider-1"]["command"] == "recover-fleet"
+    assert holders["provider-2"] is None
+    assert task.lock.holder() is None
@@ -0,0 +1,151 @@
+import pytest
+
+
+def test_node_health_adaptive_interval():
+    from gluuagent.health import NodeHealth
+
+    health = NodeHealth(min_interval=5, max_interval=60)
+    intervals = []
+    for healthy in [True, True, True, True, True, False, True]:
+        health.record_probe(healthy, 0)
+        intervals.append(health.interval)
+    assert intervals == [10, 20, 40, 60, 60, 5, 10]
+    assert health.due(10) and not health.due(9)
+
+
+def test_node_health_restart_backoff():
+    from gluuagent.health import NodeHealth
+
+    health = NodeHealth(restart_backoff=30, max_restart_backoff=100,
+                        flap_threshold=3, flap_window=1000)
+    holds = []
+    for now in [0, 200, 400]:
+        assert not health.flapping(now)
+        health.record_restart(now)
+        holds.append(health.hold_until - now)
+    assert holds == [30, 60, 100]
+    assert health.flapping(500)
+
+    # restarts older than the window are forgotten
+    assert not health.flapping(1001)
+
+
+def test_cpu_budget():
+    from gluuagent.health import CpuBudget
+
+    clock = {"cpu": 0.0, "wall": 0.0}
+    budget = CpuBudget(0.05, clock=lambda: clock["cpu"],
+                       timer=lambda: clock["wall"])
+
+    # 0.1s of CPU time in 1s is twice the budget
+    clock.update(cpu=0.1, wall=1.0)
+    assert budget.delay() == pytest.approx(1.0)
+
+    # the pause is not counted twice
+    clock.update(cpu=0.1, wall=2.0)
+    assert budget.delay() == 0
+
+
+@pytest.fixture
+def health_task(db, monkeypatch):
+    from gluuagent.health import HealthTask
+
+    task = HealthTask(db, failure_threshold=3)
+    task.healed = []
+    monkeypatch.setattr(task, "heal",
+                        lambda node, provider, cluster:
+                        task.healed.append(node["id"]))
+    return task
+
+
+def test_health_restart_after_failures(health_task, master_provider,
+                                       cluster, oxauth_node):
+    health_task.probe_node = lambda node, provider, cluster: False
+
+    for _ in range(6):
+        health_task.check_node(oxauth_node, master_provider, cluster)
+    # restarted once after 3 failures, then backing off
+    assert health_task.healed == [oxauth_node["id"]]
+
+
+def test_health_flapping_node(health_task, master_provider, cluster,
+                              oxauth_node):
+    import time
+    from gluuagent.metrics import NODE_FLAPPING
+
+    health_task.probe_node = lambda node, provider, cluster: False
+    health = health_task.get_health(oxauth_node)
+    health.restarts.extend([time.time()] * health.flap_threshold)
+
+    for _ in range(3):
+        health_task.check_node(oxauth_node, master_provider, cluster)
+    assert health_task.healed == []
+    assert NODE_FLAPPING._values[(("node_id", oxauth_node["id"]),
+                                  ("node_type", "oxauth"))] == 1
+
+
+def test_health_check_due_nodes(health_task, master_provider, cluster):
+    probed = []
+
+    def probe_node(node, provider, cluster):
+        probed.append(node["id"])
+        return True
+
+    health_task.probe_node = probe_node
+    results = health_task.check(master_provider, cluster, now=0)
+    assert all(healthy for _, healthy in results)
+    assert sorted(probed) == [1, 2, 3, 4]
+
+    # healthy nodes are not probed again until their interval passes
+    assert health_task.check(master_provider, cluster, now=1) == []
+
+
+def test_health_restart_stopped_node(tmpdir, monkeypatch):
+    import os
+    from benchmarks.dbgen import generate_database
+    from benchmarks.fakes import FakeDockerEngine
+    from benchmarks.fakes import install_fake_commands
+    from benchmarks.recovery import PortListener
+    from gluuagent.database import Database
+    from gluuagent.executors import port_probe
+    from gluuagent.health import HealthTask
+    from gluuagent.utils import get_local_hostnames
+
+    for name in ("PATH", "GLUU_BENCH_CALLS", "GLUU_BENCH_DOCKER_LATENCY",
+                 "GLUU_BENCH_WEAVE_LATENCY"):
+        monkeypatch.setenv(name, os.environ.get(name, ""))
+    install_fake_commands(str(tmpdir), str(tmpdir.join("calls.log")))
+
+    database = str(tmpdir.join("db.json"))
+    data = generate_database(database, nodes=2,
+                             hostname=get_local_hostnames()[0])
+    # ldap container is running, but its service does not respond
+    engine = FakeDockerEngine(str(tmpdir.join("docker.sock")))
+    nodes = dict((node["type"], node) for node in data["nodes"].values())
+    engine.add_container(nodes["ldap"]["id"], running=True)
+    engine.add_container(nodes["oxauth"]["id"], running=True)
+    engine.start()
+    monkeypatch.setenv("DOCKER_HOST", engine.base_url)
+    # weave IP of ldap node is not routable here
+    listener = PortListener("127.0.0.1")
+    monkeypatch.setattr(
+        "gluuagent.executors.port_probe",
+        lambda host, port, timeout=1: port_probe("127.0.0.1", listener.port,
+                                                 timeout),
+    )
+
+    try:
+        db = Database(database, snapshot=True,
+                      hostnames=get_local_hostnames())
+        task = HealthTask(db, failure_threshold=1)
+        monkeypatch.setattr(task, "probe_node",
+                            lambda node, provider, cluster:
+                            node["type"] != "ldap")
+        task.check(task.get_provider(), task.get_cluster())
+        task.close()
+    finally:
+        listener.stop()
+        engine.stop()
+
+    assert engine.calls["container_stop"] == 1
+    assert engine.calls["container_restart"] == 1
@@ -0,0 +1,78 @@
+import json
+import logging
+
+import pytest
+
+
+IMAGE = "registry.gluu.org:5000/gluuoxauth"
+
+
+@pytest.fixture
+def pull_stream():
+    events = [
+        {"status": "Pulling from gluuoxauth", "id": "latest"},
+        {"status": "Already exists", "id": "aaa"},
+        {"status": "Downloading", "id": "bbb",
+         "progressDetail": {"current": 524288, "total": 2097152}},
+        {"status": "Downloading", "id": "bbb",
+         "progressDetail": {"current": 2097152, "total": 2097152}},
+        {"status": "Pull complete", "id": "bbb"},
+        {"status": "Digest: sha256:123"},
+        {"status": "Status: Downloaded newer image for " + IMAGE},
+    ]
+    return [json.dumps(event) + "\r\n" for event in events]
+
+
+def test_pull_progress(pull_stream):
+    from gluuagent.images import PullProgress
+
+    progress = PullProgress(IMAGE, logging.getLogger(__name__))
+    for line in pull_stream:
+        progress.update(json.loads(line))
+
+    assert progress.error is None
+    assert progress.status.startswith("Status: Downloaded newer image")
+    assert progress.summary() == (
+        IMAGE + ": 2/2 layers done, 2.0/2.0 MB downloaded"
+    )
+
+
+def test_local_digest():
+    from gluuagent.images import get_local_digest
+
+    class Client(object):
+        def inspect_image(self, image):
+            return {"RepoDigests": ["other@sha256:000",
+                                    IMAGE + "@sha256:123"]}
+
+    assert get_local_digest(Client(), IMAGE) == "sha256:123"
+
+
+@pytest.mark.parametrize("remote_digest, pulled", [
+    ("sha256:123", False),
+    ("sha256:456", True),
+])
+def test_update_image(monkeypatch, db, remote_digest, pulled):
+    from gluuagent.tasks import ImageUpdateTask
+
+    monkeypatch.setattr("gluuagent.tasks.get_local_digest",
+                        lambda client, image: "sha256:123")
+    monkeypatch.setattr("gluuagent.tasks.get_registry_digest",
+                        lambda image: remote_digest)
+
+    task = ImageUpdateTask(db)
+    monkeypatch.setattr(task, "pull_image", lambda image: True)
+    assert task.update_image("gluuoxauth") is pulled
+
+
+def test_pull_image_retry(monkeypatch, db, pull_stream):
+    from gluuagent.tasks import ImageUpdateTask
+
+    streams = iter([
+        ['{"errorDetail": {"message": "timeout"}, "error": "timeout"}'],
+        pull_stream,
+    ])
+    task = ImageUpdateTask(db)
+    monkeypatch.setattr(task.docker, "pull",
+                        lambda repository, stream: iter(next(streams)))
+    assert task.pull_image(IMAGE) is True
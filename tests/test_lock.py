@@ -0,0 +1,218 @@
+import pytest
+
+
+@pytest.fixture
+def lock_file(tmpdir):
+    return str(tmpdir.join("agent.lock"))
+
+
+def test_host_lock(lock_file):
+    from gluuagent.lock import HostLock
+
+    lock, other = HostLock(lock_file), HostLock(lock_file)
+    assert lock.acquire("recover")
+    assert not other.acquire("update-images")
+    assert other.holder()["command"] == "recover"
+
+    lock.release()
+    assert other.holder() is None
+    assert other.acquire("update-images")
+    other.release()
+
+
+def test_host_lock_renewed(lock_file):
+    import time
+    from gluuagent.lock import HostLock
+
+    lock = HostLock(lock_file, lease=0.3)
+    assert lock.acquire("recover")
+    time.sleep(0.6)
+    # lease is renewed while the lock is held
+    assert not HostLock(lock_file).acquire("recover")
+    lock.release()
+
+
+@pytest.mark.parametrize("dead_pid, expires_in", [
+    (True, 60),
+    # e.g. a hung process
+    (False, -1),
+])
+def test_host_lock_stale(lock_file, dead_pid, expires_in):
+    import json
+    import os
+    import subprocess
+    import time
+    from gluuagent.lock import HostLock
+
+    pid = os.getpid()
+    if dead_pid:
+        proc = subprocess.Popen(["true"])
+        proc.wait()
+        pid = proc.pid
+
+    with open(lock_file, "w") as fp:
+        json.dump({"holder": {"token": "abc", "pid": pid,
+                              "command": "recover", "followup": True,
+                              "acquired_at": 0,
+                              "expires_at": time.time() + expires_in}}, fp)
+
+    lock = HostLock(lock_file)
+    assert lock.acquire("recover")
+    lock.release()
+
+
+def test_host_lock_threads(lock_file):
+    import contextlib
+    import threading
+    import time
+    from gluuagent.lock import HostLock
+    from gluuagent.lock import run_exclusive
+
+    # e.g. workers of health supervisor sharing the lock
+    lock = HostLock(lock_file, lease=0.5)
+    state = lock._state
+
+    @contextlib.contextmanager
+    def slow_state():
+        with state() as data:
+            yield data
+        # give other threads a chance to run after the file is updated
+        time.sleep(0.05)
+
+    lock._state = slow_state
+    renewed = []
+
+    def worker():
+        for _ in range(3):
+            while not lock.acquire("health"):
+                time.sleep(0.01)
+            renewed.append(lock.renew())
+            lock.release()
+        for _ in range(3):
+            # the lock is released by ``finish``
+            run_exclusive(lock, "health",
+                          lambda: renewed.append(lock.renew()),
+                          followup=lambda: None, poll=0.01)
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert renewed == [True] * 18
+    assert lock.holder() is None
+
+
+def test_run_exclusive_coalesce(lock_file):
+    from gluuagent.lock import HostLock
+    from gluuagent.lock import run_exclusive
+
+    holder = HostLock(lock_file)
+    calls = []
+
+    def func():
+        # requests made by other processes while the holder runs
+        for _ in range(3):
+            assert run_exclusive(HostLock(lock_file), "recover",
+                                 lambda: calls.append("other"),
+                                 coalesce=True) is None
+        return "done"
+
+    result = run_exclusive(holder, "recover", func,
+                           followup=lambda: calls.append("followup"))
+    assert result == "done"
+    assert calls == ["followup"]
+    assert holder.holder() is None
+
+
+def test_run_exclusive_options(lock_file):
+    from gluuagent.lock import HostLock
+    from gluuagent.lock import LockError
+    from gluuagent.lock import run_exclusive
+
+    holder = HostLock(lock_file)
+    holder.acquire("recover", followup=True, options={"encrypted": True})
+    try:
+        # holder would relaunch weave with other settings
+        with pytest.raises(LockError):
+            run_exclusive(HostLock(lock_file), "recover", lambda: None,
+                          options={"encrypted": False}, coalesce=True,
+                          timeout=0)
+        assert holder.finish() is True
+    finally:
+        holder.release()
+
+
+def test_run_exclusive_failure(lock_file):
+    from gluuagent.lock import HostLock
+    from gluuagent.lock import run_exclusive
+
+    calls = []
+
+    def func():
+        assert run_exclusive(HostLock(lock_file), "recover",
+                             lambda: calls.append("other"),
+                             coalesce=True) is None
+        raise RuntimeError("docker is not running")
+
+    with pytest.raises(RuntimeError):
+        run_exclusive(HostLock(lock_file), "recover", func,
+                      followup=lambda: calls.append("followup"))
+
+    # request left by the failed run isn't served by the next holder
+    run_exclusive(HostLock(lock_file), "recover", lambda: None,
+                  followup=lambda: calls.append("followup"))
+    assert calls == []
+
+
+def test_run_exclusive_timeout(lock_file):
+    from gluuagent.lock import HostLock
+    from gluuagent.lock import LockError
+    from gluuagent.lock import run_exclusive
+
+    holder = HostLock(lock_file)
+    holder.acquire("update-images")
+    try:
+        # holder doesn't accept follow-up requests
+        with pytest.raises(LockError):
+            run_exclusive(HostLock(lock_file), "recover", lambda: None,
+                          coalesce=True, timeout=0)
+    finally:
+        holder.release()
+
+
+def test_coalescer():
+    import threading
+    import time
+    from gluuagent.lock import Coalescer
+
+    started = threading.Event()
+    proceed = threading.Event()
+    runs = []
+
+    def func():
+        runs.append(len(runs) + 1)
+        started.set()
+        proceed.wait()
+        return len(runs)
+
+    coalescer = Coalescer(func)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(coalescer()))]
+    threads[0].start()
+    started.wait()
+
+    # a burst of requests while the first run is in progress
+    for _ in range(5):
+        thread = threading.Thread(target=lambda: results.append(coalescer()))
+        thread.start()
+        threads.append(thread)
+    # let every request wait for the first run
+    time.sleep(0.2)
+    proceed.set()
+    for thread in threads:
+        thread.join()
+
+    assert runs == [1, 2]
+    assert sorted(results) == [1, 2, 2, 2, 2, 2]
@@ -0,0 +1,86 @@
+import pytest
+
+
+def test_counter_exposition():
+    from gluuagent.metrics import Counter
+
+    counter = Counter("restarts_total", "Restarts.", ["node_type"])
+    counter.inc(node_type="ldap")
+    counter.inc(2, node_type="ldap")
+    assert counter.exposition() == "\n".join([
+        "# HELP restarts_total Restarts.",
+        "# TYPE restarts_total counter",
+        'restarts_total{node_type="ldap"} 3.0',
+    ])
+
+
+def test_metric_requires_labels():
+    from gluuagent.metrics import Gauge
+
+    gauge = Gauge("running", "Running.", ["container"])
+    with pytest.raises(ValueError):
+        gauge.set(1)
+
+
+def test_histogram_samples():
+    from gluuagent.metrics import Histogram
+
+    histogram = Histogram("duration_seconds", "Duration.", ["phase"],
+                          buckets=[1, 5])
+    histogram.observe(0.5, phase="restart")
+    histogram.observe(3, phase="restart")
+
+    samples = list(histogram.samples())
+    key = (("phase", "restart"),)
+    assert samples == [
+        ("duration_seconds_bucket", key + (("le", "1.0"),), 1),
+        ("duration_seconds_bucket", key + (("le", "5.0"),), 2),
+        ("duration_seconds_bucket", key + (("le", "+Inf"),), 2),
+        ("duration_seconds_count", key, 2),
+        ("duration_seconds_sum", key, 3.5),
+    ]
+
+
+def test_timed_failure():
+    from gluuagent.metrics import PHASE_FAILURES
+    from gluuagent.metrics import timed
+
+    with pytest.raises(RuntimeError):
+        with timed("test", "ldap"):
+            raise RuntimeError()
+
+    samples = dict((labels, value) for _, labels, value
+                   in PHASE_FAILURES.samples())
+    assert samples[(("phase", "test"), ("node_type", "ldap"))] == 1
+
+
+def test_registry_textfile(tmpdir):
+    from gluuagent.metrics import Counter
+    from gluuagent.metrics import Registry
+
+    registry = Registry()
+    registry.register(Counter("runs_total", "Runs.")).inc()
+
+    path = str(tmpdir.join("gluuagent.prom"))
+    registry.write_textfile(path)
+    with open(path) as fp:
+        assert "runs_total 1.0" in fp.read()
+
+
+def test_registry_serve():
+    import urllib2
+    from gluuagent.metrics import Counter
+    from gluuagent.metrics import Registry
+
+    registry = Registry()
+    registry.register(Counter("runs_total", "Runs.")).inc()
+
+    server = registry.serve(0)
+    try:
+        resp = urllib2.urlopen("http://127.0.0.1:{}/metrics".format(
+            server.server_port,
+        ))
+        assert "runs_total 1.0" in resp.read()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,173 @@
+import pytest
+
+
+class FakeContainers(object):
+    def __init__(self, running):
+        self.states = running
+
+    def running(self, container):
+        return self.states[container]
+
+    def container_id(self, container):
+        return "c{}".format(container)
+
+    def started_at(self, container):
+        return "t1"
+
+
+@pytest.fixture
+def planner(master_provider, cluster):
+    from gluuagent.planner import Planner
+    from gluuagent.tasks import NODE_EXECUTORS
+    from gluuagent.weave import DnsReconciler
+
+    class Client(object):
+        def dns_entries(self):
+            # oxauth node has lost its DNS entry
+            return [{"ContainerID": "c1", "Address": "10.2.1.1",
+                     "Hostname": "1.ldap.gluu.local."},
+                    {"ContainerID": "c1", "Address": "10.2.1.1",
+                     "Hostname": "ldap.gluu.local."}]
+
+    containers = FakeContainers({"weave": True, "prometheus": True,
+                                 1: True, 2: True, 3: False})
+    cluster = dict(cluster, weave_ip_network="10.2.0.0/16")
+    dns = DnsReconciler(Client())
+    dns.load()
+    return Planner(master_provider, cluster, containers, dns,
+                   NODE_EXECUTORS)
+
+
+def get_nodes(*nodes):
+    from gluuagent.tasks import format_node
+    return [format_node(dict(node, weave_prefixlen=16)) for node in nodes]
+
+
+def test_plan_levels():
+    from gluuagent.planner import Plan
+
+    plan = Plan()
+    a = plan.add("restart", "a", cost=2)
+    b = plan.add("restart", "b", cost=1)
+    c = plan.add("attach", "a", depends=[a.id, b.id], cost=1)
+    plan.add("entrypoint", "a", depends=[c.id], cost=5)
+    plan.add("dns_add", "b", depends=[b.id], cost=1)
+
+    assert [[action.id for action in level]
+            for level in plan.levels()] == [[1, 2], [3, 5], [4]]
+    assert plan.total_cost == 10
+    # the longest chain is restart a, attach a, entrypoint a
+    assert plan.estimated_duration == 8
+
+
+def test_plan_nodes(planner, ldap_node, oxauth_node, oxtrust_node):
+    planner.plan_weave()
+    planner.plan_nodes(get_nodes(ldap_node, oxauth_node, oxtrust_node))
+    planner.plan_prometheus()
+
+    actions = [(action.kind, action.target, action.depends)
+               for action in planner.plan.actions]
+    assert actions == [
+        # running oxauth node only needs its missing DNS entry
+        ("dns_add", "c2", []),
+        ("restart", 3, [1]),
+        ("attach", 3, [2]),
+        ("dns_add", "c3", [3]),
+        ("entrypoint", 3, [2, 3, 4]),
+    ]
+    assert planner.plan.nodes == {3: planner.plan.nodes[3]}
+
+
+def test_plan_weave(planner):
+    planner.containers.states["weave"] = False
+    planner.containers.states["prometheus"] = False
+    planner.plan_weave()
+    planner.plan_prometheus()
+
+    data = planner.plan.to_dict()
+    assert [action["action"] for action in data["actions"]] == [
+        "launch_weave", "expose_weave", "restart", "attach",
+    ]
+    # attaching prometheus waits for weave router
+    assert data["actions"][3]["depends"] == [1, 2, 3]
+    assert data["actions"][3]["params"] == {"cidr": "10.2.255.253/16"}
+    assert data["provider"] == {"id": 1, "type": "master"}
+
+
+@pytest.mark.parametrize("container_id, started_at, restarted", [
+    ("abc", "t1", False),
+    ("abc", "t2", True),
+    # a new container isn't the one recovered before
+    ("def", "t2", False),
+])
+def test_restarted_externally(master_provider, cluster, oxauth_node,
+                              container_id, started_at, restarted):
+    from gluuagent.planner import Planner
+
+    class Containers(object):
+        def container_id(self, container):
+            return container_id
+
+        def started_at(self, container):
+            return started_at
+
+    known_nodes = {
+        str(oxauth_node["id"]): {"container": "abc", "started_at": "t1",
+                                 "fingerprint": "123"},
+    }
+    planner = Planner(master_provider, cluster, Containers(), None, {},
+                      known_nodes)
+    assert planner.restarted_externally(oxauth_node) is restarted
+
+
+def test_plan_address_conflict(planner, ldap_node, oxtrust_node):
+    # stopped oxtrust node claims the IP of ldap node
+    oxtrust_node = dict(oxtrust_node, weave_ip=ldap_node["weave_ip"])
+    nodes = get_nodes(ldap_node, oxtrust_node)
+    planner.index_nodes(nodes)
+    planner.plan_nodes(nodes)
+
+    actions = [(action.kind, action.target)
+               for action in planner.plan.actions]
+    assert ("attach", 3) not in actions
+    assert ("entrypoint", 3) in actions
+    # it's unknown which node owns the IP, so both are reported
+    assert planner.plan.to_dict()["errors"] == [{
+        "target": 1,
+        "node_type": "ldap",
+        "error": "10.2.1.1 is also taken by 3",
+    }, {
+        "target": 3,
+        "node_type": "oxtrust",
+        "error": "10.2.1.1 is already taken by 1",
+    }]
+
+
+def test_plan_address_prefixlen(planner, oxauth_node):
+    # running oxauth node has lost its DNS entry, but its address
+    # doesn't belong to weave network
+    node = dict(get_nodes(oxauth_node)[0], weave_prefixlen=24)
+    planner.plan_nodes([node])
+
+    assert planner.plan.actions == []
+    assert planner.plan.errors == [{
+        "target": 2,
+        "node_type": "oxauth",
+        "error": "prefix length 24 of {} doesn't match weave network "
+                 "10.2.0.0/16".format(oxauth_node["weave_ip"]),
+    }]
+
+
+def test_resolve_nodes(ldap_node, oxauth_node, oxtrust_node, httpd_node):
+    from gluuagent.planner import resolve_nodes
+
+    nodes = get_nodes(ldap_node, oxauth_node, oxtrust_node)
+    # oxauth depends on ldap, but not on oxtrust
+    assert [node["id"] for node in resolve_nodes(nodes, [2])] == [1, 2]
+    assert [node["id"] for node in resolve_nodes(
+        nodes, node_types=["ldap"])] == [1]
+    assert resolve_nodes(nodes, ["unknown"]) == []
+
+    # node without recovery priority belongs to the first tier
+    nodes = get_nodes(ldap_node, httpd_node)
+    assert [node["id"] for node in resolve_nodes(nodes, [1])] == [1, 4]
@@ -0,0 +1,70 @@
+import pytest
+
+
+@pytest.fixture
+def rpc_server(tmpdir, request):
+    import threading
+    from gluuagent.rpc import RpcServer
+
+    def fail():
+        raise ValueError("boom")
+
+    handlers = {"echo": lambda **params: params, "fail": fail}
+    server = RpcServer(str(tmpdir.join("agent.sock")), handlers)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    def teardown():
+        server.shutdown()
+        server.server_close()
+
+    request.addfinalizer(teardown)
+    return server
+
+
+def test_rpc_call(rpc_server):
+    import os
+    import stat
+    from gluuagent.rpc import call
+
+    assert call(rpc_server.path, "echo", node_id="abc") == {"node_id": "abc"}
+    # only the owner may send commands
+    assert stat.S_IMODE(os.stat(rpc_server.path).st_mode) == 0o600
+
+
+@pytest.mark.parametrize("command, error", [
+    ("fail", "boom"),
+    ("unknown", "unknown command u'unknown'"),
+])
+def test_rpc_call_error(rpc_server, command, error):
+    from gluuagent.rpc import RpcError
+    from gluuagent.rpc import call
+
+    with pytest.raises(RpcError) as exc:
+        call(rpc_server.path, command)
+    assert str(exc.value) == error
+
+
+def test_rpc_agent_not_running(tmpdir):
+    from gluuagent.rpc import RpcError
+    from gluuagent.rpc import call
+
+    with pytest.raises(RpcError):
+        call(str(tmpdir.join("agent.sock")), "status")
+
+
+def test_rpc_stale_socket(tmpdir, rpc_server):
+    import socket
+    from gluuagent.rpc import RpcError
+    from gluuagent.rpc import RpcServer
+
+    # socket file of a dead agent is replaced
+    path = str(tmpdir.join("stale.sock"))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.close()
+    RpcServer(path, {}).server_close()
+
+    with pytest.raises(RpcError):
+        RpcServer(rpc_server.path, {})
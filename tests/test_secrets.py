@@ -0,0 +1,75 @@
+import pytest
+
+KEY = "123456789012345678901234"
+
+ENC_TEXT = "im6yqa0BROeTNcwvx4XCaw=="
+
+
+def test_triple_des_decrypt():
+    import base64
+    from gluuagent.des import triple_des_decrypt
+
+    assert triple_des_decrypt(base64.b64decode(ENC_TEXT), KEY) == "password"
+
+
+def test_des_block():
+    # known answer of single DES
+    from gluuagent.des import des_block
+    from gluuagent.des import get_subkeys
+
+    subkeys = get_subkeys("133457799BBCDFF1".decode("hex"))
+    assert des_block(0x0123456789ABCDEF, subkeys) == 0x85E813540F0AB405
+    assert des_block(0x85E813540F0AB405, subkeys[::-1]) == 0x0123456789ABCDEF
+
+
+@pytest.mark.parametrize("text", ["", "secret", "12345678", "a" * 20])
+def test_triple_des_roundtrip(text):
+    from gluuagent.des import triple_des_decrypt
+    from gluuagent.des import triple_des_encrypt
+
+    assert triple_des_decrypt(triple_des_encrypt(text, KEY), KEY) == text
+
+
+def test_triple_des_bad_key():
+    from gluuagent.des import DESError
+    from gluuagent.des import triple_des_decrypt
+    from gluuagent.des import triple_des_encrypt
+
+    with pytest.raises(DESError):
+        triple_des_decrypt("12345678", "short")
+
+    encrypted = triple_des_encrypt("password", KEY)
+    with pytest.raises(DESError):
+        triple_des_decrypt(encrypted, "x" * 24)
+
+
+def test_secret_cache():
+    from gluuagent.des import triple_des_decrypt
+    from gluuagent.secrets import SecretCache
+
+    calls = []
+
+    def decrypt(encrypted_text, key):
+        import base64
+        calls.append(encrypted_text)
+        return triple_des_decrypt(base64.b64decode(encrypted_text), key)
+
+    cache = SecretCache(decrypt=decrypt)
+    cluster = {"admin_pw": ENC_TEXT, "passkey": KEY}
+    assert cache.admin_password(cluster) == "password"
+    assert cache.admin_password(cluster) == "password"
+    assert calls == [ENC_TEXT]
+
+    cache.clear()
+    assert cache.admin_password(cluster) == "password"
+    assert len(calls) == 2
+
+
+def test_secret_cache_expired():
+    from gluuagent.secrets import SecretCache
+
+    calls = []
+    cache = SecretCache(ttl=0, decrypt=lambda text, key: calls.append(text))
+    cache.get(ENC_TEXT, KEY)
+    cache.get(ENC_TEXT, KEY)
+    assert len(calls) == 2
@@ -0,0 +1,63 @@
+import pytest
+
+
+@pytest.fixture
+def service(tmpdir):
+    from benchmarks.dbgen import generate_database
+    from gluuagent.database import Database
+    from gluuagent.service import AgentService
+    from gluuagent.utils import get_local_hostnames
+
+    database = str(tmpdir.join("db.json"))
+    data = generate_database(database, providers=2, nodes=2,
+                             hostname=get_local_hostnames()[0])
+    db = Database(database, snapshot=True)
+    service = AgentService(db)
+    service.data = data
+    return service
+
+
+def test_service_recover_node(service, monkeypatch):
+    recovered = []
+
+    def recover_node(node, provider, cluster):
+        recovered.append((node["id"], provider["id"]))
+
+    monkeypatch.setattr(service.task, "recover_node", recover_node)
+    node = service.data["nodes"]["1"]
+    result = service.recover_node(node["id"])
+
+    assert recovered == [(node["id"], "provider-1")]
+    assert result == {"node": node["id"], "type": "ldap",
+                      "restarted": False}
+    assert service.last_run["outcome"] == "success"
+
+    # node of another provider is not recovered
+    with pytest.raises(ValueError):
+        service.recover_node(service.data["nodes"]["3"]["id"])
+    assert service.last_run["outcome"] == "failure"
+    assert service.status()["requests"] == {"recover-node": 2}
+
+
+def test_service_provider_cached(service, monkeypatch):
+    import os
+    import time
+
+    lookups = []
+    search = service.db.search_from_table
+
+    def search_from_table(table_name, condition):
+        lookups.append(table_name)
+        return search(table_name, condition)
+
+    monkeypatch.setattr(service.db, "search_from_table", search_from_table)
+    assert service.status()["provider"] == {"id": "provider-1",
+                                            "type": "master"}
+    service.status()
+    assert lookups == ["providers"]
+
+    # provider is looked up again once database file is changed
+    later = time.time() + 10
+    os.utime(service.db.database_uri, (later, later))
+    service.status()
+    assert lookups == ["providers", "providers"]
@@ -0,0 +1,33 @@
+def test_state_store(tmpdir):
+    from gluuagent.state import StateStore
+
+    store = StateStore(str(tmpdir.join("agent", "state.json")))
+    assert store.load() == {"weave": None, "nodes": {}}
+
+    nodes = {"1": {"container": "abc", "started_at": "now",
+                   "fingerprint": "123"}}
+    store.save("456", nodes)
+    assert store.load() == {"weave": "456", "nodes": nodes}
+    # no temporary files are left
+    assert tmpdir.join("agent").listdir() == [tmpdir.join("agent",
+                                                          "state.json")]
+
+    store.clear()
+    assert store.load() == {"weave": None, "nodes": {}}
+
+
+def test_state_store_corrupted(tmpdir):
+    from gluuagent.state import StateStore
+
+    path = tmpdir.join("state.json")
+    path.write("{")
+    assert StateStore(str(path)).load() == {"weave": None, "nodes": {}}
+
+
+def test_fingerprint():
+    from gluuagent.state import fingerprint
+
+    assert fingerprint("abc", ["a.gluu.local"]) == \
+        fingerprint("abc", ["a.gluu.local"])
+    assert fingerprint("abc", ["a.gluu.local"]) != \
+        fingerprint("abc", ["b.gluu.local"])
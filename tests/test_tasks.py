@@ -0,0 +1,263 @@
+import pytest
+
+
+def test_get_recovery_tiers():
+    from gluuagent.tasks import format_node
+    from gluuagent.tasks import get_recovery_tiers
+
+    nodes = [
+        format_node({"id": "a", "type": "oxtrust"}),
+        format_node({"id": "b", "type": "oxauth"}),
+        format_node({"id": "c", "type": "ldap"}),
+        format_node({"id": "d", "type": "oxauth"}),
+    ]
+    tiers = get_recovery_tiers(nodes)
+    assert [[node["id"] for node in tier] for tier in tiers] == [
+        ["c"], ["b", "d"], ["a"],
+    ]
+
+
+def test_watch_handle_event(monkeypatch, db, master_provider, cluster,
+                            oxauth_node):
+    from gluuagent.tasks import WatchTask
+
+    clock = {"now": 100.5}
+    monkeypatch.setattr("time.time", lambda: clock["now"])
+
+    task = WatchTask(db)
+    recovered = []
+
+    def recover_nodes(nodes, provider, cluster):
+        recovered.extend(nodes)
+        clock["now"] += 5
+        return {}
+
+    monkeypatch.setattr(
+        task, "find_nodes",
+        lambda container_ids, provider: dict(
+            (container_id, oxauth_node) for container_id in container_ids),
+    )
+    monkeypatch.setattr(task, "recover_nodes", recover_nodes)
+
+    def handle_event(event):
+        task.handle_event(event)
+        task.recover_pending(master_provider, cluster)
+
+    handle_event({"status": "start", "id": "abc"})
+    handle_event({"status": "stop", "id": "abc", "time": 100})
+    assert recovered == []
+
+    handle_event({"status": "oom", "id": "abc", "time": 100})
+    assert recovered == [oxauth_node]
+
+    # OOM kill is reported as ``die`` as well
+    handle_event({"status": "die", "id": "abc", "time": 100})
+    assert recovered == [oxauth_node]
+
+    # recovered node dies again, within the window
+    handle_event({"status": "die", "id": "abc", "timeNano": 106 * 10 ** 9})
+    assert recovered == [oxauth_node, oxauth_node]
+    assert task.recovered_at == {"abc": 105.5}
+
+    # only recent recoveries are kept
+    clock["now"] = 200
+    handle_event({"status": "die", "id": "def", "time": 200})
+    assert task.recovered_at == {"def": 200}
+
+
+def test_watch_recover_pending(monkeypatch, db, master_provider, cluster,
+                               ldap_node, oxauth_node, oxtrust_node):
+    from gluuagent.tasks import WatchTask
+
+    task = WatchTask(db)
+    nodes = {"c1": ldap_node, "c2": oxauth_node, "c3": oxtrust_node}
+    monkeypatch.setattr(
+        task, "find_nodes",
+        lambda container_ids, provider: dict(
+            (container_id, nodes[container_id])
+            for container_id in container_ids if container_id in nodes),
+    )
+    batches = []
+    monkeypatch.setattr(
+        task, "exclusive",
+        lambda command, func, nodes, provider, cluster, **kwargs:
+            batches.append(sorted(node["id"] for node in nodes)),
+    )
+
+    # containers died while the lock is held by another process
+    for container_id in ("c1", "c2", "c3", "c2", "weave"):
+        task.handle_event({"status": "die", "id": container_id})
+    task.recover_pending(master_provider, cluster)
+
+    assert batches == [[1, 2, 3]]
+    assert task.pending == {}
+    # recovery has been left to the holder of the lock
+    assert task.recovered_at == {}
+
+
+class FakeExecutor(object):
+    def __init__(self, ready):
+        self.readiness = None
+        self.ready = ready
+
+    def wait_ready(self):
+        from gluuagent.executors import ReadinessResult
+        self.readiness = ReadinessResult(self.ready, 0, 1)
+        return self.readiness
+
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize("ready, recovered", [
+    (True, [1, 2]),
+    (False, [1]),
+])
+def test_rolling_update(monkeypatch, db, ready, recovered):
+    from gluuagent.tasks import ImageUpdateTask
+
+    monkeypatch.setattr(
+        "gluuagent.tasks.BaseTask.get_provider",
+        lambda self: db.get(1, "providers"),
+    )
+    # oxtrust node (id 3) is already running the latest image
+    monkeypatch.setattr(
+        "docker.Client.inspect_container",
+        lambda cls, container: {
+            "Image": "gluuoxtrust" if container == 3 else "old",
+        },
+    )
+    stopped = []
+    monkeypatch.setattr("docker.Client.stop",
+                        lambda cls, container: stopped.append(container))
+
+    recovered_nodes = []
+
+    def recover_node(self, node, provider, cluster):
+        recovered_nodes.append(node["id"])
+        return FakeExecutor(ready)
+
+    monkeypatch.setattr("gluuagent.tasks.RecoveryTask.recover_node",
+                        recover_node)
+
+    task = ImageUpdateTask(db, rolling=True)
+    task.rolling_update({"gluuopendj": "gluuopendj",
+                         "gluuoxauth": "gluuoxauth",
+                         "gluuoxtrust": "gluuoxtrust"})
+    assert stopped == recovered_nodes == recovered
+
+
+@pytest.mark.parametrize("pulled, image_ids, restarted", [
+    # nothing is pulled, e.g. the update has been done already
+    (False, {}, []),
+    # local oxauth image is pulled again without changes
+    (True, {}, []),
+    (True, {"gluuoxauth": "new"}, [2]),
+])
+def test_rolling_update_pulled(monkeypatch, db, pulled, image_ids,
+                               restarted):
+    from gluuagent.tasks import ImageUpdateTask
+
+    monkeypatch.setattr(
+        "gluuagent.tasks.BaseTask.get_provider",
+        lambda self: db.get(1, "providers"),
+    )
+    # nodes are still running the image they were created from
+    monkeypatch.setattr("docker.Client.inspect_container",
+                        lambda cls, container: {"Image": "old"})
+    stopped = []
+    monkeypatch.setattr("docker.Client.stop",
+                        lambda cls, container: stopped.append(container))
+    monkeypatch.setattr("gluuagent.tasks.RecoveryTask.recover_node",
+                        lambda self, node, provider, cluster: None)
+
+    task = ImageUpdateTask(db, rolling=True)
+    local_ids = {"gluuopendj": "old", "gluuoxauth": "old",
+                 "gluuoxtrust": "old"}
+
+    def update_image(image):
+        local_ids.update((name, image_id) for name, image_id
+                         in image_ids.items() if name == image)
+        return pulled and image == "gluuoxauth"
+
+    monkeypatch.setattr(task, "get_image_ids", lambda: dict(local_ids))
+    monkeypatch.setattr(task, "update_image", update_image)
+    task.execute()
+
+    assert stopped == restarted
+
+
+def test_image_update_lock(tmpdir, monkeypatch, db):
+    from gluuagent.lock import HostLock
+    from gluuagent.tasks import ImageUpdateTask
+    from gluuagent.tasks import RecoveryTask
+
+    recovery_task = RecoveryTask(db)
+    recovery_task.lock = HostLock(str(tmpdir.join("agent.lock")))
+    task = ImageUpdateTask(db, recovery_task=recovery_task)
+    monkeypatch.setattr(task, "get_image_ids", lambda: {})
+
+    holders = []
+    monkeypatch.setattr(
+        task, "update_image",
+        lambda image: holders.append(recovery_task.lock.holder()) or True,
+    )
+    monkeypatch.setattr(
+        task, "reprovision",
+        lambda: holders.append(recovery_task.lock.holder()),
+    )
+    task.execute()
+
+    # other processes aren't blocked while images are pulled
+    assert holders[:-1] == [None] * len(task.images)
+    assert holders[-1]["command"] == "update-images"
+    assert holders[-1]["options"] == recovery_task.options
+
+
+def test_recovery_state_skips_failed_nodes(tmpdir, db, master_provider,
+                                           cluster, ldap_node, oxauth_node,
+                                           oxtrust_node):
+    from gluuagent.planner import Plan
+    from gluuagent.tasks import RecoveryTask
+
+    task = RecoveryTask(db, state_file=str(tmpdir.join("state.json")))
+    plan = Plan(master_provider, cluster)
+    # oxtrust node has a conflicting weave IP
+    plan.errors.append({"target": oxtrust_node["id"], "node_type": "oxtrust",
+                        "error": "10.2.1.1 is already taken by 1"})
+    not_ready = FakeExecutor(False)
+    not_ready.wait_ready()
+
+    saved = []
+    task.get_plan = lambda node_ids, node_types: plan
+    task.run_plan = lambda plan: {oxauth_node["id"]: not_ready}
+    task.get_nodes = lambda provider: [ldap_node, oxauth_node, oxtrust_node]
+    task.save_state = lambda nodes, cluster: saved.extend(
+        node["id"] for node in nodes)
+
+    task.execute()
+    assert saved == [ldap_node["id"]]
+
+
+def test_recovery_full(tmpdir, db, master_provider, cluster):
+    import json
+    from gluuagent.planner import Plan
+    from gluuagent.tasks import RecoveryTask
+
+    state_file = tmpdir.join("state.json")
+    state_file.write(json.dumps({"weave": "fingerprint", "nodes": {}}))
+    task = RecoveryTask(db, state_file=str(state_file))
+
+    states = []
+
+    def get_plan(node_ids, node_types):
+        states.append(task.state.load())
+        return Plan(master_provider, cluster)
+
+    task.get_plan = get_plan
+    task.run_plan = lambda plan: {}
+    task.get_nodes = lambda provider: []
+    task.save_state = lambda nodes, cluster: None
+
+    task.execute(full=True)
+    assert states == [{"weave": None, "nodes": {}}]
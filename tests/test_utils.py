@@ -18,15 +18,39 @@ def test_decrypt_text():
     assert decrypt_text(enc_text, key) == "password"
 
 
-def test_get_exposed_cidr():
-    from gluuagent.utils import get_exposed_cidr
+def test_run_concurrently():
+    from gluuagent.utils import run_concurrently
+    assert run_concurrently(lambda x: x * 2, [1, 2, 3], 2) == [2, 4, 6]
 
-    ipnet = "10.1.1.0/24"
-    assert get_exposed_cidr(ipnet) == ("10.1.1.254", 24)
 
+def test_run_concurrently_error():
+    from gluuagent.utils import run_concurrently
 
-def test_get_prometheus_cidr():
-    from gluuagent.utils import get_prometheus_cidr
+    calls = []
 
-    ipnet = "10.1.1.0/24"
-    assert get_prometheus_cidr(ipnet) == ("10.1.1.253", 24)
+    def func(x):
+        calls.append(x)
+        if x == 1:
+            raise ValueError(x)
+        return x
+
+    with pytest.raises(ValueError):
+        run_concurrently(func, [1, 2, 3], 3)
+    assert sorted(calls) == [1, 2, 3]
+
+
+def test_get_logger_json(tmpdir):
+    import json
+    import logging
+    from gluuagent.utils import get_logger
+
+    logfile = str(tmpdir.join("gluuagent.log"))
+    logger = get_logger(logfile, name="gluuagent.tests.json",
+                        json_format=True)
+    logger.info("recovering")
+    for handler in logger.handlers:
+        handler.close()
+
+    with open(logfile) as fp:
+        assert json.loads(fp.readline())["message"] == "recovering"
+    assert logger.level == logging.DEBUG
@@ -0,0 +1,203 @@
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def weave_router(request):
+    import BaseHTTPServer
+
+    requests = []
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _handle(self):
+            length = int(self.headers.getheader("Content-Length") or 0)
+            requests.append((self.command, self.path, self.rfile.read(length)))
+            status = 404 if "unknown" in self.path else 204
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        do_PUT = do_DELETE = do_GET = _handle
+
+        def log_message(self, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={"poll_interval": 0.05})
+    thread.daemon = True
+    thread.start()
+
+    def teardown():
+        server.shutdown()
+        server.server_close()
+
+    request.addfinalizer(teardown)
+    server.requests = requests
+    return server
+
+
+def test_weave_client_dns(weave_router):
+    from gluuagent.weave import WeaveClient
+
+    client = WeaveClient(port=weave_router.server_port)
+    client.dns_add("abc", "10.2.1.1", "ldap.gluu.local")
+    client.dns_remove("abc", "10.2.1.1", "ldap.gluu.local")
+    client.close()
+
+    assert weave_router.requests == [
+        ("PUT", "/name/abc/10.2.1.1", "fqdn=ldap.gluu.local"),
+        ("DELETE", "/name/abc/10.2.1.1?fqdn=ldap.gluu.local", ""),
+    ]
+
+
+def test_weave_client_error(weave_router):
+    from gluuagent.weave import WeaveClient
+    from gluuagent.weave import WeaveError
+
+    client = WeaveClient(port=weave_router.server_port)
+    with pytest.raises(WeaveError):
+        client.dns_add("unknown", "10.2.1.1", "ldap.gluu.local")
+
+
+def test_weave_batch_flush(monkeypatch, weave_router):
+    from gluuagent.weave import WeaveBatch
+    from gluuagent.weave import WeaveClient
+
+    calls = []
+    monkeypatch.setattr("gluuagent.weave.weave_cli",
+                        lambda *args, **kwargs: calls.append(args))
+
+    batch = WeaveBatch(WeaveClient(port=weave_router.server_port))
+    batch.attach("10.2.1.1/24", "abc")
+    batch.dns_add("abc", "10.2.1.1", "abc.ldap.gluu.local")
+    batch.dns_add("abc", "10.2.1.1", "ldap.gluu.local")
+    batch.dns_add("def", None, "def.oxauth.gluu.local")
+    batch.flush()
+
+    assert calls == [
+        ("attach", "10.2.1.1/24", "abc"),
+        ("dns-add", "def", "-h", "def.oxauth.gluu.local"),
+    ]
+    assert len(weave_router.requests) == 2
+
+    # queue is emptied after flush
+    batch.flush()
+    assert len(calls) == 2
+
+
+def test_weave_batch_fallback(monkeypatch):
+    from gluuagent.weave import WeaveBatch
+    from gluuagent.weave import WeaveClient
+
+    calls = []
+    monkeypatch.setattr("gluuagent.weave.weave_cli",
+                        lambda *args, **kwargs: calls.append(args))
+
+    # nothing is listening on this port
+    batch = WeaveBatch(WeaveClient(port=1))
+    batch.dns_add("abc", "10.2.1.1", "ldap.gluu.local")
+    batch.flush()
+    assert calls == [("dns-add", "10.2.1.1", "abc", "-h", "ldap.gluu.local")]
+
+
+def test_weave_batch_remote(monkeypatch, weave_router):
+    from gluuagent.weave import WeaveBatch
+    from gluuagent.weave import WeaveClient
+
+    calls = []
+    monkeypatch.setattr("gluuagent.weave.weave_cli",
+                        lambda *args, **kwargs: calls.append((args, kwargs)))
+
+    # local router's API must not be used for another host
+    env = {"DOCKER_HOST": "tcp://10.0.0.2:2375"}
+    batch = WeaveBatch(WeaveClient(port=weave_router.server_port), env=env)
+    batch.dns_add("abc", "10.2.1.1", "ldap.gluu.local")
+    batch.flush()
+    assert calls == [
+        (("dns-add", "10.2.1.1", "abc", "-h", "ldap.gluu.local"),
+         {"env": env}),
+    ]
+    assert weave_router.requests == []
+
+
+class FakeBatch(object):
+    def __init__(self):
+        self.added = []
+        self.removed = []
+
+    def dns_add(self, *record, **kwargs):
+        self.added.append(record)
+
+    def dns_remove(self, *record, **kwargs):
+        self.removed.append(record)
+
+
+class FakeClient(object):
+    def __init__(self, entries):
+        self.entries = entries
+
+    def dns_entries(self):
+        return self.entries
+
+
+@pytest.fixture
+def dns_entries():
+    return [
+        {"ContainerID": "abc", "Address": "10.2.1.1",
+         "Hostname": "abc.ldap.gluu.local."},
+        {"ContainerID": "abc", "Address": "10.2.1.1",
+         "Hostname": "ldap.gluu.local."},
+        {"ContainerID": "def", "Address": "10.2.1.2",
+         "Hostname": "old.example.com."},
+        {"ContainerID": "xyz", "Address": "10.2.1.9",
+         "Hostname": "remote.gluu.local."},
+    ]
+
+
+def test_dns_reconciler_steady_state(dns_entries):
+    from gluuagent.weave import DnsReconciler
+
+    dns = DnsReconciler(FakeClient(dns_entries))
+    dns.load()
+    batch = FakeBatch()
+    dns.reconcile([("abc", "10.2.1.1", "abc.ldap.gluu.local"),
+                   ("abc", "10.2.1.1", "ldap.gluu.local")], batch)
+    dns.reconcile([("abc", None, "abc.ldap.gluu.local"),
+                   ("abc", None, "ldap.gluu.local")], batch)
+    assert batch.added == []
+    assert batch.removed == []
+
+
+def test_dns_reconciler_diff(dns_entries):
+    from gluuagent.weave import DnsReconciler
+
+    dns = DnsReconciler(FakeClient(dns_entries))
+    dns.load()
+    batch = FakeBatch()
+    dns.reconcile([("def", "10.2.1.2", "def.nginx.gluu.local"),
+                   ("def", "10.2.1.2", "new.example.com")], batch)
+
+    assert batch.added == [("def", "10.2.1.2", "def.nginx.gluu.local"),
+                           ("def", "10.2.1.2", "new.example.com")]
+    # records of other containers are left untouched
+    assert batch.removed == [("def", "10.2.1.2", "old.example.com")]
+
+    # known records are updated after reconciliation
+    batch = FakeBatch()
+    dns.reconcile([("def", "10.2.1.2", "new.example.com")], batch)
+    assert batch.added == []
+
+
+def test_dns_reconciler_forget(dns_entries):
+    from gluuagent.weave import DnsReconciler
+
+    dns = DnsReconciler(FakeClient(dns_entries))
+    dns.load()
+    dns.forget("abc")
+    batch = FakeBatch()
+    dns.reconcile([("abc", "10.2.1.1", "ldap.gluu.local")], batch)
+    assert batch.added == [("abc", "10.2.1.1", "ldap.gluu.local")]